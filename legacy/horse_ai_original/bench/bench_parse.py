@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+保存済みHTML（bench/fixtures）を各スパイダーの parse に直接通して、抽出処理の速さを測ります。
+ネットワークは一切使いません。
+
+  - pages/sec, items/sec : 各ケースを --repeat 回まわした実測
+  - peak_kib             : tracemalloc で測った1ページ処理中のピークメモリ
+  - baselines.json       : --save-baseline で保存。以後の実行は基準比（x1.00 が同等）を表示
+
+fixtures は netkeiba のページ構造（表の summary / class / 列順）を再現した縮小版です。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJ_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+FIXTURE_DIR = os.path.join(SCRIPT_DIR, "fixtures")
+DEFAULT_BASELINE = os.path.join(SCRIPT_DIR, "baselines.json")
+
+# scrapy プロジェクト（horse_ai_scrapy パッケージ）を import できるようにする
+sys.path.insert(0, os.path.join(PROJ_ROOT, "horse_ai_scrapy"))
+
+from itemadapter import is_item  # noqa: E402
+from scrapy.utils.misc import load_object  # noqa: E402
+
+from horse_ai_scrapy.replay import REPLAY_SPECS, build_response  # noqa: E402
+
+# (ケース名, spider名, fixture, エンティティID, URL)
+CASES = [
+    ("race_result_old", "race_result_spider", "race_result_201208040611.html", "201208040611",
+     "https://db.netkeiba.com/race/201208040611/"),
+    ("race_result_new", "race_result_spider", "race_result_202505020607.html", "202505020607",
+     "https://db.netkeiba.com/race/202505020607/"),
+    ("shutuba", "race_info_spider", "shutuba_202505020607.html", "202505020607",
+     "https://race.netkeiba.com/race/shutuba.html?race_id=202505020607&rf=race_submenu"),
+    ("horse_profile", "horse_info_spider", "horse_2009102739.html", "2009102739",
+     "https://db.netkeiba.com/horse/2009102739/"),
+]
+
+
+def _run_once(callback, spider_name, entity_id, url, body) -> int:
+    response = build_response(spider_name, entity_id, url, body, "utf-8")
+    return sum(1 for out in callback(response, **response.request.cb_kwargs) if is_item(out))
+
+
+def bench_case(spider_name: str, fixture: str, entity_id: str, url: str, repeat: int) -> dict:
+    with open(os.path.join(FIXTURE_DIR, fixture), "rb") as f:
+        body = f.read()
+
+    spidercls_path, callback_name, _, _ = REPLAY_SPECS[spider_name]
+    spider = load_object(spidercls_path)()
+    callback = getattr(spider, callback_name)
+
+    # ウォームアップ（XPath のコンパイル等）
+    _run_once(callback, spider_name, entity_id, url, body)
+
+    items = 0
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        items += _run_once(callback, spider_name, entity_id, url, body)
+    elapsed = time.perf_counter() - t0
+
+    # ピークメモリは計測オーバーヘッドが大きいので別パス
+    tracemalloc.start()
+    _run_once(callback, spider_name, entity_id, url, body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "pages_per_sec": round(repeat / elapsed, 1),
+        "items_per_sec": round(items / elapsed, 1),
+        "items_per_page": items // repeat,
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="保存済みHTMLで parse の速度を測ります（オフライン）。")
+    ap.add_argument("--repeat", type=int, default=200, help="1ケースあたりの処理回数")
+    ap.add_argument("--case", action="append", help="対象ケース名（複数可、既定: 全部）")
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE, help=f"基準値ファイル（既定: {DEFAULT_BASELINE}）")
+    ap.add_argument("--save-baseline", action="store_true", help="今回の結果を基準値として保存")
+    ap.add_argument("--fail-under", type=float, default=None,
+                    help="pages/sec が基準比この値を下回ったら終了コード1（例: 0.8）")
+    args = ap.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressed = []
+    print(f"{'case':<18}{'pages/s':>10}{'items/s':>11}{'items/pg':>10}{'peak KiB':>10}{'vs base':>10}")
+    for name, spider_name, fixture, entity_id, url in CASES:
+        if args.case and name not in args.case:
+            continue
+        r = bench_case(spider_name, fixture, entity_id, url, args.repeat)
+        results[name] = r
+        ratio = ""
+        if name in baseline and baseline[name].get("pages_per_sec"):
+            x = r["pages_per_sec"] / baseline[name]["pages_per_sec"]
+            ratio = f"x{x:.2f}"
+            if args.fail_under is not None and x < args.fail_under:
+                regressed.append(name)
+        print(f"{name:<18}{r['pages_per_sec']:>10}{r['items_per_sec']:>11}{r['items_per_page']:>10}{r['peak_kib']:>10}{ratio:>10}")
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Wrote {args.baseline}")
+
+    if regressed:
+        print(f"[REGRESSION] {', '.join(regressed)}（基準比 {args.fail_under} 未満）")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
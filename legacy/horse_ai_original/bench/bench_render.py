@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+出馬表（shutuba）を Chrome で描画して、1ページあたりの描画時間を描画モード毎に測ります。
+PooledSeleniumMiddleware と同じ render_page / RenderPolicy / ドライバ設定（settings.py）を使います。
+
+  - eager   : pageLoadStrategy=eager → wait_until（EC.any_of）をポーリング（従来）
+  - observe : pageLoadStrategy=none  → meta["render_ready"] を MutationObserver で待つ
+  - median / p90 / mean ms : 描画（Cookie・get・準備完了まで）の実測。load / wait はその内訳の中央値
+
+既定は bench/fixtures の出馬表をローカルの HTTP サーバから配信して測ります（ネットワーク不要）。
+--race-id を付けると netkeiba の実ページを描画します（許可リスト外の広告・解析の遮断の効果も含む）。
+"""
+
+import argparse
+import functools
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJ_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+FIXTURE_DIR = os.path.join(SCRIPT_DIR, "fixtures")
+DEFAULT_FIXTURE = "shutuba_202505020607.html"
+DEFAULT_RACE_ID = "202505020607"
+
+# scrapy プロジェクト（horse_ai_scrapy パッケージ）を import できるようにする
+sys.path.insert(0, os.path.join(PROJ_ROOT, "horse_ai_scrapy"))
+os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "horse_ai_scrapy.settings")
+
+from scrapy.utils.project import get_project_settings  # noqa: E402
+from scrapy_selenium import SeleniumRequest  # noqa: E402
+
+from horse_ai_scrapy.render import PAGE_LOAD_STRATEGIES, RENDER_MODES, RenderPolicy, render_page  # noqa: E402
+from horse_ai_scrapy.selenium_eager_mw import build_eager_driver  # noqa: E402
+from horse_ai_scrapy.spiders.race_info_spider import RaceInfoSpiderSpider  # noqa: E402
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_fixtures() -> ThreadingHTTPServer:
+    """bench/fixtures を 127.0.0.1 の空きポートで配信する（別スレッド）"""
+    handler = functools.partial(_QuietHandler, directory=FIXTURE_DIR)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, name="bench-fixture-server", daemon=True).start()
+    return server
+
+
+def shutuba_request(race_id: str, url: str | None = None) -> SeleniumRequest:
+    """race_info_spider と同じ待機条件・render_ready の SeleniumRequest（url で配信先を差し替え）"""
+    base = RaceInfoSpiderSpider()._shutuba_request(race_id)
+    return SeleniumRequest(
+        url=url or base.url,
+        meta=dict(base.meta),
+        wait_time=base.wait_time,
+        wait_until=base.wait_until,
+        dont_filter=True,
+    )
+
+
+def _ms(values) -> float:
+    return round(statistics.median(values) * 1000, 1) if values else 0.0
+
+
+def bench_mode(settings, mode: str, policy: RenderPolicy, request: SeleniumRequest, repeat: int) -> dict:
+    driver = build_eager_driver(
+        settings.getlist("SELENIUM_DRIVER_ARGUMENTS") + policy.chrome_arguments(),
+        settings.get("SELENIUM_DRIVER_EXECUTABLE_PATH"),
+        os.devnull,
+        blocked_urls=policy.deny_urls,
+        page_load_strategy=PAGE_LOAD_STRATEGIES[mode],
+    )
+    totals, loads, waits = [], [], []
+    failed = 0
+    try:
+        # ウォームアップ（Chrome のプロセス起動・キャッシュ）
+        render_page(driver, request, mode)
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            try:
+                _, _, _, timing = render_page(driver, request, mode)
+            except Exception as e:
+                failed += 1
+                print(f"  [{mode}] 失敗: {e!r}"[:200])
+                continue
+            totals.append(time.perf_counter() - t0)
+            loads.append(timing["load"])
+            waits.append(timing.get("wait", 0.0))
+    finally:
+        driver.quit()
+
+    if not totals:
+        return {"n": 0, "failed": failed}
+    ordered = sorted(totals)
+    return {
+        "n": len(totals),
+        "failed": failed,
+        "median_ms": _ms(totals),
+        "p90_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))] * 1000, 1),
+        "mean_ms": round(statistics.fmean(totals) * 1000, 1),
+        "load_ms": _ms(loads),
+        "wait_ms": _ms(waits),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="出馬表の描画時間を描画モード毎に測ります。")
+    ap.add_argument("--repeat", type=int, default=20, help="1モードあたりの描画回数")
+    ap.add_argument("--mode", action="append", choices=RENDER_MODES, help="対象モード（複数可、既定: 全部）")
+    ap.add_argument("--race-id", default=None, help="netkeiba の実ページを描画する race_id（既定: fixture をローカル配信）")
+    ap.add_argument("--fixture", default=DEFAULT_FIXTURE, help=f"ローカル配信する fixture（既定: {DEFAULT_FIXTURE}）")
+    ap.add_argument("--no-policy", action="store_true",
+                    help="SELENIUM_ALLOW_HOSTS / SELENIUM_DENY_URLS を使わずに測る（遮断の効果を比べる用）")
+    args = ap.parse_args()
+
+    settings = get_project_settings()
+    policy = RenderPolicy() if args.no_policy else RenderPolicy.from_settings(settings)
+
+    server = None
+    if args.race_id:
+        request = shutuba_request(args.race_id)
+    else:
+        server = serve_fixtures()
+        url = f"http://127.0.0.1:{server.server_address[1]}/{args.fixture}"
+        request = shutuba_request(DEFAULT_RACE_ID, url)
+    print(f"url: {request.url}")
+
+    try:
+        print(f"{'mode':<10}{'n':>5}{'failed':>8}{'median ms':>11}{'p90 ms':>9}{'mean ms':>9}{'load ms':>9}{'wait ms':>9}")
+        for mode in RENDER_MODES:
+            if args.mode and mode not in args.mode:
+                continue
+            r = bench_mode(settings, mode, policy, request, args.repeat)
+            if not r["n"]:
+                print(f"{mode:<10}{0:>5}{r['failed']:>8}")
+                continue
+            print(f"{mode:<10}{r['n']:>5}{r['failed']:>8}{r['median_ms']:>11}{r['p90_ms']:>9}{r['mean_ms']:>9}"
+                  f"{r['load_ms']:>9}{r['wait_ms']:>9}")
+    finally:
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
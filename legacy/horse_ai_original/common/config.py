@@ -10,6 +10,8 @@ default = output.csv
 robots_obey = true
 download_delay = 1.0
 concurrent_per_domain = 1
+# AdaptiveRateMiddleware が増やしてよい同時接続数の上限（ホスト毎）
+max_concurrent_per_domain = 2
 autothrottle = true
 autothrottle_start_delay = 1.0
 autothrottle_max_delay = 10.0
@@ -0,0 +1,195 @@
+# horse_ai_scrapy/adaptive_rate.py
+import logging
+
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from twisted.internet import task
+
+from .ini_config import load_ini
+
+logger = logging.getLogger(__name__)
+
+# 混雑・制限を示すステータス（RETRY_HTTP_CODES の一部）。即座に半減させる
+BACKOFF_HTTP_CODES = (429, 503)
+
+
+class _HostState:
+    """ホスト毎の観測値と現在の設定値"""
+    __slots__ = ("delay", "concurrency", "latency", "error_rate", "ok_streak", "responses", "errors", "backoffs")
+
+    def __init__(self, delay: float, concurrency: int):
+        self.delay = delay
+        self.concurrency = concurrency
+        self.latency = None
+        self.error_rate = 0.0
+        self.ok_streak = 0
+        self.responses = 0
+        self.errors = 0
+        self.backoffs = 0
+
+
+class AdaptiveRateMiddleware:
+    """
+    ホスト（db / race / regist.netkeiba.com）毎に遅延と同時接続数を自動調整する downloader middleware
+    - 正常応答: 遅延を「レイテンシ / target」に寄せて下げる。連続成功で同時接続数を +1
+    - 429/503: 遅延を2倍（Retry-After があればそれ以上）、同時接続数を半分
+    - 5xx/例外: 遅延を1.5倍（IgnoreRequest＝取らなかったリクエストは数えない）
+    - いずれも [min_delay, max_delay] / [1, max_concurrency] の範囲に収める
+      範囲は common/config.py の [scraping]、ADAPTIVE_RATE_* 設定、ADAPTIVE_RATE_HOSTS の順に上書き
+      （min_delay の既定は DOWNLOAD_DELAY と [scraping] download_delay の大きい方）
+    - 選んだ値は ADAPTIVE_RATE_REPORT_INTERVAL 秒毎にログと stats（adaptive_rate/<host>/...）へ出す
+    ※ SeleniumRequest はダウンローダのスロットを通らないため対象外（同時描画数はプールの台数で決まる）
+    """
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_RATE_ENABLED"):
+            raise NotConfigured
+        if settings.getbool("AUTOTHROTTLE_ENABLED"):
+            logger.warning("AUTOTHROTTLE_ENABLED と ADAPTIVE_RATE_ENABLED が両方有効です（AutoThrottle を切ってください）")
+
+        ini = load_ini(settings)
+        sec = "scraping"
+        self.defaults = {
+            # 下限は DOWNLOAD_DELAY（2.0秒）より下げない。下げるなら ADAPTIVE_RATE_MIN_DELAY で明示する
+            "min_delay": settings.getfloat(
+                "ADAPTIVE_RATE_MIN_DELAY",
+                max(settings.getfloat("DOWNLOAD_DELAY"), ini.getfloat(sec, "download_delay", fallback=0.0)),
+            ),
+            "start_delay": settings.getfloat("ADAPTIVE_RATE_START_DELAY", ini.getfloat(sec, "autothrottle_start_delay", fallback=2.0)),
+            "max_delay": settings.getfloat("ADAPTIVE_RATE_MAX_DELAY", ini.getfloat(sec, "autothrottle_max_delay", fallback=10.0)),
+            "target": settings.getfloat("ADAPTIVE_RATE_TARGET", ini.getfloat(sec, "autothrottle_target", fallback=1.0)),
+            "max_concurrency": settings.getint(
+                "ADAPTIVE_RATE_MAX_CONCURRENCY",
+                ini.getint(sec, "max_concurrent_per_domain", fallback=ini.getint(sec, "concurrent_per_domain", fallback=1)),
+            ),
+        }
+        self.host_bounds = settings.getdict("ADAPTIVE_RATE_HOSTS")
+        self.ok_streak_to_grow = settings.getint("ADAPTIVE_RATE_GROW_AFTER", 20)
+        self.max_error_rate = settings.getfloat("ADAPTIVE_RATE_MAX_ERROR_RATE", 0.05)
+        self.report_interval = settings.getfloat("ADAPTIVE_RATE_REPORT_INTERVAL", 60.0)
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.hosts: dict[str, _HostState] = {}
+        self._report_task = None
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def bounds(self, host: str) -> dict:
+        return {**self.defaults, **self.host_bounds.get(host, {})}
+
+    # ---------- スロット ----------
+    def _slot(self, request):
+        downloader = self.crawler.engine.downloader
+        if hasattr(downloader, "get_slot_key"):
+            key = downloader.get_slot_key(request)
+        else:
+            key = downloader._get_slot_key(request, None)
+        return key, downloader.slots.get(key)
+
+    def _state(self, key: str) -> _HostState:
+        state = self.hosts.get(key)
+        if state is None:
+            b = self.bounds(key)
+            delay = min(max(b["start_delay"], b["min_delay"]), b["max_delay"])
+            state = self.hosts[key] = _HostState(delay, 1)
+        return state
+
+    def _apply(self, key: str, state: _HostState, slot) -> None:
+        b = self.bounds(key)
+        state.delay = min(max(state.delay, b["min_delay"]), b["max_delay"])
+        state.concurrency = min(max(state.concurrency, 1), int(b["max_concurrency"]))
+        if slot is not None:
+            slot.delay = state.delay
+            slot.concurrency = state.concurrency
+
+    # ---------- 観測 ----------
+    def process_response(self, request, response, spider):
+        key, slot = self._slot(request)
+        state = self._state(key)
+        state.responses += 1
+
+        if response.status in BACKOFF_HTTP_CODES:
+            state.backoffs += 1
+            state.ok_streak = 0
+            state.error_rate = 0.8 * state.error_rate + 0.2
+            retry_after = self._retry_after(response)
+            state.delay = max(state.delay * 2, retry_after)
+            state.concurrency = state.concurrency // 2
+            logger.warning(f"[RATE] {key}: HTTP {response.status} → delay={state.delay:.2f}s")
+        elif response.status >= 500:
+            self._on_error(state)
+        else:
+            state.error_rate = 0.8 * state.error_rate
+            state.ok_streak += 1
+            latency = request.meta.get("download_latency")
+            if latency is not None:
+                state.latency = latency if state.latency is None else 0.8 * state.latency + 0.2 * latency
+                target_delay = state.latency / self.bounds(key)["target"]
+                # 下げるのはエラー率が低い時だけ。上げる方向はそのまま追従
+                if target_delay > state.delay or state.error_rate <= self.max_error_rate:
+                    state.delay = (state.delay + target_delay) / 2.0
+            if state.ok_streak >= self.ok_streak_to_grow and state.error_rate <= self.max_error_rate:
+                state.concurrency += 1
+                state.ok_streak = 0
+
+        self._apply(key, state, slot)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        # 取らなかった（鮮度判定の NotModified 等）→ サーバの混雑とは無関係
+        if isinstance(exception, IgnoreRequest):
+            return None
+        key, slot = self._slot(request)
+        state = self._state(key)
+        self._on_error(state)
+        self._apply(key, state, slot)
+        return None
+
+    @staticmethod
+    def _on_error(state: _HostState) -> None:
+        state.errors += 1
+        state.ok_streak = 0
+        state.error_rate = 0.8 * state.error_rate + 0.2
+        state.delay *= 1.5
+
+    @staticmethod
+    def _retry_after(response) -> float:
+        value = response.headers.get(b"Retry-After")
+        try:
+            return float(value.decode()) if value else 0.0
+        except ValueError:
+            return 0.0
+
+    # ---------- 報告 ----------
+    def report(self) -> None:
+        for key, state in sorted(self.hosts.items()):
+            # 遅延があるスロットは遅延毎に1件ずつ送るので、上限は 1/delay（同時接続数は重なり分）
+            if state.delay:
+                rate = 1.0 / state.delay
+            else:
+                rate = state.concurrency / state.latency if state.latency else float(state.concurrency)
+            self.stats.set_value(f"adaptive_rate/{key}/delay", round(state.delay, 3))
+            self.stats.set_value(f"adaptive_rate/{key}/concurrency", state.concurrency)
+            self.stats.set_value(f"adaptive_rate/{key}/error_rate", round(state.error_rate, 4))
+            self.stats.set_value(f"adaptive_rate/{key}/backoffs", state.backoffs)
+            latency = f"{state.latency:.2f}s" if state.latency is not None else "-"
+            logger.warning(
+                f"[RATE] {key}: delay={state.delay:.2f}s concurrency={state.concurrency} "
+                f"(~{rate:.2f} req/s) latency={latency} error_rate={state.error_rate:.3f} "
+                f"responses={state.responses} errors={state.errors} backoffs={state.backoffs}"
+            )
+
+    def spider_opened(self, spider):
+        if self.report_interval > 0:
+            self._report_task = task.LoopingCall(self.report)
+            self._report_task.start(self.report_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self._report_task is not None and self._report_task.running:
+            self._report_task.stop()
+        self.report()
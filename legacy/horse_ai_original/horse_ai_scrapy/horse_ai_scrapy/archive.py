@@ -0,0 +1,151 @@
+# horse_ai_scrapy/archive.py
+import gzip
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import TextResponse
+
+# リクエストから取り出すエンティティIDのキー（cb_kwargs → meta の順に探す）
+ENTITY_KEYS = ("race_id", "horse_id")
+
+
+def entity_id_of(request) -> str | None:
+    for key in ENTITY_KEYS:
+        value = request.cb_kwargs.get(key) or request.meta.get(key)
+        if value:
+            return str(value)
+    return None
+
+
+def object_path(root: str, sha1: str) -> str:
+    return os.path.join(root, "objects", sha1[:2], sha1[2:4], f"{sha1}.html.gz")
+
+
+def read_object(root: str, sha1: str) -> bytes:
+    """保存済み本文を読む（index を開かないので replay のワーカーからも使える）"""
+    with open(object_path(root, sha1), "rb") as f:
+        return gzip.decompress(f.read())
+
+
+class HtmlArchive:
+    """
+    取得したページ本文の保存庫（既定 {OUTPUT_BASE_DIR}/archive）
+    - objects/ab/cd/<sha1>.html.gz : 本文（gzip）。内容アドレスなので同じ本文は1つだけ
+    - index.sqlite3                : (spider, entity_id) → sha1 / url / encoding / fetched_at
+      同じエンティティを取り直したら最新の本文を指す
+    """
+    def __init__(self, root: str, commit_every: int = 100):
+        self.root = root
+        self.commit_every = commit_every
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite3"))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " spider TEXT NOT NULL, entity_id TEXT NOT NULL, url TEXT NOT NULL,"
+            " sha1 TEXT NOT NULL, encoding TEXT NOT NULL, fetched_at REAL NOT NULL,"
+            " PRIMARY KEY (spider, entity_id))"
+        )
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def put(self, spider: str, entity_id: str, url: str, body: bytes, encoding: str) -> str:
+        sha1 = hashlib.sha1(body).hexdigest()
+        path = object_path(self.root, sha1)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(gzip.compress(body, compresslevel=6, mtime=0))
+            os.replace(tmp, path)
+
+        self._conn.execute(
+            "INSERT OR REPLACE INTO pages (spider, entity_id, url, sha1, encoding, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (spider, entity_id, url, sha1, encoding, time.time()),
+        )
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self.commit()
+        return sha1
+
+    def get_body(self, sha1: str) -> bytes:
+        return read_object(self.root, sha1)
+
+    def entries(self, spider: str) -> list[tuple[str, str, str, str]]:
+        """(entity_id, url, sha1, encoding) の一覧"""
+        return self._conn.execute(
+            "SELECT entity_id, url, sha1, encoding FROM pages WHERE spider = ? ORDER BY entity_id",
+            (spider,),
+        ).fetchall()
+
+    def merge_from(self, other_root: str) -> int:
+        """別の保存庫（ワーカー毎の archive）の本文と索引を取り込む（同じエンティティは新しい方）。取り込んだ件数"""
+        other = sqlite3.connect(os.path.join(other_root, "index.sqlite3"))
+        try:
+            rows = other.execute("SELECT spider, entity_id, url, sha1, encoding, fetched_at FROM pages").fetchall()
+        finally:
+            other.close()
+        merged = 0
+        for spider, entity_id, url, sha1, encoding, fetched_at in rows:
+            current = self._conn.execute(
+                "SELECT fetched_at FROM pages WHERE spider = ? AND entity_id = ?", (spider, entity_id)
+            ).fetchone()
+            if current is not None and current[0] >= fetched_at:
+                continue
+            path = object_path(self.root, sha1)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.tmp"
+                shutil.copyfile(object_path(other_root, sha1), tmp)
+                os.replace(tmp, path)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (spider, entity_id, url, sha1, encoding, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (spider, entity_id, url, sha1, encoding, fetched_at),
+            )
+            merged += 1
+        self.commit()
+        return merged
+
+    def commit(self) -> None:
+        self._conn.commit()
+        self._uncommitted = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._conn.close()
+
+
+class HtmlArchiveMiddleware:
+    """
+    200 応答の本文を HtmlArchive に保存する downloader middleware
+    - HttpCompression(590) より手前に置くこと（展開後の本文を保存するため）
+    - Selenium で描画した HtmlResponse も保存される（process_response は全段通るため）
+    - エンティティID（race_id / horse_id）が取れないリクエスト（ログイン等）は保存しない
+    """
+    def __init__(self, archive: HtmlArchive):
+        self.archive = archive
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("HTML_ARCHIVE_ENABLED"):
+            raise NotConfigured
+        root = settings.get("HTML_ARCHIVE_DIR") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), "archive")
+        mw = cls(HtmlArchive(root))
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def process_response(self, request, response, spider):
+        if response.status == 200 and isinstance(response, TextResponse):
+            entity_id = entity_id_of(request)
+            if entity_id:
+                self.archive.put(spider.name, entity_id, response.url, response.body, response.encoding)
+        return response
+
+    def spider_closed(self):
+        self.archive.close()
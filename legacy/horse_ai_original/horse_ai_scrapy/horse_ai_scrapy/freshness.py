@@ -0,0 +1,270 @@
+# horse_ai_scrapy/freshness.py
+"""
+取り直しの要否（鮮度）を判断する downloader middleware と取得記録
+
+- ページを URL から種類（race / shutuba / horse）とエンティティIDに分類し、
+  {OUTPUT_BASE_DIR}/.fetch_log.sqlite3 に「いつ・どの ETag / Last-Modified で取れたか」を残す
+    取れた時点ではメモリに控えるだけ（stage）。CsvExportPipeline のチェックポイントで、CSV を fsync して
+    進捗を commit した ID の分だけ書く（confirm）→ parse・CSV まで届かなかったページは次回も取る
+    （進捗ストアが無い PROGRESS_ENABLED=False では書かない＝毎回取る）
+- 種類毎の FRESHNESS_MAX_AGE（秒、None は一度取れたら不変）で判断
+    不変 / まだ新しい → 取らない（NotModified で errback へ。スパイダーは取得済み扱いにする）
+    古い → ETag / Last-Modified があれば条件付き GET（304 なら NotModified）、無ければ普通に取る
+- race_id を持つ種類は、race_id の年が今年より前なら不変（過去のレースの出馬表・結果は変わらない）
+- 馬のページは、その馬が新しいレース結果に出てきたら古い扱いにする（FreshnessPipeline が invalidate）
+- request.meta["freshness"] = False のリクエストは対象外（オッズの定期取得など）
+- スパイダーは進捗ストアで取得済みのIDを飛ばすが、記録が古い / stale のIDは飛ばさない（due_for_refetch）
+  → 馬・出馬表は FRESHNESS_MAX_AGE や invalidate で取り直される。-a resume=0 は進捗を消すだけで、記録は使う
+    （記録は CSV に書けたIDの分だけなので、記録のあるページは取り直さなくてよい）
+"""
+import datetime as dt
+import os
+import re
+import sqlite3
+import time
+
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy_selenium import SeleniumRequest
+
+
+# (種類, URL の正規表現)。グループ1がエンティティID
+ENTITY_PATTERNS = (
+    ("race", re.compile(r"^https?://db\.netkeiba\.com/race/(\d{12})/?$")),
+    ("shutuba", re.compile(r"^https?://race\.netkeiba\.com/race/shutuba\.html\?(?:.*&)?race_id=(\d{12})")),
+    ("horse", re.compile(r"^https?://db\.netkeiba\.com/horse/(\d{10})/?$")),
+)
+# race_id（先頭4桁が年）を持つ種類
+RACE_KINDS = ("race", "shutuba")
+
+
+class NotModified(IgnoreRequest):
+    """前回取得から変わっていない（取り直さなかった / 304 だった）"""
+
+
+def classify(url: str) -> tuple[str, str] | None:
+    for kind, pattern in ENTITY_PATTERNS:
+        m = pattern.match(url)
+        if m:
+            return kind, m.group(1)
+    return None
+
+
+class FetchLog:
+    """
+    エンティティ毎の最終取得記録（SQLite）
+    - (kind, entity_id) → url / status / fetched_at / etag / last_modified / stale
+    - stale=1 は「次は必ず取る」（invalidate() で立て、取れたら下ろす）
+    - 複数のスパイダー（プロセス）で共有するので、書き込みは都度 commit（ロックを持ち続けない）
+    - stage() はメモリに控えるだけ。confirm(ids) でその ID の分を record する
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fetches ("
+            " kind TEXT NOT NULL, entity_id TEXT NOT NULL, url TEXT NOT NULL, status INTEGER NOT NULL,"
+            " fetched_at REAL NOT NULL, etag TEXT, last_modified TEXT, stale INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (kind, entity_id))"
+        )
+        self._conn.commit()
+        # open_fetch_log() で共有している数
+        self._users = 0
+        # entity_id → [(kind, url, status, etag, last_modified)]（確定待ち）
+        self._staged: dict[str, list[tuple]] = {}
+
+    def get(self, kind: str, entity_id: str) -> dict | None:
+        row = self._conn.execute(
+            "SELECT url, status, fetched_at, etag, last_modified, stale FROM fetches WHERE kind = ? AND entity_id = ?",
+            (kind, entity_id),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("url", "status", "fetched_at", "etag", "last_modified", "stale"), row))
+
+    def record(self, kind: str, entity_id: str, url: str, status: int,
+               etag: str | None = None, last_modified: str | None = None) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO fetches (kind, entity_id, url, status, fetched_at, etag, last_modified, stale)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            (kind, entity_id, url, status, time.time(), etag, last_modified),
+        )
+        self._conn.commit()
+
+    def records(self, kind: str) -> dict[str, dict]:
+        """kind の全記録（entity_id → get() と同じ dict）"""
+        cols = ("url", "status", "fetched_at", "etag", "last_modified", "stale")
+        rows = self._conn.execute(
+            "SELECT entity_id, url, status, fetched_at, etag, last_modified, stale FROM fetches WHERE kind = ?", (kind,)
+        )
+        return {row[0]: dict(zip(cols, row[1:])) for row in rows}
+
+    def stage(self, kind: str, entity_id: str, url: str, status: int,
+              etag: str | None = None, last_modified: str | None = None) -> None:
+        """取れた記録を控える（CSV に書けたと分かるまで書かない）"""
+        self._staged.setdefault(entity_id, []).append((kind, url, status, etag, last_modified))
+
+    def confirm(self, entity_ids) -> None:
+        """控えた記録のうち entity_ids の分を書く（進捗の commit の後に呼ぶ）"""
+        rows = []
+        now = time.time()
+        for entity_id in entity_ids:
+            for kind, url, status, etag, last_modified in self._staged.pop(entity_id, ()):
+                rows.append((kind, entity_id, url, status, now, etag, last_modified))
+        if not rows:
+            return
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO fetches (kind, entity_id, url, status, fetched_at, etag, last_modified, stale)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            rows,
+        )
+        self._conn.commit()
+
+    def touch(self, kind: str, entity_id: str) -> None:
+        """304 だった（内容はそのまま、確認した時刻だけ更新）"""
+        self._conn.execute(
+            "UPDATE fetches SET fetched_at = ?, stale = 0 WHERE kind = ? AND entity_id = ?",
+            (time.time(), kind, entity_id),
+        )
+        self._conn.commit()
+
+    def invalidate(self, kind: str, entity_ids) -> None:
+        self._conn.executemany(
+            "UPDATE fetches SET stale = 1 WHERE kind = ? AND entity_id = ? AND stale = 0",
+            [(kind, i) for i in entity_ids],
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._users -= 1
+        if self._users <= 0:
+            _OPENED.pop(os.path.abspath(self.path), None)
+            self._conn.close()
+
+
+# パス → FetchLog（middleware と pipeline で同じ接続を使う）
+_OPENED: dict[str, FetchLog] = {}
+
+
+def fetch_log_path(settings) -> str:
+    """FRESHNESS_LOG_PATH（既定 {OUTPUT_BASE_DIR}/.fetch_log.sqlite3）"""
+    return settings.get("FRESHNESS_LOG_PATH") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), ".fetch_log.sqlite3")
+
+
+def open_fetch_log(settings) -> FetchLog:
+    """fetch_log_path() の FetchLog。使い終わったら close()"""
+    path = fetch_log_path(settings)
+    log = _OPENED.get(os.path.abspath(path))
+    if log is None:
+        log = _OPENED[os.path.abspath(path)] = FetchLog(path)
+    log._users += 1
+    return log
+
+
+class FreshnessPolicy:
+    """記録と種類から "skip" / "conditional" / "fetch" を決める"""
+    def __init__(self, max_age: dict, today: dt.date | None = None):
+        self.max_age = max_age
+        self.today = today or dt.date.today()
+
+    def immutable(self, kind: str, entity_id: str) -> bool:
+        if kind in self.max_age and self.max_age[kind] is None:
+            return True
+        return kind in RACE_KINDS and entity_id[:4].isdigit() and int(entity_id[:4]) < self.today.year
+
+    def decide(self, kind: str, entity_id: str, record: dict | None, now: float | None = None) -> str:
+        if record is None or record["stale"] or record["status"] != 200:
+            return "fetch"
+        if self.immutable(kind, entity_id):
+            return "skip"
+        max_age = self.max_age.get(kind, 0)
+        if (now or time.time()) - record["fetched_at"] < max_age:
+            return "skip"
+        if record["etag"] or record["last_modified"]:
+            return "conditional"
+        return "fetch"
+
+
+class FreshnessMiddleware:
+    """
+    FetchLog / FreshnessPolicy で取り直しを間引く downloader middleware（FRESHNESS_ENABLED）
+    - HtmlArchive(500) / Selenium(800) より手前に置く（取らないページはそこで止める）
+    - SeleniumRequest には条件付きヘッダを付けない（取る / 取らないだけ）
+    - 取れたページは FetchLog.stage() まで（確定は CsvExportPipeline のチェックポイント）
+    - stats: freshness/skip, freshness/conditional, freshness/not_modified, freshness/fetch
+    """
+    def __init__(self, crawler, log: FetchLog, policy: FreshnessPolicy):
+        self.stats = crawler.stats
+        self.log = log
+        self.policy = policy
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("FRESHNESS_ENABLED"):
+            raise NotConfigured
+        mw = cls(crawler, open_fetch_log(settings), FreshnessPolicy(settings.getdict("FRESHNESS_MAX_AGE")))
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    def process_request(self, request, spider):
+        if request.meta.get("freshness") is False:
+            return None
+        entity = classify(request.url)
+        if entity is None:
+            return None
+        kind, entity_id = entity
+        record = self.log.get(kind, entity_id)
+        decision = self.policy.decide(kind, entity_id, record)
+        self.stats.inc_value(f"freshness/{decision}")
+        if decision == "skip":
+            raise NotModified(f"{kind} {entity_id}: 取得済み（{time.strftime('%Y-%m-%d %H:%M', time.localtime(record['fetched_at']))}）")
+        if decision == "conditional" and not isinstance(request, SeleniumRequest):
+            if record["etag"]:
+                request.headers.setdefault(b"If-None-Match", record["etag"])
+            if record["last_modified"]:
+                request.headers.setdefault(b"If-Modified-Since", record["last_modified"])
+        request.meta["freshness_entity"] = entity
+        return None
+
+    def process_response(self, request, response, spider):
+        entity = request.meta.get("freshness_entity")
+        if entity is None:
+            return response
+        kind, entity_id = entity
+        if response.status == 304:
+            self.log.touch(kind, entity_id)
+            self.stats.inc_value("freshness/not_modified")
+            raise NotModified(f"{kind} {entity_id}: 304")
+        if response.status == 200:
+            etag = response.headers.get(b"ETag")
+            last_modified = response.headers.get(b"Last-Modified")
+            self.log.stage(
+                kind, entity_id, response.url, response.status,
+                etag.decode("latin-1") if etag else None,
+                last_modified.decode("latin-1") if last_modified else None,
+            )
+        return response
+
+    def spider_closed(self):
+        self.log.close()
+
+
+def due_for_refetch(settings, kind: str, entity_ids) -> set[str]:
+    """
+    entity_ids のうち、記録が古い / stale で取り直すべきID（FRESHNESS_ENABLED でなければ空）
+    スパイダーが進捗ストアの「取得済み」から外すのに使う。記録の無いIDは含めない（進捗ストアに従う）
+    """
+    if not settings.getbool("FRESHNESS_ENABLED"):
+        return set()
+    log = open_fetch_log(settings)
+    try:
+        records = log.records(kind)
+    finally:
+        log.close()
+    policy = FreshnessPolicy(settings.getdict("FRESHNESS_MAX_AGE"))
+    now = time.time()
+    return {i for i in entity_ids
+            if i in records and policy.decide(kind, i, records[i], now) != "skip"}
@@ -0,0 +1,156 @@
+# horse_ai_scrapy/id_codes.py
+"""
+ID（horse_id / jockey_id / trainer_id / owner_id / breeder_id）→ 連番 int32 コードの辞書
+
+保存先は {OUTPUT_BASE_DIR}/id_codes/（ID_CODES_DIR で変更可）:
+  - {namespace}.ids : 固定幅（ID_CODE_WIDTH バイト）の ID を登録順に並べただけのファイル
+                      コード = 何番目か。np.memmap(dtype="S16") でそのまま code → ID を引ける
+- 追記のみ（一度振ったコードは変わらない）。書き込むのは1プロセスだけにすること
+- ID → コードはオープン時にメモリ上の dict を作る（登録数ぶん）
+- ID_CODES_ENABLED なら Parquet / SQLite 出力に {列}_code（int32）を足す。features.py の行番号もこのコード
+  → 結合・集計は文字列ではなく int32 配列で（decode() で ID に戻せる）
+
+使い方（scrapy.cfg のあるディレクトリで）:
+    python -m horse_ai_scrapy.id_codes              # 名前空間毎の登録数
+    python -m horse_ai_scrapy.id_codes horse 2019104567
+    python -m horse_ai_scrapy.id_codes horse --decode 0 1 2
+"""
+import argparse
+import os
+
+import numpy as np
+
+# item / CSV の列 → 名前空間
+ID_FIELDS = {
+    "horse_id": "horse",
+    "jockey_id": "jockey",
+    "trainer_id": "trainer",
+    "owner_id": "owner",
+    "breeder_id": "breeder",
+}
+ID_CODE_WIDTH = 16
+# 出力に足す列: horse_id → horse_id_code
+CODE_SUFFIX = "_code"
+
+
+class IdInterner:
+    """1名前空間ぶんの ID ⇔ コード"""
+    def __init__(self, path: str, width: int = ID_CODE_WIDTH):
+        self.path = path
+        self.width = width
+        self.dtype = np.dtype(f"S{width}")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._table = self._map()
+        self._codes = {v: i for i, v in enumerate(self._table.tolist())}
+        # まだファイルに書いていない分
+        self._pending: list[bytes] = []
+
+    def _map(self) -> np.ndarray:
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size % self.width:
+            raise ValueError(f"{self.path}: サイズが {self.width} の倍数ではありません（書き込み途中で落ちた可能性）")
+        if size == 0:
+            return np.empty(0, dtype=self.dtype)
+        return np.memmap(self.path, dtype=self.dtype, mode="r")
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+    def code(self, value, create: bool = True) -> int:
+        """ID → コード（空や未登録で create=False なら -1）"""
+        key = str(value or "").strip().encode("ascii")
+        if not key:
+            return -1
+        c = self._codes.get(key)
+        if c is None:
+            if not create:
+                return -1
+            if len(key) > self.width:
+                raise ValueError(f"ID が長すぎます（{self.width} バイトまで）: {value}")
+            c = self._codes[key] = len(self._codes)
+            self._pending.append(key)
+        return c
+
+    def encode(self, values, create: bool = True) -> np.ndarray:
+        """ID の配列 → int32 コードの配列（辞書は重複を除いた値にだけ引く）"""
+        values = np.asarray(values, dtype=str)
+        if values.size == 0:
+            return np.empty(values.shape, dtype=np.int32)
+        uniq, inv = np.unique(values, return_inverse=True)
+        codes = np.fromiter((self.code(v, create) for v in uniq.tolist()), dtype=np.int32, count=uniq.size)
+        return codes[inv].reshape(values.shape)
+
+    def decode(self, codes) -> np.ndarray:
+        """コードの配列 → ID（str）の配列。-1 や範囲外は空文字"""
+        codes = np.asarray(codes, dtype=np.int64)
+        table = np.asarray(self._table)
+        if self._pending:
+            table = np.concatenate([table, np.array(self._pending, dtype=self.dtype)])
+        out = np.zeros(codes.shape, dtype=self.dtype)
+        ok = (codes >= 0) & (codes < len(table))
+        out[ok] = table[codes[ok]]
+        return np.char.decode(out, "ascii")
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        with open(self.path, "ab") as f:
+            f.write(np.array(self._pending, dtype=self.dtype).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        self._pending.clear()
+        self._table = self._map()
+
+
+def default_root(settings) -> str:
+    return settings.get("ID_CODES_DIR") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), "id_codes")
+
+
+# root → 名前空間 → IdInterner（同じプロセスの pipeline 同士で別々に追記しないよう共有）
+_OPENED: dict[str, dict[str, IdInterner]] = {}
+
+
+def open_interners(root: str, width: int = ID_CODE_WIDTH) -> dict[str, IdInterner]:
+    """名前空間 → IdInterner（同じ root はプロセス内で同じインスタンス）"""
+    key = os.path.abspath(root)
+    if key not in _OPENED:
+        _OPENED[key] = {ns: IdInterner(os.path.join(root, f"{ns}.ids"), width)
+                        for ns in dict.fromkeys(ID_FIELDS.values())}
+    return _OPENED[key]
+
+
+def flush_all(interners: dict[str, IdInterner]) -> None:
+    for interner in interners.values():
+        interner.flush()
+
+
+def code_columns(fields) -> list[tuple[str, str]]:
+    """列名の並び → [(ID列, コード列)]（ID_FIELDS にある列だけ）"""
+    return [(f, f + CODE_SUFFIX) for f in fields if f in ID_FIELDS]
+
+
+def main():
+    from scrapy.utils.project import get_project_settings
+
+    ap = argparse.ArgumentParser(description="ID ⇔ int32 コードの辞書を引きます。")
+    ap.add_argument("namespace", nargs="?", choices=sorted(set(ID_FIELDS.values())))
+    ap.add_argument("values", nargs="*", help="ID（--decode ならコード）")
+    ap.add_argument("--decode", action="store_true", help="values をコードとして ID に戻す")
+    args = ap.parse_args()
+
+    interners = open_interners(default_root(get_project_settings()))
+    if not args.namespace:
+        for ns, interner in interners.items():
+            print(f"{ns}\t{len(interner)}")
+        return
+    interner = interners[args.namespace]
+    if args.decode:
+        for v, i in zip(args.values, interner.decode([int(v) for v in args.values]).tolist()):
+            print(f"{v}\t{i}")
+    else:
+        for v, c in zip(args.values, interner.encode(args.values, create=False).tolist()):
+            print(f"{v}\t{c}")
+
+
+if __name__ == "__main__":
+    main()
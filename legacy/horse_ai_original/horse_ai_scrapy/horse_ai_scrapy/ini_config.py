@@ -0,0 +1,18 @@
+# horse_ai_scrapy/ini_config.py
+import configparser
+import os
+
+# 既定: legacy/horse_ai_original/common/config.py（拡張子は .py だが中身は INI）
+DEFAULT_INI_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "common", "config.py"))
+
+
+def load_ini(settings=None) -> configparser.ConfigParser:
+    """
+    common/config.py（INI）を読む。settings.SCRAPING_CONFIG_PATH で差し替え可
+    ファイルが無ければ空の ConfigParser を返す（各所の fallback 値で動く）
+    """
+    path = (settings.get("SCRAPING_CONFIG_PATH") if settings is not None else None) or DEFAULT_INI_PATH
+    parser = configparser.ConfigParser(interpolation=None)
+    if os.path.exists(path):
+        parser.read(path, encoding="utf-8")
+    return parser
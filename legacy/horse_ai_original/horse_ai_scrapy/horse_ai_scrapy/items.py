@@ -60,6 +60,40 @@ class RaceResultItem(scrapy.Item):
     horse_weight_change = scrapy.Field()
     win_odds = scrapy.Field()
     odds_rank = scrapy.Field()
+    finish_position = scrapy.Field()
+
+# -----------------------------------
+# race_info_spider.py（出馬表）
+# ------------------------------------
+class ShutubaItem(scrapy.Item):
+    _file = scrapy.Field()
+    race_id = scrapy.Field()
+    race_name = scrapy.Field()
+    race_info1 = scrapy.Field()
+    race_info2 = scrapy.Field()
+    race_grade = scrapy.Field()
+    gate_number = scrapy.Field()
+    horse_number = scrapy.Field()
+    horse_id = scrapy.Field()
+    horse_sex_age = scrapy.Field()
+    jockey_id = scrapy.Field()
+    trainer_id = scrapy.Field()
+    horse_weight = scrapy.Field()
+    horse_weight_change = scrapy.Field()
+    win_odds = scrapy.Field()
+    odds_rank = scrapy.Field()
+
+# race_info_spider.py（-a live=1、前回から変わった馬だけ）
+class LiveOddsItem(scrapy.Item):
+    _file = scrapy.Field()
+    race_id = scrapy.Field()
+    horse_number = scrapy.Field()
+    observed_at = scrapy.Field()
+    win_odds = scrapy.Field()
+    odds_rank = scrapy.Field()
+    horse_weight = scrapy.Field()
+    horse_weight_change = scrapy.Field()
+    source = scrapy.Field()
 
 # -----------------------------------
 # horse_info_spider.py
@@ -75,4 +109,14 @@ class HorseInfoItem(scrapy.Item):
     birthplace = scrapy.Field()
     auction_price = scrapy.Field()
     earnings_jra = scrapy.Field()
-    earnings_local = scrapy.Field()
\ No newline at end of file
+    earnings_local = scrapy.Field()
+
+# -----------------------------------
+# bloodline_spider.py
+# ------------------------------------
+class PedigreeItem(scrapy.Item):
+    _file = scrapy.Field()
+    horse_id = scrapy.Field()
+    horse_name = scrapy.Field()
+    sire_id = scrapy.Field()
+    dam_id = scrapy.Field()
\ No newline at end of file
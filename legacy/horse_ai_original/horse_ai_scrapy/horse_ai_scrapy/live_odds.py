@@ -0,0 +1,117 @@
+# horse_ai_scrapy/live_odds.py
+"""
+当日レースのオッズ（単勝オッズ・人気・馬体重）の定期取得（race_info_spider の -a live=1）
+
+- 取得元 LIVE_ODDS_SOURCE:
+    "api"  : 単勝オッズは出馬表ページが裏で呼んでいる JSON（api_get_jra_odds）を HTTP で取る（描画なし）
+             馬体重は出馬表ページを LIVE_ODDS_PAGE_INTERVAL 秒毎に描画して取る
+    "page" : 毎回出馬表ページを描画して全部取る（API の形が変わった時の退避用）
+- 間隔は発走までの残り時間で詰める（LIVE_ODDS_SCHEDULE）。発走 LIVE_ODDS_AFTER_POST 秒後に追跡をやめる
+- OddsTracker で前回から値が変わった馬だけを LiveOddsItem（live_odds.csv、時刻付きの追記）にする
+"""
+import datetime as dt
+import json
+import re
+
+# 発走時刻（出馬表の race_info1 "15:40発走 / 芝2000m …"）は日本時間
+JST = dt.timezone(dt.timedelta(hours=9))
+_POST_TIME = re.compile(r"(\d{1,2}):(\d{2})発走")
+
+ODDS_API_URL = "https://race.netkeiba.com/api/api_get_jra_odds.html?race_id={race_id}&type=1&action=update"
+SHUTUBA_URL = "https://race.netkeiba.com/race/shutuba.html?race_id={race_id}&rf=race_submenu"
+LIVE_ODDS_SOURCES = ("api", "page")
+# 差分を見る列
+TRACKED_FIELDS = ("win_odds", "odds_rank", "horse_weight", "horse_weight_change")
+
+
+def now_jst() -> dt.datetime:
+    return dt.datetime.now(JST)
+
+
+def parse_post_time(race_info1: str, day: dt.date | None = None) -> dt.datetime | None:
+    """'15:40発走 / …' → 当日（day）のその時刻（JST）"""
+    m = _POST_TIME.search(race_info1 or "")
+    if not m:
+        return None
+    day = day or now_jst().date()
+    return dt.datetime(day.year, day.month, day.day, int(m.group(1)), int(m.group(2)), tzinfo=JST)
+
+
+def parse_odds_api(body: str | bytes) -> dict[str, dict]:
+    """
+    api_get_jra_odds（type=1）の JSON → 馬番 → {"win_odds", "odds_rank"}
+    data.odds["1"] = {"01": ["3.5", "", "2"], …}（オッズ, ?, 人気）。発売前・形が違う時は空
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return {}
+    data = payload.get("data") if isinstance(payload, dict) else None
+    odds = ((data or {}).get("odds") or {}).get("1") if isinstance(data, dict) else None
+    if not isinstance(odds, dict):
+        return {}
+    out = {}
+    for number, values in odds.items():
+        if not str(number).isdigit() or not isinstance(values, list) or not values:
+            continue
+        out[str(int(number))] = {
+            "win_odds": str(values[0]),
+            "odds_rank": str(values[2]) if len(values) > 2 else "",
+        }
+    return out
+
+
+class LiveSchedule:
+    """発走までの残り秒数 → 次に取るまでの秒数"""
+    def __init__(self, steps, max_interval: float = 900.0):
+        # (残り秒数がこれ以下なら, この間隔) を残り秒数の小さい順に
+        self.steps = sorted((float(t), float(i)) for t, i in steps)
+        self.max_interval = max_interval
+
+    def interval(self, remaining: float | None) -> float:
+        if remaining is None:
+            return self.max_interval
+        for threshold, interval in self.steps:
+            if remaining <= threshold:
+                return interval
+        return self.max_interval
+
+
+class LiveRace:
+    """1レースの追跡状態"""
+    def __init__(self, race_id: str):
+        self.race_id = race_id
+        self.day = now_jst().date()
+        self.post_at: dt.datetime | None = None
+        self.next_odds_at = 0.0
+        self.next_page_at = 0.0
+        # 描画中の出馬表があるか（同じレースを重ねて描画しない）/ 1回でも描画できたか
+        self.page_in_flight = False
+        self.seen_page = False
+
+    def remaining(self, now: dt.datetime) -> float | None:
+        return (self.post_at - now).total_seconds() if self.post_at else None
+
+    def finished(self, now: dt.datetime, after_post: float) -> bool:
+        if self.post_at is None:
+            # 発走時刻が取れないレースは日付が変わるまで
+            return now.date() > self.day
+        return (now - self.post_at).total_seconds() > after_post
+
+
+class OddsTracker:
+    """(race_id, 馬番) 毎の最後の値。update() は変わった馬の行だけ返す"""
+    def __init__(self):
+        self._last: dict[tuple[str, str], dict] = {}
+
+    def update(self, race_id: str, rows: dict[str, dict]) -> list[dict]:
+        changed = []
+        for number, values in rows.items():
+            key = (race_id, number)
+            last = self._last.setdefault(key, {})
+            # 今回取れた列だけ比べる（API には馬体重が無い）
+            diff = {f: values[f] for f in TRACKED_FIELDS if f in values and values[f] != "" and values[f] != last.get(f)}
+            if diff:
+                last.update(diff)
+                changed.append({"horse_number": number, **{f: last.get(f, "") for f in TRACKED_FIELDS}})
+        return changed
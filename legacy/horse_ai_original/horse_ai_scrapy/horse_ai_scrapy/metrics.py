@@ -0,0 +1,430 @@
+# horse_ai_scrapy/metrics.py
+"""
+クロールの計測（どこで時間を使ったか：ネットワーク / Chrome / パース / 書き込み）
+
+- spider.metrics（CrawlMetrics）に スパイダー×ホスト 毎のヒストグラム・カウンタ・ゲージを溜める
+    download_latency_seconds  : HTTP のダウンロード時間（ホスト毎）
+    selenium_seconds          : Chrome の待ち（checkout=空きドライバ待ち / load=driver.get / wait=待機条件）
+    parse_seconds             : callback の実行時間（callback 毎）
+    pipeline_seconds          : item が ITEM_PIPELINES を通り抜けるまで（_file 毎）
+    responses_total / download_errors_total / retries_total / spider_errors_total / items_total
+    items_per_second / queue_depth（scheduler / downloader / scraper / progress）
+- METRICS_EXPORT_INTERVAL 秒毎と終了時に {METRICS_DIR}（既定 {OUTPUT_BASE_DIR}/metrics）へ
+    {spider}.prom            : Prometheus のテキスト形式（node_exporter の textfile collector でそのまま読める）
+    {spider}-YYYYMMDD.jsonl  : JSON のスナップショットを1行ずつ追記（夜間の遅さを後から見比べる用）
+- 部品は METRICS_ENABLED で揃って有効になる
+    MetricsExtension（EXTENSIONS）/ MetricsDownloaderMiddleware / MetricsSpiderMiddleware / MetricsPipeline
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.utils.httpobj import urlparse_cached
+from twisted.internet import task
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "horse_ai_"
+# 秒。ネットワーク・Chrome・パース・書き込みのどれにも使える幅
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 名前 → (種類, 説明)
+METRICS = {
+    "download_latency_seconds": ("histogram", "HTTP download latency"),
+    "selenium_seconds": ("histogram", "Selenium time by phase (checkout / load / wait)"),
+    "parse_seconds": ("histogram", "Spider callback time"),
+    "pipeline_seconds": ("histogram", "Time for an item to pass through ITEM_PIPELINES"),
+    "responses_total": ("counter", "Responses by host and status"),
+    "download_errors_total": ("counter", "Download exceptions by host and type"),
+    "retries_total": ("counter", "Retried requests by host"),
+    "spider_errors_total": ("counter", "Exceptions raised in callbacks / pipelines"),
+    "items_total": ("counter", "Scraped items by output file"),
+    "items_per_second": ("gauge", "Items per second since the previous export"),
+    "queue_depth": ("gauge", "Requests / IDs waiting by queue"),
+}
+
+
+class Histogram:
+    """固定バケットのヒストグラム（Prometheus と同じ le 区切り、最後は +Inf）"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[int]:
+        out, total = [], 0
+        for c in self.counts:
+            total += c
+            out.append(total)
+        return out
+
+    def quantile(self, q: float) -> float | None:
+        """バケットの上端で近似（+Inf に入った分は最大のバケット値）"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in zip(self.buckets + (self.buckets[-1],), self.cumulative()):
+            if total >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = labels + extra
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in items) + "}"
+
+
+class CrawlMetrics:
+    """
+    1スパイダー分の計測値（spider.metrics）
+    - inc / set / observe(名前, 値, **ラベル)。名前は METRICS のもの（接頭辞なし）
+    - Selenium の描画スレッド等からも呼べるようロックで守る
+    """
+    def __init__(self, spider_name: str, buckets=DEFAULT_BUCKETS):
+        self.spider_name = spider_name
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # (名前, ラベル) → 値 / Histogram
+        self.counters: dict[tuple, float] = {}
+        self.gauges: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(self.buckets)
+            hist.observe(value)
+
+    def total(self, name: str) -> float:
+        with self._lock:
+            return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    # ---------- 出力 ----------
+    def prometheus(self) -> str:
+        spider = (("spider", self.spider_name),)
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in METRICS.items():
+                full = PREFIX + name
+                if kind == "histogram":
+                    series = sorted((k[1], v) for k, v in self.histograms.items() if k[0] == name)
+                else:
+                    values = self.counters if kind == "counter" else self.gauges
+                    series = sorted((k[1], v) for k, v in values.items() if k[0] == name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {full} {help_text}")
+                lines.append(f"# TYPE {full} {kind}")
+                for labels, value in series:
+                    labels = spider + labels
+                    if kind != "histogram":
+                        lines.append(f"{full}{_format_labels(labels)} {value}")
+                        continue
+                    for bound, total in zip(value.buckets + (float("inf"),), value.cumulative()):
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{full}_bucket{_format_labels(labels, (('le', le),))} {total}")
+                    lines.append(f"{full}_sum{_format_labels(labels)} {value.sum}")
+                    lines.append(f"{full}_count{_format_labels(labels)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "spider": self.spider_name,
+                "counters": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.counters.items())],
+                "gauges": [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(self.gauges.items())],
+                "histograms": [
+                    {
+                        "name": n, "labels": dict(l), "count": h.count, "sum": round(h.sum, 6),
+                        "mean": round(h.sum / h.count, 6) if h.count else None,
+                        "p50": h.quantile(0.5), "p95": h.quantile(0.95), "p99": h.quantile(0.99),
+                    }
+                    for (n, l), h in sorted(self.histograms.items(), key=lambda kv: kv[0])
+                ],
+            }
+
+
+def _metrics(spider) -> CrawlMetrics | None:
+    return getattr(spider, "metrics", None)
+
+
+def _host(request) -> str:
+    return urlparse_cached(request).hostname or ""
+
+
+def _check_enabled(settings) -> None:
+    if not settings.getbool("METRICS_ENABLED"):
+        raise NotConfigured
+
+
+class MetricsDownloaderMiddleware:
+    """
+    ダウンロードの計測（ダウンローダ寄り・Selenium(800) より後ろに置く）
+    - HTTP: download_latency / ステータス / 例外 / リトライ（meta["retry_times"]）をホスト毎に
+    - SeleniumRequest: PooledSeleniumMiddleware が meta["selenium_timing"] に残した段階毎の秒数
+      （process_request はここまで来ないが、process_response は全 middleware を通る）
+    """
+    def __init__(self, crawler):
+        _check_enabled(crawler.settings)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider):
+        metrics = _metrics(spider)
+        if metrics is not None and request.meta.get("retry_times"):
+            metrics.inc("retries_total", host=_host(request))
+        return None
+
+    def process_response(self, request, response, spider):
+        metrics = _metrics(spider)
+        if metrics is None:
+            return response
+        host = _host(request)
+        metrics.inc("responses_total", host=host, status=response.status)
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            metrics.observe("download_latency_seconds", latency, host=host)
+        for phase, seconds in (request.meta.get("selenium_timing") or {}).items():
+            metrics.observe("selenium_seconds", seconds, host=host, phase=phase)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        metrics = _metrics(spider)
+        # 取らなかったリクエスト（鮮度判定の NotModified 等）はエラーではない
+        if metrics is not None and not isinstance(exception, IgnoreRequest):
+            metrics.inc("download_errors_total", host=_host(request), exception=type(exception).__name__)
+        return None
+
+
+class MetricsSpiderMiddleware:
+    """
+    callback の実行時間（スパイダー寄りに置き、callback の出力を1件ずつ取り出す時間だけを足す）
+    ※ 後ろの middleware / pipeline の時間は含まない
+    """
+    def __init__(self, crawler):
+        _check_enabled(crawler.settings)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    @staticmethod
+    def _callback(response) -> str:
+        request = getattr(response, "request", None)
+        return getattr(getattr(request, "callback", None), "__name__", "parse")
+
+    def process_spider_output(self, response, result, spider):
+        metrics = _metrics(spider)
+        if metrics is None:
+            return result
+        return self._timed(result, metrics, self._callback(response))
+
+    async def process_spider_output_async(self, response, result, spider):
+        metrics = _metrics(spider)
+        if metrics is None:
+            async for out in result:
+                yield out
+            return
+        it = result.__aiter__()
+        elapsed = 0.0
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    out = await it.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - t0
+                yield out
+        finally:
+            metrics.observe("parse_seconds", elapsed, callback=self._callback(response))
+
+    @staticmethod
+    def _timed(result, metrics: CrawlMetrics, callback: str):
+        it = iter(result)
+        elapsed = 0.0
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    out = next(it)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - t0
+                yield out
+        finally:
+            metrics.observe("parse_seconds", elapsed, callback=callback)
+
+
+class MetricsPipeline:
+    """
+    ITEM_PIPELINES の先頭に置き、item が残りの pipeline（CSV / Parquet / SQLite …）を
+    通り抜けるまでの時間を _file 毎に測る（終わりは item_scraped / item_dropped / item_error）
+    """
+    def __init__(self, crawler):
+        _check_enabled(crawler.settings)
+        # id(item) → 開始時刻
+        self._started: dict[int, float] = {}
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(self.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(self.item_error, signal=signals.item_error)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_item(self, item, spider):
+        self._started[id(item)] = time.perf_counter()
+        return item
+
+    def _finished(self, item, spider, outcome: str) -> None:
+        t0 = self._started.pop(id(item), None)
+        metrics = _metrics(spider)
+        if t0 is not None and metrics is not None:
+            metrics.observe("pipeline_seconds", time.perf_counter() - t0,
+                            file=ItemAdapter(item).get("_file") or "", outcome=outcome)
+
+    def item_scraped(self, item, spider):
+        self._finished(item, spider, "ok")
+
+    def item_dropped(self, item, spider):
+        self._finished(item, spider, "dropped")
+
+    def item_error(self, item, spider):
+        self._finished(item, spider, "error")
+
+
+class MetricsExtension:
+    """
+    spider.metrics を用意し、件数・エラー・キュー長を溜めて METRICS_EXPORT_INTERVAL 秒毎にファイルへ書く拡張
+    """
+    def __init__(self, crawler):
+        settings = crawler.settings
+        _check_enabled(settings)
+        self.crawler = crawler
+        self.interval = settings.getfloat("METRICS_EXPORT_INTERVAL", 60.0)
+        self.out_dir = settings.get("METRICS_DIR") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), "metrics")
+        self.buckets = tuple(sorted(float(b) for b in settings.getlist("METRICS_BUCKETS"))) or DEFAULT_BUCKETS
+        self._task = None
+        self._last = None
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(self.spider_error, signal=signals.spider_error)
+        crawler.signals.connect(self.item_error, signal=signals.item_error)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        spider.metrics = CrawlMetrics(spider.name, self.buckets)
+        self._last = (time.monotonic(), 0)
+        os.makedirs(self.out_dir, exist_ok=True)
+        if self.interval > 0:
+            self._task = task.LoopingCall(self.export, spider)
+            self._task.start(self.interval, now=False)
+
+    def item_scraped(self, item, spider):
+        spider.metrics.inc("items_total", file=ItemAdapter(item).get("_file") or "")
+
+    def spider_error(self, failure, response, spider):
+        spider.metrics.inc("spider_errors_total", stage="callback", exception=failure.type.__name__,
+                           callback=MetricsSpiderMiddleware._callback(response))
+
+    def item_error(self, item, response, spider, failure):
+        spider.metrics.inc("spider_errors_total", stage="pipeline", exception=failure.type.__name__,
+                           callback=ItemAdapter(item).get("_file") or "")
+
+    # ---------- ゲージ ----------
+    def queue_depths(self, spider) -> dict[str, int]:
+        engine = self.crawler.engine
+        depths = {}
+        scheduler = getattr(engine, "scheduler", None)
+        if scheduler is None:
+            slot = getattr(engine, "_slot", None) or getattr(engine, "slot", None)
+            scheduler = getattr(slot, "scheduler", None)
+        if scheduler is not None and hasattr(scheduler, "__len__"):
+            depths["scheduler"] = len(scheduler)
+        downloader = getattr(engine, "downloader", None)
+        if downloader is not None:
+            depths["downloader"] = len(downloader.active)
+        scraper_slot = getattr(getattr(engine, "scraper", None), "slot", None)
+        if scraper_slot is not None:
+            depths["scraper"] = len(scraper_slot.active)
+        progress = getattr(spider, "progress", None)
+        if progress is not None:
+            depths["progress"] = progress.pending_count
+        return depths
+
+    # ---------- 出力 ----------
+    def export(self, spider) -> None:
+        metrics = spider.metrics
+        now = time.monotonic()
+        items = metrics.total("items_total")
+        since, last_items = self._last
+        if now > since:
+            metrics.set("items_per_second", round((items - last_items) / (now - since), 3))
+        self._last = (now, items)
+        for queue_name, depth in self.queue_depths(spider).items():
+            metrics.set("queue_depth", depth, queue=queue_name)
+
+        prom = os.path.join(self.out_dir, f"{spider.name}.prom")
+        tmp = f"{prom}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(metrics.prometheus())
+        os.replace(tmp, prom)
+
+        snapshot = {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), **metrics.snapshot()}
+        path = os.path.join(self.out_dir, f"{spider.name}-{time.strftime('%Y%m%d')}.jsonl")
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot, ensure_ascii=False) + "\n")
+
+    def spider_closed(self, spider):
+        if self._task is not None and self._task.running:
+            self._task.stop()
+        try:
+            self.export(spider)
+        except OSError as e:
+            logger.warning(f"[METRICS] 書き出しに失敗しました: {e!r}")
+            return
+        logger.info(f"[METRICS] {spider.name}: {os.path.join(self.out_dir, spider.name)}.prom / -YYYYMMDD.jsonl")
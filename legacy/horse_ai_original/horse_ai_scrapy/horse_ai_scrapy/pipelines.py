@@ -1,28 +1,55 @@
 # horse_ai_scrapy/pipelines.py
 import csv
+import datetime
+import logging
 import os
+import queue
+import re
+import threading
+import time
 from itemadapter import ItemAdapter
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.reactor import is_reactor_installed
 
-class CsvExportPipeline:
-    """
-    ルール（簡潔版）:
-    - 各 item に必ず item['_file'] を入れる
-    - 列順は「そのファイルに最初に書いた item のキー順」（先頭 '_' のキーは除外）
-    - 上書き/追記は settings.EXPORT_OVERWRITE（True=上書き, False=追記）
-    """
-    def open_spider(self, spider):
-        self.settings = spider.settings
-        self.base_dir = self.settings.get('OUTPUT_BASE_DIR', 'data')
-        self.overwrite = self.settings.getbool('EXPORT_OVERWRITE', True)
-        self.encoding = self.settings.get('FEED_EXPORT_ENCODING', 'utf-8')
-        os.makedirs(self.base_dir, exist_ok=True)
-        # filename -> {"f":..., "writer":..., "fieldnames":..., "wrote_header":...}
-        self._files = {}
+from .profiling import profiled
+from .storage import open_storage
+from .upsert import KeyIndex, compact
+
+logger = logging.getLogger(__name__)
+
+EXPORT_WRITER_MODES = ("sync", "thread")
 
-    def _ensure_writer(self, filename: str, adapter: ItemAdapter):
-        if filename in self._files:
-            return self._files[filename]
 
+def _add_columns(path: str, columns: list, encoding: str) -> None:
+    """CSV の末尾に列を足して書き直す（既存の行は空欄。一時ファイル → 置き換え）"""
+    tmp = f"{path}.columns.tmp"
+    with open(path, newline='', encoding=encoding) as src, open(tmp, 'w', newline='', encoding=encoding) as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        header = next(reader, None) or []
+        writer.writerow(header + columns)
+        pad = [''] * len(columns)
+        for row in reader:
+            writer.writerow(row + [''] * (len(header) - len(row)) + pad)
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp, path)
+
+
+class _CsvFiles:
+    """出力CSVのファイルハンドル群（書き込み・flush・fsync だけを担当）"""
+    def __init__(self, base_dir: str, overwrite: bool, encoding: str,
+                 primary_keys: dict | None = None, compact_ratio: float = 0.0):
+        self.base_dir = base_dir
+        self.overwrite = overwrite
+        self.encoding = encoding
+        # ファイル名（basename）→ 主キー列。載っているファイルは upsert（KeyIndex）で書く
+        self.primary_keys = primary_keys or {}
+        self.compact_ratio = compact_ratio
+        # filename -> {"f":..., "writer":..., "index": KeyIndex | None}
+        self._files = {}
+
+    def _open(self, filename: str, fieldnames: list):
         # パス生成
         path = filename if os.path.isabs(filename) else os.path.join(self.base_dir, filename)
         os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -34,18 +61,224 @@ class CsvExportPipeline:
         f = open(path, mode, newline='', encoding=self.encoding)
         wrote_header = (mode == 'a' and exists_before and size_before > 0)
 
-        # 列順：最初のitemのキー順（先頭 '_' は除外）
-        fieldnames = [k for k in adapter.asdict().keys() if not str(k).startswith('_')]
+        # 既存ファイルに追記する時は、そのファイルのヘッダの列順に合わせる（列ずれさせない）
+        # 新しい列があれば、既存の行を空欄で埋めてヘッダごと書き直してから追記（列を黙って落とさない）
+        if wrote_header:
+            with open(path, newline='', encoding=self.encoding) as rf:
+                existing = next(csv.reader(rf), None) or fieldnames
+            added = [c for c in fieldnames if c not in existing]
+            if added:
+                f.close()
+                _add_columns(path, added, self.encoding)
+                logger.warning(f"{path}: 列 {added} を足してヘッダを書き直しました（既存の行は空欄）")
+                f = open(path, mode, newline='', encoding=self.encoding)
+            fieldnames = existing + added
 
         writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
         if not wrote_header:
             writer.writeheader()
-            wrote_header = True
 
-        rec = {"f": f, "writer": writer, "fieldnames": fieldnames, "wrote_header": wrote_header}
+        # 主キー索引（キー列が揃っているファイルだけ）
+        index = None
+        keys = self.primary_keys.get(os.path.basename(filename))
+        if keys and all(k in fieldnames for k in keys):
+            index = KeyIndex(path, keys, self.encoding)
+            if mode == 'w':
+                index.reset()
+            f.flush()
+            index.attach(fieldnames)
+
+        rec = {"f": f, "writer": writer, "fieldnames": fieldnames, "index": index}
         self._files[filename] = rec
         return rec
 
+    def write_rows(self, filename: str, fieldnames: list, rows: list) -> None:
+        rec = self._files.get(filename) or self._open(filename, fieldnames)
+        index = rec["index"]
+        if index is not None:
+            # 同じキー・同じ内容の行は書かない（変わった行だけ追記し、古い行は dead 扱い）
+            rows = [r for r in rows if index.accept([r.get(k, '') for k in rec["fieldnames"]])]
+        rec["writer"].writerows(rows)
+
+    def flush(self, fsync: bool = False) -> None:
+        for rec in self._files.values():
+            rec["f"].flush()
+            if fsync:
+                os.fsync(rec["f"].fileno())
+            if rec["index"] is not None:
+                rec["index"].commit()
+
+    def close(self) -> None:
+        for rec in self._files.values():
+            index = rec["index"]
+            try:
+                rec["f"].close()
+                if index is not None:
+                    index.commit()
+                    if self.compact_ratio and index.dead_ratio >= self.compact_ratio:
+                        before = index.rows
+                        removed = compact(index)
+                        logger.warning(f"[COMPACT] {index.csv_path}: {before} → {before - removed} rows")
+            except Exception:
+                logger.exception(f"CSV のクローズに失敗しました: {rec['f'].name}")
+            finally:
+                if index is not None:
+                    index.close()
+        self._files.clear()
+
+
+class _CsvWriterThread(threading.Thread):
+    """
+    行をキュー経由で受け取り、まとめて書く専用スレッド
+    - キューが空になるか EXPORT_BATCH_SIZE 行溜まる毎に writerows
+    - EXPORT_FLUSH_INTERVAL 秒毎に OS へ flush（fsync はチェックポイントのみ）
+    - キューは EXPORT_QUEUE_SIZE で上限あり（満杯なら offer() が False → 呼び出し側が別スレッドで put して待つ＝背圧）
+    - 同期の印 (None, fsync, notify) までの行を書き切って flush（fsync）したら、このスレッドで notify() を呼ぶ
+    """
+    _STOP = object()
+
+    def __init__(self, files: _CsvFiles, queue_size: int, batch_size: int, flush_interval: float):
+        super().__init__(name="csv-export-writer", daemon=True)
+        self.files = files
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.error = None
+        self.blocked = 0
+
+    def offer(self, msg) -> bool:
+        """待たずに入れる（満杯なら False）"""
+        self._raise_error()
+        try:
+            self.queue.put_nowait(msg)
+            return True
+        except queue.Full:
+            self.blocked += 1
+            return False
+
+    def put(self, msg) -> None:
+        """空くまで待って入れる（reactor 以外のスレッドから呼ぶ）"""
+        self._raise_error()
+        self.queue.put(msg)
+
+    def sync(self, fsync: bool) -> None:
+        """ここまでに put した行を書き切って flush（fsync）するまで待つ"""
+        self._raise_error()
+        done = threading.Event()
+        self.queue.put((None, fsync, done.set))
+        done.wait()
+        self._raise_error()
+
+    def stop(self) -> None:
+        self.queue.put(self._STOP)
+        self.join()
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            raise RuntimeError(f"CSV 書き込みスレッドが停止しています: {self.error!r}") from self.error
+
+    def run(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.05, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                msg = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                msg = None
+
+            # 溜まっている分をまとめて取り出す（ファイル毎に writerows）
+            batch = {}
+            controls = []
+            n = 0
+            while msg is not None:
+                if msg is self._STOP or msg[0] is None:
+                    controls.append(msg)
+                    break
+                filename, fieldnames, row = msg
+                batch.setdefault(filename, (fieldnames, []))[1].append(row)
+                n += 1
+                if n >= self.batch_size:
+                    break
+                try:
+                    msg = self.queue.get_nowait()
+                except queue.Empty:
+                    msg = None
+
+            try:
+                if self.error is None:
+                    for filename, (fieldnames, rows) in batch.items():
+                        self.files.write_rows(filename, fieldnames, rows)
+                    now = time.monotonic()
+                    if controls or now - last_flush >= self.flush_interval:
+                        fsync = any(c is self._STOP or c[1] for c in controls)
+                        self.files.flush(fsync=fsync)
+                        last_flush = now
+            except Exception as e:
+                # 以後の書き込みは捨て、呼び出し側（put/sync）で例外にする
+                logger.exception("CSV 書き込みに失敗しました")
+                self.error = e
+
+            for c in controls:
+                if c is self._STOP:
+                    return
+                c[2]()
+
+
+class CsvExportPipeline:
+    """
+    ルール（簡潔版）:
+    - 各 item に必ず item['_file'] を入れる
+    - 列順は「そのファイルに最初に書いた item のキー順」（先頭 '_' のキーは除外）
+    - 上書き/追記は settings.EXPORT_OVERWRITE（True=上書き, False=追記）
+    - EXPORT_UPSERT なら EXPORT_PRIMARY_KEYS のファイルは主キーで重複を除いて書く（upsert.py）
+    - EXPORT_WRITER_MODE="thread" なら書き込みは専用スレッドでまとめて行う（"sync" は従来どおり都度書き込み）
+    - spider.progress（進捗ストア）があれば、未確定IDが PROGRESS_COMMIT_EVERY 件溜まる毎に
+      CSV を書き切って flush・fsync → 進捗を commit（チェックポイント）
+      "thread" では fsync は書き込みスレッドが行い、reactor は待たない（commit は fsync 後に reactor 上で）
+      FRESHNESS_ENABLED なら、commit したIDの取得記録（freshness.py）もここで確定
+    """
+    def open_spider(self, spider):
+        self.settings = spider.settings
+        self.base_dir = self.settings.get('OUTPUT_BASE_DIR', 'data')
+        self.overwrite = self.settings.getbool('EXPORT_OVERWRITE', True)
+        self.encoding = self.settings.get('FEED_EXPORT_ENCODING', 'utf-8')
+        self.checkpoint_every = self.settings.getint('PROGRESS_COMMIT_EVERY', 50)
+        self.fsync = self.settings.getbool('EXPORT_FSYNC', True)
+        os.makedirs(self.base_dir, exist_ok=True)
+        # filename -> 列順
+        self._fieldnames = {}
+        primary_keys = self.settings.getdict('EXPORT_PRIMARY_KEYS') if self.settings.getbool('EXPORT_UPSERT') else {}
+        self._files = _CsvFiles(
+            self.base_dir, self.overwrite, self.encoding,
+            primary_keys=primary_keys,
+            compact_ratio=self.settings.getfloat('EXPORT_COMPACT_RATIO', 0.0),
+        )
+
+        mode = self.settings.get('EXPORT_WRITER_MODE', 'sync')
+        if mode not in EXPORT_WRITER_MODES:
+            raise ValueError(f"EXPORT_WRITER_MODE は {EXPORT_WRITER_MODES} のいずれかです: {mode}")
+        self._writer = None
+        if mode == "thread":
+            self._writer = _CsvWriterThread(
+                self._files,
+                queue_size=self.settings.getint('EXPORT_QUEUE_SIZE', 10000),
+                batch_size=self.settings.getint('EXPORT_BATCH_SIZE', 1000),
+                flush_interval=self.settings.getfloat('EXPORT_FLUSH_INTERVAL', 5.0),
+            )
+            self._writer.start()
+        # 鮮度の取得記録（FreshnessMiddleware が控えた分を、進捗と同じチェックポイントで確定する）
+        self._fetch_log = None
+        if self.settings.getbool('FRESHNESS_ENABLED'):
+            from .freshness import open_fetch_log
+            self._fetch_log = open_fetch_log(self.settings)
+        # reactor 上（scrapy crawl）なら満杯待ち・チェックポイントで reactor を止めない（replay はその場で待つ）
+        self._lock = None
+        if self._writer is not None and is_reactor_installed():
+            from twisted.internet.defer import DeferredLock
+            self._lock = DeferredLock()
+
+    @profiled
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
 
@@ -54,16 +287,478 @@ class CsvExportPipeline:
         if not filename:
             raise ValueError("CsvExportPipeline: item['_file'] が必須です。書き込み先CSVを指定してください。")
 
-        rec = self._ensure_writer(filename, adapter)
+        # 列順：最初のitemのキー順（先頭 '_' は除外）
+        fieldnames = self._fieldnames.get(filename)
+        if fieldnames is None:
+            fieldnames = self._fieldnames[filename] = [k for k in adapter.asdict().keys() if not str(k).startswith('_')]
 
         # 書き込み（ヘッダ順に合わせて整形）
-        row = {k: adapter.get(k, '') for k in rec["fieldnames"]}
-        rec["writer"].writerow(row)
+        row = {k: adapter.get(k, '') for k in fieldnames}
+        queued = None
+        if self._writer is not None:
+            queued = self._send((filename, fieldnames, row))
+        else:
+            self._files.write_rows(filename, fieldnames, [row])
+
+        progress = getattr(spider, 'progress', None)
+        if progress is not None and progress.pending_count >= self.checkpoint_every:
+            synced = self.checkpoint(spider)
+            if synced is not None:
+                # fsync を待たずに次の item へ（commit は書き込みスレッドの fsync 後に reactor 上で）
+                synced.addErrback(self._checkpoint_failed)
+        if queued is not None:
+            # キューが満杯 → 入るまでこの item を保留（背圧）
+            return queued.addCallback(lambda _: item)
         return item
 
+    def _send(self, msg):
+        """
+        書き込みスレッドのキューへ入れる。満杯なら reactor を止めずに別スレッドで待って入れる（Deferred を返す）
+        待っている間の後続も DeferredLock に並べて、キューに入る順序を保つ（replay 等 reactor 無しならその場で待つ）
+        """
+        if self._lock is None:
+            if not self._writer.offer(msg):
+                self._writer.put(msg)
+            return None
+        if not self._lock.locked and self._writer.offer(msg):
+            return None
+        from twisted.internet.threads import deferToThread
+        return self._lock.run(deferToThread, self._writer.put, msg)
+
+    def checkpoint(self, spider):
+        """
+        CSV を書き切って flush・fsync してから、書き終えたIDを進捗ストアへ確定
+        - 確定するのは呼んだ時点の未確定ID（take_pending）。以後の mark_done は次のチェックポイントへ
+        - 書き込みスレッドがあり reactor 上なら待たずに Deferred を返す
+          （スレッドが同期の印まで fsync したら callFromThread で reactor に戻り、そこで commit）
+        """
+        progress = getattr(spider, 'progress', None)
+        ids = progress.take_pending() if progress is not None else []
+        if self._writer is None or self._lock is None:
+            if self._writer is not None:
+                self._writer.sync(fsync=self.fsync)
+            else:
+                self._files.flush(fsync=self.fsync)
+            self._commit(progress, ids)
+            return None
+
+        from twisted.internet import reactor
+        from twisted.internet.defer import Deferred
+
+        synced = Deferred()
+        queued = self._send((None, self.fsync, lambda: reactor.callFromThread(synced.callback, None)))
+        if queued is not None:
+            queued.addErrback(synced.errback)
+        # 書き込みに失敗していたら commit しない（IDは未完了のまま次回取り直す）
+        synced.addCallback(lambda _: self._writer._raise_error())
+        synced.addCallback(lambda _: self._commit(progress, ids))
+        return synced
+
+    def _commit(self, progress, ids: list) -> None:
+        """進捗を確定し、同じIDの取得記録（freshness.py で控えた分）も確定"""
+        if progress is None:
+            return
+        progress.commit(ids)
+        if self._fetch_log is not None:
+            self._fetch_log.confirm(ids)
+
+    @staticmethod
+    def _checkpoint_failed(failure):
+        logger.error(f"チェックポイントに失敗しました（この区切りのIDは未完了のまま次回取り直します）: {failure.value!r}")
+
     def close_spider(self, spider):
-        for rec in self._files.values():
-            try:
-                rec["f"].close()
-            except Exception:
-                pass
+        try:
+            synced = self.checkpoint(spider)
+        except BaseException:
+            self._close()
+            raise
+        if synced is None:
+            self._close()
+            return None
+
+        def closed(result):
+            self._close()
+            return result
+        return synced.addBoth(closed)
+
+    def _close(self):
+        try:
+            if self._writer is not None:
+                self._writer.stop()
+                if self._writer.blocked:
+                    logger.warning(f"CSV 書き込みキューが満杯で待った回数: {self._writer.blocked}"
+                                   "（EXPORT_QUEUE_SIZE / EXPORT_BATCH_SIZE の見直し候補）")
+        finally:
+            self._files.close()
+            if self._fetch_log is not None:
+                self._fetch_log.close()
+
+
+def _field_names(adapter: ItemAdapter) -> list:
+    """出力する列（item クラスの宣言順。値が入っていないフィールドも含む。先頭 '_' は除外）"""
+    return [k for k in adapter.field_names() if not str(k).startswith('_')]
+
+
+# _file → {列: 型}。載っていない列は文字列のまま
+#   "int" / "float"
+#   "int_list" : "%" 区切りの数値（払戻 "110%150%300"）→ list<int64>
+#   "yen"      : "1億2,345万円" 等の金額 → int64（円）
+#   "date"     : "2019年4月5日" → date32
+PARQUET_COLUMN_TYPES = {
+    "race_result.csv": {
+        "gate_number": "int", "horse_number": "int", "horse_weight": "int",
+        "horse_weight_change": "int", "win_odds": "float", "odds_rank": "int",
+        "finish_position": "int",
+    },
+    "shutuba.csv": {
+        "gate_number": "int", "horse_number": "int", "horse_weight": "int",
+        "horse_weight_change": "int", "win_odds": "float", "odds_rank": "int",
+    },
+    "live_odds.csv": {
+        "horse_number": "int", "horse_weight": "int", "horse_weight_change": "int",
+        "win_odds": "float", "odds_rank": "int",
+    },
+    "race_info.csv": {
+        "track_bias_index": "int",
+    },
+    "race_odds.csv": {
+        f"{bet}_dividend": "int_list"
+        for bet in ("win", "place", "bracket_quinella", "quinella", "quinella_place", "exacta", "trio", "trifecta")
+    },
+    "horse_info.csv": {
+        "dob": "date", "auction_price": "yen", "earnings_jra": "yen", "earnings_local": "yen",
+    },
+}
+
+
+def _to_int(v):
+    s = str(v).strip().replace(",", "").replace("−", "-").strip("()")
+    try:
+        return int(s)
+    except ValueError:
+        return None
+
+
+def _to_float(v):
+    s = str(v).strip().replace(",", "")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _to_int_list(v):
+    s = str(v).strip()
+    if not s:
+        return None
+    return [_to_int(p) for p in s.split("%")]
+
+
+_YEN = re.compile(r"(?:(\d+)億)?(?:(\d+(?:\.\d+)?)万)?(\d+)?円")
+
+
+def _to_yen(v):
+    m = _YEN.match(str(v).replace(",", "").replace(" ", ""))
+    if m is None or not any(m.groups()):
+        return None
+    oku, man, en = m.groups()
+    return int(oku or 0) * 100_000_000 + round(float(man or 0) * 10_000) + int(en or 0)
+
+
+_DATE = re.compile(r"(\d{4})年(\d{1,2})月(\d{1,2})日")
+
+
+def _to_date(v):
+    m = _DATE.search(str(v))
+    if m is None:
+        return None
+    try:
+        return datetime.date(*map(int, m.groups()))
+    except ValueError:
+        return None
+
+
+def _open_id_codes(settings):
+    """ID_CODES_ENABLED の pipeline が共有する IdInterner 群（numpy が必要）"""
+    from .id_codes import default_root, open_interners
+    return open_interners(default_root(settings))
+
+
+class ParquetExportPipeline:
+    """
+    CsvExportPipeline と並べて使う列指向（Parquet）出力
+    - 振り分けは CSV と同じ item['_file']（race_result.csv → parquet/race_result/）
+    - race_id を持つ item は race_id の桁から year=YYYY/venue=JJ で分割（Hive 形式）
+      → pyarrow.dataset / pandas.read_parquet で年・場・列を絞って読める
+    - 列は item クラスのフィールド（最初の item に無い列も落とさない。CSV の列は従来どおり最初の item のキー）
+    - 型は PARQUET_COLUMN_TYPES（数値・金額・日付に変換できない値は null）
+    - 分割ごとにメモリへ溜め、PARQUET_ROW_GROUP_SIZE 行 か PARQUET_FLUSH_INTERVAL 秒で1ファイル書き出し
+    - ID_CODES_ENABLED なら ID 列毎に {列}_code（int32、id_codes.py）も書く
+    ※ 未書き出し分はクラッシュで失われる（正本は CSV。replay でも作り直せる）
+    """
+    def __init__(self, settings):
+        if not settings.getbool('PARQUET_EXPORT_ENABLED'):
+            raise NotConfigured
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            logger.error("PARQUET_EXPORT_ENABLED ですが pyarrow が入っていません（pip install pyarrow）")
+            raise NotConfigured
+        self.row_group_size = settings.getint('PARQUET_ROW_GROUP_SIZE', 50000)
+        self.flush_interval = settings.getfloat('PARQUET_FLUSH_INTERVAL', 300.0)
+        self.id_codes = settings.getbool('ID_CODES_ENABLED')
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def open_spider(self, spider):
+        base = spider.settings.get('OUTPUT_BASE_DIR', 'data')
+        self.base_dir = spider.settings.get('PARQUET_BASE_DIR') or os.path.join(base, 'parquet')
+        self.interners = _open_id_codes(spider.settings) if self.id_codes else None
+        # filename -> 列順（item クラスのフィールド順）
+        self._fieldnames = {}
+        # (filename, partition) -> {"rows": [...], "since": 最初の行を溜めた時刻}
+        self._buffers = {}
+        self._seq = 0
+
+    @staticmethod
+    def partition_of(adapter: ItemAdapter) -> tuple:
+        race_id = str(adapter.get('race_id') or '')
+        if len(race_id) == 12 and race_id.isdigit():
+            return (("year", race_id[:4]), ("venue", race_id[4:6]))
+        return ()
+
+    @profiled
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        filename = adapter.get('_file')
+        if not filename:
+            raise ValueError("ParquetExportPipeline: item['_file'] が必須です。")
+
+        if filename not in self._fieldnames:
+            self._fieldnames[filename] = _field_names(adapter)
+        key = (filename, self.partition_of(adapter))
+        buf = self._buffers.setdefault(key, {"rows": [], "since": time.monotonic()})
+        buf["rows"].append({k: adapter.get(k) for k in self._fieldnames[filename]})
+
+        if len(buf["rows"]) >= self.row_group_size:
+            self._flush(key)
+        else:
+            now = time.monotonic()
+            for k in [k for k, b in self._buffers.items() if now - b["since"] >= self.flush_interval]:
+                self._flush(k)
+        return item
+
+    def _table(self, filename: str, rows: list):
+        import pyarrow as pa
+
+        types = PARQUET_COLUMN_TYPES.get(filename, {})
+        columns = {}
+        for col in self._fieldnames[filename]:
+            values = [r.get(col) for r in rows]
+            kind = types.get(col)
+            if kind == "int":
+                columns[col] = pa.array([None if v in (None, '') else _to_int(v) for v in values], type=pa.int32())
+            elif kind == "float":
+                columns[col] = pa.array([None if v in (None, '') else _to_float(v) for v in values], type=pa.float64())
+            elif kind == "int_list":
+                columns[col] = pa.array([None if v is None else _to_int_list(v) for v in values], type=pa.list_(pa.int64()))
+            elif kind == "yen":
+                columns[col] = pa.array([None if v in (None, '') else _to_yen(v) for v in values], type=pa.int64())
+            elif kind == "date":
+                columns[col] = pa.array([None if v in (None, '') else _to_date(v) for v in values], type=pa.date32())
+            else:
+                columns[col] = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+        if self.interners:
+            from .id_codes import ID_FIELDS, code_columns
+
+            for col, code_col in code_columns(self._fieldnames[filename]):
+                codes = self.interners[ID_FIELDS[col]].encode([r.get(col) or '' for r in rows])
+                columns[code_col] = pa.array(codes, mask=codes < 0, type=pa.int32())
+        return pa.table(columns)
+
+    def _flush(self, key) -> None:
+        import pyarrow.parquet as pq
+
+        buf = self._buffers.pop(key, None)
+        if not buf or not buf["rows"]:
+            return
+        filename, partition = key
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        out_dir = os.path.join(self.base_dir, stem, *(f"{k}={v}" for k, v in partition))
+        os.makedirs(out_dir, exist_ok=True)
+
+        self._seq += 1
+        path = os.path.join(out_dir, f"part-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{self._seq:05d}.parquet")
+        tmp = f"{path}.tmp"
+        table = self._table(filename, buf["rows"])
+        if self.interners:
+            # 新しく振ったコードを、それを使うファイルより先に書く
+            from .id_codes import flush_all
+            flush_all(self.interners)
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, path)
+
+    def close_spider(self, spider):
+        for key in list(self._buffers):
+            self._flush(key)
+
+
+class SqliteStoragePipeline:
+    """
+    item を SQLite（storage.py）にも書く pipeline（STORAGE_ENABLED）
+    - テーブル毎に STORAGE_BATCH_SIZE 件溜めて1トランザクションで upsert
+    - 残りは close_spider で書く（正本は CSV）
+    - ID_CODES_ENABLED なら ID 列毎に {列}_code（INTEGER、id_codes.py）も書く
+    """
+    def __init__(self, settings):
+        if not settings.getbool("STORAGE_ENABLED"):
+            raise NotConfigured
+        self.batch_size = settings.getint("STORAGE_BATCH_SIZE", 500)
+        self.id_codes = settings.getbool("ID_CODES_ENABLED")
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def open_spider(self, spider):
+        self.storage = open_storage(settings=spider.settings)
+        self.interners = _open_id_codes(spider.settings) if self.id_codes else None
+        # filename -> (table, fields, code_cols, rows)
+        self._buffers = {}
+
+    @profiled
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        filename = adapter.get("_file")
+        if not filename:
+            raise ValueError("SqliteStoragePipeline: item['_file'] が必須です。")
+
+        buf = self._buffers.get(filename)
+        if buf is None:
+            fields = _field_names(adapter)
+            code_cols = []
+            if self.interners:
+                from .id_codes import code_columns
+                code_cols = code_columns(fields)
+            table = self.storage.ensure_table(filename, fields + [c for _, c in code_cols],
+                                              {c: "int" for _, c in code_cols})
+            buf = self._buffers[filename] = (table, fields, code_cols, [])
+        table, fields, code_cols, rows = buf
+        values = tuple(adapter.get(k) for k in fields)
+        if code_cols:
+            from .id_codes import ID_FIELDS
+            codes = (self.interners[ID_FIELDS[col]].code(adapter.get(col)) for col, _ in code_cols)
+            values += tuple(c if c >= 0 else None for c in codes)
+        rows.append(values)
+        if len(rows) >= self.batch_size:
+            self._flush(filename)
+        return item
+
+    def _flush(self, filename: str) -> None:
+        table, fields, code_cols, rows = self._buffers[filename]
+        if code_cols:
+            from .id_codes import flush_all
+            flush_all(self.interners)
+        self.storage.upsert_many(table, fields + [c for _, c in code_cols], rows)
+        rows.clear()
+
+    def close_spider(self, spider):
+        try:
+            for filename in self._buffers:
+                self._flush(filename)
+        finally:
+            self.storage.close()
+
+
+class FeatureStorePipeline:
+    """
+    RaceResultItem を特徴量ストア（processing/features.py）へ追加反映する pipeline（FEATURE_STORE_ENABLED）
+    - 日付は同じページの RaceInfoItem（race_info.csv）の race_info から取る
+    - FEATURE_STORE_FLUSH_RACES レース溜まる毎に、日付順に反映して flush（残りは close_spider）
+    """
+    def __init__(self, settings):
+        if not settings.getbool('FEATURE_STORE_ENABLED'):
+            raise NotConfigured
+        self.flush_races = settings.getint('FEATURE_STORE_FLUSH_RACES', 100)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def open_spider(self, spider):
+        from .processing.features import FeatureStore, default_root
+
+        self.store = FeatureStore(default_root(spider.settings), _open_id_codes(spider.settings))
+        # race_id -> 日付 / 結果行
+        self._dates = {}
+        self._rows = {}
+
+    @profiled
+    def process_item(self, item, spider):
+        from .processing.features import parse_race_date
+
+        adapter = ItemAdapter(item)
+        filename = adapter.get('_file')
+        race_id = adapter.get('race_id')
+        if filename == 'race_info.csv' and race_id:
+            self._dates[race_id] = parse_race_date(adapter.get('race_info') or '')
+        elif filename == 'race_result.csv' and race_id:
+            self._rows.setdefault(race_id, []).append(adapter.asdict())
+            if len(self._rows) > self.flush_races:
+                self._apply()
+        return item
+
+    def _apply(self) -> None:
+        for race_id in sorted(self._rows, key=lambda r: (self._dates.get(r, 0), r)):
+            self.store.apply_race(race_id, self._dates.pop(race_id, 0), self._rows[race_id])
+        self._rows.clear()
+        self.store.flush()
+
+    def close_spider(self, spider):
+        try:
+            self._apply()
+        finally:
+            self.store.close()
+
+
+class FreshnessPipeline:
+    """
+    新しく取れたレース結果に出てきた馬を、鮮度記録（freshness.py）で「古い」にする pipeline（FRESHNESS_ENABLED）
+    → 次の horse_info_spider で、走った馬のページだけが FRESHNESS_MAX_AGE を待たずに取り直される
+    """
+    def __init__(self, settings):
+        if not settings.getbool('FRESHNESS_ENABLED'):
+            raise NotConfigured
+        self.batch_size = settings.getint('STORAGE_BATCH_SIZE', 500)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings)
+
+    def open_spider(self, spider):
+        from .freshness import open_fetch_log
+
+        self.log = open_fetch_log(spider.settings)
+        self._horse_ids = set()
+
+    @profiled
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        if adapter.get('_file') == 'race_result.csv' and adapter.get('horse_id'):
+            self._horse_ids.add(adapter.get('horse_id'))
+            if len(self._horse_ids) >= self.batch_size:
+                self._flush()
+        return item
+
+    def _flush(self) -> None:
+        if self._horse_ids:
+            self.log.invalidate('horse', sorted(self._horse_ids))
+            self._horse_ids.clear()
+
+    def close_spider(self, spider):
+        try:
+            self._flush()
+        finally:
+            self.log.close()
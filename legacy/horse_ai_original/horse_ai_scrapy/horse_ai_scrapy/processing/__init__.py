@@ -0,0 +1,3 @@
+# 取得済みCSV（{OUTPUT_BASE_DIR}）を学習用の配列に変換する処理群
+#
+# クロールとは独立して、python -m horse_ai_scrapy.processing.<module> で実行します。
@@ -0,0 +1,61 @@
+# horse_ai_scrapy/processing/arrays.py
+"""processing 共通の numpy 補助（行内位置・配置・CSV 由来キャッシュ）"""
+import os
+import re
+
+import numpy as np
+
+
+def tokenize(pattern: re.Pattern, values) -> tuple[np.ndarray, np.ndarray]:
+    """
+    列全体を1回の正規表現でトークン化し (トークン, 行番号) を返す
+    pattern は区切りとして "\\n" にもマッチすること（改行トークン自体は返さない）
+    """
+    text = "\n".join(v.replace("\n", " ") if v else "" for v in values)
+    tokens = np.array(pattern.findall(text) or [""], dtype=str)
+    is_nl = tokens == "\n"
+    rows = np.cumsum(is_nl)
+    keep = ~is_nl & (tokens != "")
+    return tokens[keep], rows[keep]
+
+
+def column_in_row(rows: np.ndarray) -> np.ndarray:
+    """行番号（非減少）の並びから、各要素が行内で何番目か（0始まり）"""
+    if rows.size == 0:
+        return rows
+    return np.arange(rows.size) - np.searchsorted(rows, rows)
+
+
+def scatter(n_rows: int, rows: np.ndarray, cols: np.ndarray, values: np.ndarray, fill, dtype) -> np.ndarray:
+    """(行, 列, 値) を [n_rows, 最大列+1] の行列に置く"""
+    width = int(cols.max()) + 1 if cols.size else 0
+    out = np.full((n_rows, width), fill, dtype=dtype)
+    out[rows, cols] = values
+    return out
+
+
+def cache_path_of(csv_path: str, name: str) -> str:
+    """{CSVのフォルダ}/.cache/{name}.npz"""
+    return os.path.join(os.path.dirname(csv_path) or ".", ".cache", f"{name}.npz")
+
+
+def load_cached(csv_path: str, name: str, build, version: int = 1, refresh: bool = False) -> dict[str, np.ndarray]:
+    """
+    CSV から作る配列群をキャッシュ付きで返す
+    - キャッシュは CSV のサイズ・更新時刻・version が一致する時だけ使う
+    - build(csv_path) -> dict[str, ndarray]
+    """
+    cache = cache_path_of(csv_path, name)
+    st = os.stat(csv_path)
+    stamp = np.array([version, st.st_size, st.st_mtime_ns], dtype=np.int64)
+    if not refresh and os.path.exists(cache):
+        with np.load(cache) as z:
+            if "_source" in z and np.array_equal(z["_source"], stamp):
+                return {k: z[k] for k in z.files if not k.startswith("_")}
+
+    arrays = build(csv_path)
+    os.makedirs(os.path.dirname(cache), exist_ok=True)
+    tmp = cache + ".tmp.npz"
+    np.savez(tmp, _source=stamp, **arrays)
+    os.replace(tmp, cache)
+    return arrays
@@ -0,0 +1,386 @@
+# horse_ai_scrapy/processing/features.py
+"""
+馬 / 騎手 / 調教師ごとの「直近の成績」特徴量ストア（memmap の固定幅配列）
+
+保存先は {OUTPUT_BASE_DIR}/features/（既定）:
+  - {entity}/{列}.npy           : 行 = ID のコード（id_codes.py の int32 コード）の固定幅配列
+                                  （np.load(mmap_mode="r+") で開く）
+      n_runs / n_wins / n_top3  : int32  出走数・1着数・3着内数
+      last_date                 : int32  最後に走った日（1970-01-01 からの日数、0 は不明）
+      recent_finish             : int8   [N] 直近N走の着順（新しい順、0 は不明/中止等）
+      recent_odds_rank          : int8   [N] 直近N走の人気
+      recent_weight_change      : int16  [N] 直近N走の馬体重増減（馬のみ）
+      recent_date               : int32  [N] 直近N走の日付
+  - applied_races.txt           : 反映済み race_id（同じレースを二重に数えない）
+
+- FeatureStorePipeline（pipelines.py）がクロール中の RaceResultItem を日付順に追加反映
+- 出馬表の特徴量は features_for() で ID→コードを引いて配列を切り出すだけ（CSV は読まない）
+- 作り直しは rebuild()：race_result.csv / race_info.csv を読み、(entity, 行範囲) 毎にプロセス並列で集計
+
+使い方（scrapy.cfg のあるディレクトリで）:
+    python -m horse_ai_scrapy.processing.features rebuild --jobs 8
+    python -m horse_ai_scrapy.processing.features show horse 2019104567
+"""
+import argparse
+import csv
+import datetime as dt
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ..id_codes import IdInterner, default_root as id_codes_root, flush_all, open_interners
+
+# entity → race_result.csv の列
+ENTITIES = {"horse": "horse_id", "jockey": "jockey_id", "trainer": "trainer_id"}
+RECENT_N = 5
+# 直近N走の配列（entity 毎に持つ列）
+RECENT_FIELDS = {
+    "horse": ("finish", "odds_rank", "weight_change", "date"),
+    "jockey": ("finish", "odds_rank", "date"),
+    "trainer": ("finish", "odds_rank", "date"),
+}
+COUNTERS = ("n_runs", "n_wins", "n_top3", "last_date")
+_DTYPES = {"finish": np.int8, "odds_rank": np.int8, "weight_change": np.int16, "date": np.int32}
+
+_EPOCH = dt.date(1970, 1, 1)
+_DATE = re.compile(r"(\d{4})年(\d{1,2})月(\d{1,2})日")
+_INT = re.compile(r"[-+−]?\d+")
+
+
+def parse_race_date(text: str) -> int:
+    """race_info（'2025年05月10日 2回東京6日目 …'）→ 1970-01-01 からの日数（取れなければ 0）"""
+    m = _DATE.search(text or "")
+    if not m:
+        return 0
+    try:
+        return (dt.date(int(m.group(1)), int(m.group(2)), int(m.group(3))) - _EPOCH).days
+    except ValueError:
+        return 0
+
+
+def to_int(value, default: int = 0) -> int:
+    m = _INT.search(str(value or ""))
+    return int(m.group(0).replace("−", "-")) if m else default
+
+
+def _columns_of(entity: str) -> dict[str, tuple]:
+    """列名 → (dtype, 幅)（幅 0 はスカラー）"""
+    cols = {c: (np.int32, 0) for c in COUNTERS}
+    for f in RECENT_FIELDS[entity]:
+        cols[f"recent_{f}"] = (_DTYPES[f], RECENT_N)
+    return cols
+
+
+def _shape(n: int, width: int) -> tuple:
+    return (n, width) if width else (n,)
+
+
+class FeatureStore:
+    """
+    特徴量ストア本体
+    - apply_race() で1レース分を反映（反映済みの race_id は無視）
+    - features_for() で出馬表（馬・騎手・調教師のID列）の特徴量を返す
+    - flush() で ID コード・memmap・applied_races.txt をディスクへ
+    """
+    def __init__(self, root: str, interners: dict[str, IdInterner]):
+        self.root = root
+        self.interners = interners
+        os.makedirs(root, exist_ok=True)
+        self._arrays: dict[str, dict[str, np.ndarray]] = {}
+        for entity in ENTITIES:
+            edir = os.path.join(root, entity)
+            if os.path.exists(os.path.join(edir, "ids.txt")):
+                raise RuntimeError(f"{root} は旧形式（ids.txt）です。rebuild で作り直してください。")
+            os.makedirs(edir, exist_ok=True)
+            n = len(interners[entity])
+            self._arrays[entity] = {
+                col: _open_array(os.path.join(edir, f"{col}.npy"), dtype, width, n)
+                for col, (dtype, width) in _columns_of(entity).items()
+            }
+        applied_path = os.path.join(root, "applied_races.txt")
+        self._applied = set(_read_lines(applied_path))
+        self._new_applied: list[str] = []
+
+    # ---------- 行番号（= ID コード） ----------
+    def slot(self, entity: str, entity_id: str, create: bool = False) -> int:
+        i = self.interners[entity].code(entity_id, create=create)
+        if i >= 0:
+            self._ensure_capacity(entity, i + 1)
+        return i
+
+    def _ensure_capacity(self, entity: str, n: int) -> None:
+        arrays = self._arrays[entity]
+        cap = next(iter(arrays.values())).shape[0]
+        if n <= cap:
+            return
+        new_cap = max(n, cap * 2, 1024)
+        edir = os.path.join(self.root, entity)
+        for col, (dtype, width) in _columns_of(entity).items():
+            old = arrays[col]
+            old.flush()
+            path = os.path.join(edir, f"{col}.npy")
+            tmp = path + ".grow.npy"
+            grown = np.lib.format.open_memmap(tmp, mode="w+", dtype=dtype, shape=_shape(new_cap, width))
+            grown[:cap] = old
+            grown.flush()
+            del old, grown
+            arrays[col] = None
+            os.replace(tmp, path)
+            arrays[col] = np.load(path, mmap_mode="r+")
+
+    # ---------- 更新 ----------
+    def apply_race(self, race_id: str, date: int, rows: list[dict]) -> bool:
+        """
+        1レース分（RaceResultItem 相当の dict のリスト）を反映
+        日付が各IDの last_date より古いレースは通算成績にだけ足し、直近N走は動かさない
+        """
+        if race_id in self._applied:
+            return False
+        for entity, key in ENTITIES.items():
+            arrays = self._arrays[entity]
+            recent = RECENT_FIELDS[entity]
+            for row in rows:
+                i = self.slot(entity, row.get(key) or "", create=True)
+                if i < 0:
+                    continue
+                finish = to_int(row.get("finish_position"))
+                arrays["n_runs"][i] += 1
+                arrays["n_wins"][i] += finish == 1
+                arrays["n_top3"][i] += 1 <= finish <= 3
+                if date and date < arrays["last_date"][i]:
+                    continue
+                arrays["last_date"][i] = date
+                values = {
+                    "finish": finish,
+                    "odds_rank": to_int(row.get("odds_rank")),
+                    "weight_change": to_int(row.get("horse_weight_change")),
+                    "date": date,
+                }
+                for f in recent:
+                    a = arrays[f"recent_{f}"]
+                    a[i, 1:] = a[i, :-1]
+                    a[i, 0] = values[f]
+        self._applied.add(race_id)
+        self._new_applied.append(race_id)
+        return True
+
+    def flush(self) -> None:
+        # コードを先に書く（配列の行がどの ID か分からなくならないように）
+        flush_all(self.interners)
+        for entity in ENTITIES:
+            for a in self._arrays[entity].values():
+                a.flush()
+        if self._new_applied:
+            _append_lines(os.path.join(self.root, "applied_races.txt"), self._new_applied)
+            self._new_applied.clear()
+
+    def close(self) -> None:
+        self.flush()
+        self._arrays.clear()
+
+    # ---------- 参照 ----------
+    def features_for(self, race_date: int, horse_ids, jockey_ids=None, trainer_ids=None) -> dict[str, np.ndarray]:
+        """
+        出馬表の特徴量（出走頭数ぶんの配列）。未知のIDは 0 / -1
+        キー: {entity}_n_runs, {entity}_win_rate, {entity}_top3_rate, {entity}_days_since_last, {entity}_recent_*
+        """
+        out = {}
+        for entity, ids in (("horse", horse_ids), ("jockey", jockey_ids), ("trainer", trainer_ids)):
+            if ids is None:
+                continue
+            slots = self.interners[entity].encode(ids, create=False).astype(np.int64)
+            arrays = self._arrays[entity]
+            known = (slots >= 0) & (slots < arrays["n_runs"].shape[0])
+            take = np.where(known, slots, 0)
+            n_runs = np.where(known, arrays["n_runs"][take], 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                out[f"{entity}_n_runs"] = n_runs
+                out[f"{entity}_win_rate"] = np.where(n_runs > 0, arrays["n_wins"][take] / n_runs, np.nan)
+                out[f"{entity}_top3_rate"] = np.where(n_runs > 0, arrays["n_top3"][take] / n_runs, np.nan)
+            last = arrays["last_date"][take]
+            out[f"{entity}_days_since_last"] = np.where(known & (last > 0) & (race_date > 0), race_date - last, -1)
+            for f in RECENT_FIELDS[entity]:
+                a = arrays[f"recent_{f}"][take]
+                a[~known] = 0
+                out[f"{entity}_recent_{f}"] = a
+        return out
+
+    def row(self, entity: str, entity_id: str) -> dict | None:
+        i = self.slot(entity, entity_id)
+        if i < 0:
+            return None
+        return {col: a[i].tolist() for col, a in self._arrays[entity].items()}
+
+
+def _read_lines(path: str) -> list[str]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def _append_lines(path: str, lines: list[str]) -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("".join(f"{v}\n" for v in lines))
+
+
+def _open_array(path: str, dtype, width: int, n: int) -> np.ndarray:
+    if not os.path.exists(path):
+        a = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=_shape(max(n, 1024), width))
+        a.flush()
+        del a
+    return np.load(path, mmap_mode="r+")
+
+
+# ---------- 作り直し（バッチ） ----------
+def _read_stream(race_result_csv: str, race_info_csv: str | None) -> dict[str, np.ndarray]:
+    """race_result.csv を日付→race_id 順に並べた列の配列"""
+    dates = {}
+    if race_info_csv and os.path.exists(race_info_csv):
+        with open(race_info_csv, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                dates[row.get("race_id") or ""] = parse_race_date(row.get("race_info") or "")
+
+    cols = {"race_id": [], "horse_id": [], "jockey_id": [], "trainer_id": [],
+            "finish": [], "odds_rank": [], "weight_change": []}
+    with open(race_result_csv, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if not row.get("race_id"):
+                continue
+            cols["race_id"].append(row["race_id"])
+            for k in ("horse_id", "jockey_id", "trainer_id"):
+                cols[k].append(row.get(k) or "")
+            cols["finish"].append(to_int(row.get("finish_position")))
+            cols["odds_rank"].append(to_int(row.get("odds_rank")))
+            cols["weight_change"].append(to_int(row.get("horse_weight_change")))
+
+    race_id = np.asarray(cols["race_id"], dtype=str)
+    date = np.array([dates.get(r, 0) for r in cols["race_id"]], dtype=np.int32)
+    # 同じ (race_id, 馬) が重複していたら後の行を使う（追記CSVの取り直し分）
+    key = np.char.add(np.char.add(race_id, "/"), np.asarray(cols["horse_id"], dtype=str))
+    _, last = np.unique(key[::-1], return_index=True)
+    keep = np.sort(key.size - 1 - last)
+    order = keep[np.lexsort((race_id[keep], date[keep]))]
+    return {
+        "race_id": race_id[order],
+        "date": date[order],
+        "horse_id": np.asarray(cols["horse_id"], dtype=str)[order],
+        "jockey_id": np.asarray(cols["jockey_id"], dtype=str)[order],
+        "trainer_id": np.asarray(cols["trainer_id"], dtype=str)[order],
+        "finish": np.asarray(cols["finish"], dtype=np.int8)[order],
+        "odds_rank": np.asarray(cols["odds_rank"], dtype=np.int8)[order],
+        "weight_change": np.asarray(cols["weight_change"], dtype=np.int16)[order],
+    }
+
+
+def _aggregate(args) -> None:
+    """ワーカー：1 entity の行番号 [lo, hi) を、時系列順の行から一括で集計して memmap に書く"""
+    root, entity, lo, hi, stream_dir = args
+    slots = np.load(os.path.join(stream_dir, f"{entity}_slot.npy"), mmap_mode="r")
+    sel = np.flatnonzero((slots >= lo) & (slots < hi))
+    if sel.size == 0:
+        return
+    s = slots[sel] - lo
+    # 行番号毎にまとめる（stable なので各グループ内は時系列順のまま）
+    order = np.argsort(s, kind="stable")
+    sel, s = sel[order], s[order]
+    values = {f: np.load(os.path.join(stream_dir, f"{f}.npy"), mmap_mode="r")[sel] for f in _DTYPES}
+    n = hi - lo
+
+    edir = os.path.join(root, entity)
+    out = {col: np.load(os.path.join(edir, f"{col}.npy"), mmap_mode="r+") for col in _columns_of(entity)}
+    finish = values["finish"]
+    out["n_runs"][lo:hi] = np.bincount(s, minlength=n)
+    out["n_wins"][lo:hi] = np.bincount(s, weights=finish == 1, minlength=n).astype(np.int32)
+    out["n_top3"][lo:hi] = np.bincount(s, weights=(finish >= 1) & (finish <= 3), minlength=n).astype(np.int32)
+
+    # 各グループの末尾（最新）から N 本
+    end = np.searchsorted(s, np.arange(n), side="right")
+    start = np.searchsorted(s, np.arange(n), side="left")
+    has = end > start
+    out["last_date"][lo:hi] = np.where(has, values["date"][np.maximum(end - 1, 0)], 0)
+    for f in RECENT_FIELDS[entity]:
+        a = np.zeros((n, RECENT_N), dtype=_DTYPES[f])
+        for k in range(RECENT_N):
+            idx = end - 1 - k
+            ok = idx >= start
+            a[ok, k] = values[f][idx[ok]]
+        out[f"recent_{f}"][lo:hi] = a
+    for a in out.values():
+        a.flush()
+
+
+def rebuild(root: str, interners: dict[str, IdInterner], race_result_csv: str,
+            race_info_csv: str | None = None, jobs: int | None = None) -> None:
+    """CSV から特徴量ストアを作り直す（既存の root は置き換え。ID コードは追記して使い続ける）"""
+    jobs = jobs or os.cpu_count() or 1
+    stream = _read_stream(race_result_csv, race_info_csv)
+
+    tmp_root = root.rstrip("/\\") + ".rebuild"
+    shutil.rmtree(tmp_root, ignore_errors=True)
+    stream_dir = os.path.join(tmp_root, "_stream")
+    os.makedirs(stream_dir)
+    for f in _DTYPES:
+        np.save(os.path.join(stream_dir, f"{f}.npy"), stream[f])
+
+    tasks = []
+    for entity, key in ENTITIES.items():
+        edir = os.path.join(tmp_root, entity)
+        os.makedirs(edir)
+        # 空ID（リンク無し）は -1 → 行を持たない
+        slot = interners[entity].encode(stream[key])
+        n = len(interners[entity])
+        np.save(os.path.join(stream_dir, f"{entity}_slot.npy"), slot.astype(np.int64))
+        for col, (dtype, width) in _columns_of(entity).items():
+            a = np.lib.format.open_memmap(os.path.join(edir, f"{col}.npy"), mode="w+", dtype=dtype,
+                                          shape=_shape(max(n, 1024), width))
+            a.flush()
+            del a
+        step = -(-n // jobs) if n else 1
+        tasks += [(tmp_root, entity, lo, min(lo + step, n), stream_dir) for lo in range(0, n, step)]
+    flush_all(interners)
+
+    with ProcessPoolExecutor(max_workers=jobs) as ex:
+        list(ex.map(_aggregate, tasks))
+
+    _append_lines(os.path.join(tmp_root, "applied_races.txt"), np.unique(stream["race_id"]).tolist())
+    shutil.rmtree(stream_dir)
+    shutil.rmtree(root, ignore_errors=True)
+    os.replace(tmp_root, root)
+
+
+def default_root(settings) -> str:
+    return settings.get("FEATURE_STORE_DIR") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), "features")
+
+
+def main():
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    base = settings.get("OUTPUT_BASE_DIR", "data")
+    ap = argparse.ArgumentParser(description="馬・騎手・調教師の直近成績の特徴量ストア")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    rb = sub.add_parser("rebuild", help="race_result.csv / race_info.csv から作り直す")
+    rb.add_argument("--race-result", default=os.path.join(base, "race_result.csv"))
+    rb.add_argument("--race-info", default=os.path.join(base, "race_info.csv"))
+    rb.add_argument("--jobs", type=int, default=None, help="並列プロセス数（既定: CPUコア数）")
+    sh = sub.add_parser("show", help="1件の中身を表示")
+    sh.add_argument("entity", choices=sorted(ENTITIES))
+    sh.add_argument("entity_id")
+    args = ap.parse_args()
+
+    root = default_root(settings)
+    interners = open_interners(id_codes_root(settings))
+    if args.cmd == "rebuild":
+        rebuild(root, interners, args.race_result, args.race_info, jobs=args.jobs)
+        print(f"[FEATURES] rebuilt → {root}")
+    else:
+        store = FeatureStore(root, interners)
+        print(store.row(args.entity, args.entity_id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# horse_ai_scrapy/processing/pace.py
+"""
+race_info.csv のラップ / ペース / コーナー通過順（文字列）を列まとめて numpy 配列に変換します。
+
+  - laps        : float32 [レース数, 最大ハロン数]  1ハロン毎のラップ（無い所は NaN）
+  - n_laps      : int16   [レース数]
+  - pace_cum    : float32 [レース数, 最大区間数]   ペースの累計タイム
+  - pace_front / pace_back : float32 [レース数]    前半3F / 後半3F（括弧内。無ければラップの先頭/末尾3本の和）
+  - corner3_pos / corner4_pos : int8  [レース数, 19]  馬番 → 何番手（0 は不明）
+  - corner3_gap / corner4_gap : int8  [レース数, 19]  馬番 → 先頭からの差の目安（"-" を1、"=" を2として累積、-1 は不明）
+
+行毎に Python で文字列を回さず、列全体を1回の正規表現でトークン化 → numpy で行・列位置を求めて配置します。
+結果は CSV と同じフォルダの .cache/race_info.pace.npz に保存し、CSV が変わるまで再利用します。
+
+使い方（scrapy.cfg のあるディレクトリで）:
+    python -m horse_ai_scrapy.processing.pace data/race_info.csv
+"""
+import argparse
+import csv
+import os
+import re
+
+import numpy as np
+
+from .arrays import cache_path_of, column_in_row, load_cached, scatter, tokenize
+
+# 馬番の上限（JRA は最大18頭。列0は使わない）
+MAX_HORSE_NUMBER = 18
+CACHE_NAME = "race_info.pace"
+CACHE_VERSION = 1
+
+_LAP_TOKEN = re.compile(r"\d+(?:\.\d+)?|\n")
+_PACE_TOKEN = re.compile(r"\d+\.\d+|\(|\n")
+_CORNER_TOKEN = re.compile(r"\d+|[()\-=\n]")
+
+# コーナー通過順の区切り → 差の目安
+_GAP_UNITS = {"-": 1, "=": 2}
+
+
+# ---------- ラップ ----------
+def parse_laps(values) -> tuple[np.ndarray, np.ndarray]:
+    """'12.3 - 10.9 - 11.4 ...' の列 → (laps [n, max], n_laps [n])"""
+    n = len(values)
+    tokens, rows = tokenize(_LAP_TOKEN, values)
+    laps = scatter(n, rows, column_in_row(rows), tokens.astype(np.float32), np.nan, np.float32)
+    n_laps = np.bincount(rows, minlength=n)[:n].astype(np.int16)
+    return laps, n_laps
+
+
+def _edge_sums(laps: np.ndarray, n_laps: np.ndarray, k: int = 3) -> tuple[np.ndarray, np.ndarray]:
+    """先頭k本 / 末尾k本の和（k本に満たない行は NaN）"""
+    n = laps.shape[0]
+    front = np.full(n, np.nan, dtype=np.float32)
+    back = np.full(n, np.nan, dtype=np.float32)
+    ok = n_laps >= k
+    if laps.shape[1] >= k and ok.any():
+        front[ok] = laps[ok, :k].sum(axis=1)
+        idx = n_laps[ok, None] - k + np.arange(k)
+        back[ok] = np.take_along_axis(laps[ok], idx.astype(np.intp), axis=1).sum(axis=1)
+    return front, back
+
+
+# ---------- ペース ----------
+def parse_pace(values) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """'12.3 - 23.2 - 34.6 ... (34.6-35.9)' の列 → (pace_cum [n, max], front [n], back [n])"""
+    n = len(values)
+    tokens, rows = tokenize(_PACE_TOKEN, values)
+    is_open = tokens == "("
+    # 行内で "(" より後ろか
+    opens = np.cumsum(is_open)
+    row_start = np.searchsorted(rows, rows)
+    in_paren = (opens - np.where(row_start > 0, opens[row_start - 1], 0)) > 0 if rows.size else is_open
+
+    nums = ~is_open
+    cum_mask = nums & ~in_paren
+    pace_cum = scatter(n, rows[cum_mask], column_in_row(rows[cum_mask]),
+                       tokens[cum_mask].astype(np.float32), np.nan, np.float32)
+
+    par_mask = nums & in_paren
+    par_rows = rows[par_mask]
+    par_cols = column_in_row(par_rows)
+    par_vals = tokens[par_mask].astype(np.float32)
+    front = np.full(n, np.nan, dtype=np.float32)
+    back = np.full(n, np.nan, dtype=np.float32)
+    front[par_rows[par_cols == 0]] = par_vals[par_cols == 0]
+    back[par_rows[par_cols == 1]] = par_vals[par_cols == 1]
+    return pace_cum, front, back
+
+
+# ---------- コーナー通過順 ----------
+def parse_corner_order(values) -> tuple[np.ndarray, np.ndarray]:
+    """
+    '(*7,8)-(4,13)(9,14)=2,5' の列 → (pos [n, 19], gap [n, 19])
+    - 括弧内は併走 → 同じ順位（括弧の先頭の馬の番手）
+    - "-" / "=" は差の目安として累積（"," や括弧の切れ目は 0）
+    - "*" は無視
+    """
+    n = len(values)
+    tokens, rows = tokenize(_CORNER_TOKEN, values)
+    pos = np.zeros((n, MAX_HORSE_NUMBER + 1), dtype=np.int8)
+    gap = np.full((n, MAX_HORSE_NUMBER + 1), -1, dtype=np.int8)
+    if tokens.size == 0:
+        return pos, gap
+
+    is_num = np.char.isdigit(tokens)
+    is_open = tokens == "("
+    is_close = tokens == ")"
+    units = np.zeros(tokens.size, dtype=np.int32)
+    for sep, u in _GAP_UNITS.items():
+        units[tokens == sep] = u
+
+    # 行内の累積（行頭でリセット）
+    row_start = np.searchsorted(rows, rows)
+
+    def _row_cumsum(x):
+        c = np.cumsum(x)
+        return c - np.where(row_start > 0, c[row_start - 1], 0)
+
+    depth = _row_cumsum(is_open.astype(np.int32)) - _row_cumsum(is_close.astype(np.int32))
+    gap_acc = _row_cumsum(units)
+
+    # 馬番トークンだけにする。括弧の外の馬、括弧内の最初の馬が「組」の先頭
+    idx = np.flatnonzero(is_num)
+    prev_is_open = np.zeros(tokens.size, dtype=bool)
+    prev_is_open[1:] = is_open[:-1]
+    new_group = (depth[idx] <= 0) | prev_is_open[idx]
+    num_rows = rows[idx]
+    ordinal = column_in_row(num_rows)
+    # 組の先頭の番手を、その組の馬すべてに配る（行頭は必ず組の先頭なので行を跨がない）
+    k = np.arange(idx.size)
+    first = np.maximum.accumulate(np.where(new_group, k, 0))
+    place = ordinal[first] + 1
+
+    horse = tokens[idx].astype(np.int64)
+    ok = (horse >= 1) & (horse <= MAX_HORSE_NUMBER)
+    pos[num_rows[ok], horse[ok]] = np.minimum(place[ok], 127)
+    gap[num_rows[ok], horse[ok]] = np.minimum(gap_acc[idx][ok], 127)
+    return pos, gap
+
+
+# ---------- まとめて ----------
+def build_pace_arrays(race_ids, lap_times, paces, corner3, corner4) -> dict[str, np.ndarray]:
+    laps, n_laps = parse_laps(lap_times)
+    pace_cum, front, back = parse_pace(paces)
+    lap_front, lap_back = _edge_sums(laps, n_laps)
+    front = np.where(np.isnan(front), lap_front, front)
+    back = np.where(np.isnan(back), lap_back, back)
+    c3_pos, c3_gap = parse_corner_order(corner3)
+    c4_pos, c4_gap = parse_corner_order(corner4)
+    return {
+        "race_id": np.asarray(race_ids, dtype="U12"),
+        "laps": laps,
+        "n_laps": n_laps,
+        "pace_cum": pace_cum,
+        "pace_front": front.astype(np.float32),
+        "pace_back": back.astype(np.float32),
+        "corner3_pos": c3_pos,
+        "corner3_gap": c3_gap,
+        "corner4_pos": c4_pos,
+        "corner4_gap": c4_gap,
+    }
+
+
+def read_race_info_columns(csv_path: str, encoding: str = "utf-8") -> dict[str, list[str]]:
+    wanted = ("race_id", "lap_times_raw", "pace_raw", "corner_pass_order_3c_raw", "corner_pass_order_4c_raw")
+    cols = {k: [] for k in wanted}
+    with open(csv_path, newline="", encoding=encoding) as f:
+        for row in csv.DictReader(f):
+            if not row.get("race_id"):
+                continue
+            for k in wanted:
+                cols[k].append(row.get(k) or "")
+    return cols
+
+
+def _build(csv_path: str) -> dict[str, np.ndarray]:
+    cols = read_race_info_columns(csv_path)
+    return build_pace_arrays(
+        cols["race_id"], cols["lap_times_raw"], cols["pace_raw"],
+        cols["corner_pass_order_3c_raw"], cols["corner_pass_order_4c_raw"],
+    )
+
+
+def load_pace_arrays(csv_path: str, refresh: bool = False) -> dict[str, np.ndarray]:
+    """キャッシュ（.cache/race_info.pace.npz）が CSV と一致すればそれを、無ければ作って返す"""
+    return load_cached(csv_path, CACHE_NAME, _build, version=CACHE_VERSION, refresh=refresh)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="race_info.csv のラップ/ペース/通過順を配列化してキャッシュします。")
+    ap.add_argument("csv_path", nargs="?", default=os.path.join("data", "race_info.csv"), help="race_info.csv のパス")
+    ap.add_argument("--refresh", action="store_true", help="キャッシュを使わず作り直す")
+    args = ap.parse_args()
+
+    arrays = load_pace_arrays(args.csv_path, refresh=args.refresh)
+    print(f"[PACE] races={arrays['race_id'].size} laps={arrays['laps'].shape} → {cache_path_of(args.csv_path, CACHE_NAME)}")
+
+
+if __name__ == "__main__":
+    main()
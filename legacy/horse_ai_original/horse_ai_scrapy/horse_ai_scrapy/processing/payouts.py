@@ -0,0 +1,180 @@
+# horse_ai_scrapy/processing/payouts.py
+"""
+race_odds.csv（"%" 区切りで1セルに詰めた組み合わせ・払戻）を、1的中=1行の縦持ち表に展開します。
+
+  - race_id  : int64   [的中数]
+  - bet_type : int8    [的中数]   BET_TYPES の位置（0=単勝 … 7=三連単）
+  - horses   : int8    [的中数, 3] 馬番（枠連は枠番）。使わない所は 0
+                                   順不同の券種は昇順、馬単・三連単は着順のまま
+  - payout   : int32   [的中数]   100円あたりの払戻（円）
+
+行は (race_id, bet_type, horses) の順に並べてあり、PayoutTable で
+「全レース×買い目」の払戻を searchsorted 1回で引けます。
+結果は CSV と同じフォルダの .cache/race_odds.payouts.npz に保存し、CSV が変わるまで再利用します。
+
+使い方（scrapy.cfg のあるディレクトリで）:
+    python -m horse_ai_scrapy.processing.payouts data/race_odds.csv
+    python -m horse_ai_scrapy.processing.payouts data/race_odds.csv --csv data/race_payout.csv
+"""
+import argparse
+import csv
+import os
+import re
+
+import numpy as np
+
+from .arrays import cache_path_of, column_in_row, load_cached, tokenize
+
+# race_odds.csv の列名（組み合わせ列。払戻は "<列名>_dividend"）
+BET_TYPES = ("win", "place", "bracket_quinella", "quinella", "quinella_place", "exacta", "trio", "trifecta")
+# 着順どおりに当てる券種（組み合わせを並べ替えない）
+ORDERED_BET_TYPES = ("win", "place", "exacta", "trifecta")
+CACHE_NAME = "race_odds.payouts"
+CACHE_VERSION = 1
+
+_NUM_TOKEN = re.compile(r"\d+|\n")
+# 組み合わせ → 整数（馬番 0..18 の3桁19進数）
+_BASE = 19
+
+
+def bet_type_code(bet_type: str) -> int:
+    return BET_TYPES.index(bet_type)
+
+
+def _explode(race_ids: np.ndarray, combos: list[str], dividends: list[str], bet_type: str):
+    """1券種分の列を展開 → (race_id, horses [m,3], payout)"""
+    combos = np.asarray(combos, dtype=str)
+    dividends = np.char.replace(np.asarray(dividends, dtype=str), ",", "")
+    n_c = np.char.count(combos, "%") + 1
+    n_d = np.char.count(dividends, "%") + 1
+    # 組み合わせと払戻の数が合わない行（ページの崩れ）は捨てる
+    ok = (combos != "") & (dividends != "") & (n_c == n_d)
+    if not ok.any():
+        return np.empty(0, np.int64), np.empty((0, 3), np.int8), np.empty(0, np.int32)
+
+    rows = np.repeat(np.flatnonzero(ok), n_c[ok])
+    pieces = "%".join(combos[ok].tolist()).split("%")
+    amounts = np.asarray("%".join(dividends[ok].tolist()).split("%"), dtype=str)
+
+    # 的中毎の馬番（"3 - 15" / "15 → 3 → 10" / "7"）
+    tokens, piece = tokenize(_NUM_TOKEN, pieces)
+    cols = column_in_row(piece)
+    keep = cols < 3
+    horses = np.zeros((len(pieces), 3), dtype=np.int8)
+    horses[piece[keep], cols[keep]] = np.minimum(tokens[keep].astype(np.int64), 127)
+    if bet_type not in ORDERED_BET_TYPES:
+        horses = np.where(horses == 0, 127, horses)
+        horses.sort(axis=1)
+        horses[horses == 127] = 0
+
+    valid = np.char.isdigit(amounts) & (horses[:, 0] > 0)
+    payout = np.where(valid, amounts, "0").astype(np.int64)
+    return race_ids[rows][valid], horses[valid], payout[valid].astype(np.int32)
+
+
+def combo_code(horses: np.ndarray) -> np.ndarray:
+    h = horses.astype(np.int64)
+    return (h[:, 0] * _BASE + h[:, 1]) * _BASE + h[:, 2]
+
+
+def build_payouts(columns: dict[str, list[str]]) -> dict[str, np.ndarray]:
+    """race_odds.csv の列（race_id と各券種・払戻）→ 縦持ち配列"""
+    ids = np.asarray(columns["race_id"], dtype=str)
+    numeric = np.char.isdigit(ids)
+    race_ids = np.where(numeric, ids, "0").astype(np.int64)
+
+    parts = []
+    for code, bt in enumerate(BET_TYPES):
+        combos = np.where(numeric, np.asarray(columns.get(bt) or [""] * ids.size, dtype=str), "")
+        r, h, p = _explode(race_ids, combos.tolist(), columns.get(f"{bt}_dividend") or [""] * ids.size, bt)
+        parts.append((r, np.full(r.size, code, dtype=np.int8), h, p))
+
+    race_id = np.concatenate([p[0] for p in parts])
+    bet_type = np.concatenate([p[1] for p in parts])
+    horses = np.concatenate([p[2] for p in parts])
+    payout = np.concatenate([p[3] for p in parts])
+    order = np.lexsort((combo_code(horses), bet_type, race_id))
+    return {"race_id": race_id[order], "bet_type": bet_type[order], "horses": horses[order], "payout": payout[order]}
+
+
+class PayoutTable:
+    """
+    縦持ち払戻表の検索（すべて配列で渡して配列で返す）
+    - rows_for(race_ids, bet_type) : 各レースのその券種の行範囲 (start, end)
+    - payouts(race_ids, bet_type, horses) : 買い目毎の払戻（外れは 0）
+    """
+    def __init__(self, arrays: dict[str, np.ndarray]):
+        self.race_id = arrays["race_id"]
+        self.bet_type = arrays["bet_type"]
+        self.horses = arrays["horses"]
+        self.payout = arrays["payout"]
+        self._group_key = self.race_id * len(BET_TYPES) + self.bet_type
+        self._full_key = self._group_key * _BASE ** 3 + combo_code(self.horses)
+
+    def __len__(self) -> int:
+        return self.race_id.size
+
+    def rows_for(self, race_ids, bet_type: str) -> tuple[np.ndarray, np.ndarray]:
+        key = np.asarray(race_ids, dtype=np.int64) * len(BET_TYPES) + bet_type_code(bet_type)
+        return np.searchsorted(self._group_key, key, "left"), np.searchsorted(self._group_key, key, "right")
+
+    def payouts(self, race_ids, bet_type: str, horses) -> np.ndarray:
+        horses = np.atleast_2d(np.asarray(horses, dtype=np.int8))
+        if horses.shape[1] < 3:
+            horses = np.pad(horses, ((0, 0), (0, 3 - horses.shape[1])))
+        if bet_type not in ORDERED_BET_TYPES:
+            horses = np.where(horses == 0, 127, horses)
+            horses.sort(axis=1)
+            horses[horses == 127] = 0
+        key = ((np.asarray(race_ids, dtype=np.int64) * len(BET_TYPES) + bet_type_code(bet_type)) * _BASE ** 3
+               + combo_code(horses))
+        if not len(self):
+            return np.zeros(key.size, dtype=np.int32)
+        i = np.minimum(np.searchsorted(self._full_key, key), len(self) - 1)
+        return np.where(self._full_key[i] == key, self.payout[i], 0).astype(np.int32)
+
+
+def read_odds_columns(csv_path: str, encoding: str = "utf-8") -> dict[str, list[str]]:
+    wanted = ("race_id",) + BET_TYPES + tuple(f"{bt}_dividend" for bt in BET_TYPES)
+    cols = {k: [] for k in wanted}
+    with open(csv_path, newline="", encoding=encoding) as f:
+        for row in csv.DictReader(f):
+            for k in wanted:
+                cols[k].append(row.get(k) or "")
+    return cols
+
+
+def _build(csv_path: str) -> dict[str, np.ndarray]:
+    return build_payouts(read_odds_columns(csv_path))
+
+
+def load_payouts(csv_path: str, refresh: bool = False) -> PayoutTable:
+    """キャッシュ（.cache/race_odds.payouts.npz）が CSV と一致すればそれを、無ければ作って返す"""
+    return PayoutTable(load_cached(csv_path, CACHE_NAME, _build, version=CACHE_VERSION, refresh=refresh))
+
+
+def write_csv(table: PayoutTable, out_path: str) -> None:
+    with open(out_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["race_id", "bet_type", "horse1", "horse2", "horse3", "payout"])
+        names = np.asarray(BET_TYPES)[table.bet_type]
+        for rid, bt, h, p in zip(table.race_id.tolist(), names.tolist(), table.horses.tolist(), table.payout.tolist()):
+            w.writerow([rid, bt, *(x or "" for x in h), p])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="race_odds.csv を券種×的中毎の縦持ち払戻表に展開します。")
+    ap.add_argument("csv_path", nargs="?", default=os.path.join("data", "race_odds.csv"), help="race_odds.csv のパス")
+    ap.add_argument("--refresh", action="store_true", help="キャッシュを使わず作り直す")
+    ap.add_argument("--csv", default=None, help="縦持ち表をCSVでも書き出す先")
+    args = ap.parse_args()
+
+    table = load_payouts(args.csv_path, refresh=args.refresh)
+    print(f"[PAYOUT] rows={len(table)} races={np.unique(table.race_id).size} → {cache_path_of(args.csv_path, CACHE_NAME)}")
+    if args.csv:
+        write_csv(table, args.csv)
+        print(f"Wrote {args.csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# horse_ai_scrapy/processing/pedigree.py
+"""
+血統グラフ（馬 → 父・母）を int32 の隣接配列で持つストアと、その上の検索
+
+保存先は {OUTPUT_BASE_DIR}/pedigree/（PEDIGREE_DIR で変更可）:
+  - sire.npy / dam.npy : int32  行 = 馬のコード（id_codes.py の horse コード）→ 父・母のコード（-1 は不明）
+  - known.npy          : int8   1 = 父母をページから読んだ（父母が不明のまま確定した馬も含む）
+
+- bloodline_spider が血統ページ（5代血統表）を読む毎に add() で父母を入れる。
+  同じ祖先は known になった時点で以後取らない（全馬・次回以降の実行を通して1回）
+- 検索はメモリ上の配列だけで行う（ページを辿り直さない）。世代毎にまとめて父母を引く
+    ancestors()  : k 代前までの祖先と、最も近い世代
+    crosses()    : 父側・母側の両方に出る祖先（いわゆる「3×4」）
+    inbreeding() : 近交係数（Wright の F。k 代前までの血統表から血縁行列を作って計算）
+- 書き込むのは1プロセスだけにすること（id_codes と同じ）
+
+使い方（scrapy.cfg のあるディレクトリで）:
+    python -m horse_ai_scrapy.processing.pedigree stats
+    python -m horse_ai_scrapy.processing.pedigree ancestors 2019104567 --depth 3
+    python -m horse_ai_scrapy.processing.pedigree inbreeding 2019104567 --depth 5
+"""
+import argparse
+import os
+
+import numpy as np
+
+from ..id_codes import IdInterner, default_root as id_codes_root, open_interners
+
+COLUMNS = {"sire": (np.int32, -1), "dam": (np.int32, -1), "known": (np.int8, 0)}
+
+
+class PedigreeGraph:
+    """
+    horse コード → 父・母コードの配列（self.sire / self.dam / self.known）
+    - add() で1ページ分の (馬, 父, 母) をまとめて入れる
+    - unresolved() で「k 代以内で父母をまだ読んでいない祖先」をまとめて引く（取得対象）
+    - flush() で horse コードと配列をディスクへ
+    """
+    def __init__(self, root: str, interner: IdInterner):
+        self.root = root
+        self.interner = interner
+        os.makedirs(root, exist_ok=True)
+        arrays = {}
+        for col, (dtype, fill) in COLUMNS.items():
+            path = os.path.join(root, f"{col}.npy")
+            arrays[col] = np.load(path) if os.path.exists(path) else np.full(0, fill, dtype=dtype)
+        self.sire: np.ndarray = arrays["sire"]
+        self.dam: np.ndarray = arrays["dam"]
+        self.known: np.ndarray = arrays["known"]
+        self._ensure_capacity(len(interner))
+
+    def __len__(self) -> int:
+        return int(self.known.sum())
+
+    # ---------- コード ----------
+    def encode(self, horse_ids, create: bool = True) -> np.ndarray:
+        codes = self.interner.encode(horse_ids, create=create)
+        if codes.size:
+            self._ensure_capacity(int(codes.max()) + 1)
+        return codes
+
+    def horse_ids(self, codes) -> list[str]:
+        return self.interner.decode(codes).tolist()
+
+    def _ensure_capacity(self, n: int) -> None:
+        cap = self.known.shape[0]
+        if n <= cap:
+            return
+        new_cap = max(n, cap * 2, 1024)
+        grown = []
+        for col, (dtype, fill) in COLUMNS.items():
+            a = np.full(new_cap, fill, dtype=dtype)
+            a[:cap] = getattr(self, col)
+            grown.append(a)
+        self.sire, self.dam, self.known = grown
+
+    # ---------- 更新 ----------
+    def add(self, horse_ids, sire_ids, dam_ids) -> np.ndarray:
+        """(馬, 父, 母) の並びを入れる（"" は不明）。今回新しく known になった行の bool 配列を返す"""
+        codes = self.encode(horse_ids)
+        sires = self.encode(sire_ids)
+        dams = self.encode(dam_ids)
+        ok = codes >= 0
+        new = ok & (self.known[np.maximum(codes, 0)] == 0)
+        self.sire[codes[ok]] = sires[ok]
+        self.dam[codes[ok]] = dams[ok]
+        self.known[codes[ok]] = 1
+        return new
+
+    def flush(self) -> None:
+        # 配列は horse コードを指すので、コードを先に書く
+        self.interner.flush()
+        for col in COLUMNS:
+            path = os.path.join(self.root, f"{col}.npy")
+            tmp = os.path.join(self.root, f"{col}.tmp.npy")
+            np.save(tmp, getattr(self, col))
+            os.replace(tmp, path)
+
+    # ---------- 検索（配列のみ） ----------
+    def _parents(self, codes: np.ndarray) -> np.ndarray:
+        """コードの配列 → [父..., 母...]（不明は除く）"""
+        parents = np.concatenate([self.sire[codes], self.dam[codes]])
+        return parents[parents >= 0]
+
+    def ancestor_codes(self, codes, depth: int) -> tuple[np.ndarray, np.ndarray]:
+        """codes（複数可）から depth 代前までの祖先 → (コード, 最も近い世代)。世代毎に父母をまとめて引く"""
+        frontier = np.unique(np.asarray(codes, dtype=np.int32))
+        frontier = frontier[(frontier >= 0) & (frontier < self.known.shape[0])]
+        seen = {}
+        for gen in range(1, depth + 1):
+            if not frontier.size:
+                break
+            frontier = np.unique(self._parents(frontier))
+            new = [c for c in frontier.tolist() if c not in seen]
+            for c in new:
+                seen[c] = gen
+            frontier = np.array(new, dtype=np.int32)
+        out = np.fromiter(seen.keys(), dtype=np.int32, count=len(seen))
+        gens = np.fromiter(seen.values(), dtype=np.int32, count=len(seen))
+        return out, gens
+
+    def unresolved(self, codes, depth: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        codes 自身と depth 代未満の祖先のうち、父母をまだ読んでいないもの → (コード, 最も近い世代)
+        （世代 g の馬のページを読めば、そこから depth - g 代を辿れる）
+        """
+        codes = np.unique(np.asarray(codes, dtype=np.int32))
+        codes = codes[codes >= 0]
+        if codes.size:
+            self._ensure_capacity(int(codes.max()) + 1)
+        seen = {c: 0 for c in codes.tolist()}
+        frontier, out, gens = codes, [], []
+        for gen in range(depth):
+            missing = self.known[frontier] == 0
+            out.append(frontier[missing])
+            gens.append(np.full(int(missing.sum()), gen, dtype=np.int32))
+            if gen + 1 == depth:
+                break
+            parents = np.unique(self._parents(frontier[~missing]))
+            frontier = np.array([c for c in parents.tolist() if c not in seen], dtype=np.int32)
+            for c in frontier.tolist():
+                seen[c] = gen + 1
+            if not frontier.size:
+                break
+        if not out:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        return np.concatenate(out), np.concatenate(gens)
+
+    def ancestors(self, horse_id: str, depth: int) -> dict[str, int]:
+        """depth 代前までの祖先 ID → 最も近い世代（父母 = 1）"""
+        codes, gens = self.ancestor_codes(self.encode([horse_id], create=False), depth)
+        order = np.lexsort((codes, gens))
+        return dict(zip(self.horse_ids(codes[order]), gens[order].tolist()))
+
+    def _path_generations(self, code: int, depth: int) -> dict[int, list[int]]:
+        """code を1代目として depth 代前まで、祖先 → 経路毎の世代（同じ祖先が複数の経路で出れば複数）"""
+        out: dict[int, list[int]] = {}
+        if code < 0:
+            return out
+        frontier = np.array([code], dtype=np.int32)
+        for gen in range(1, depth + 1):
+            for c in frontier.tolist():
+                out.setdefault(c, []).append(gen)
+            if gen == depth:
+                break
+            # 重複を残す（経路の数だけ数える）
+            frontier = self._parents(frontier)
+            if not frontier.size:
+                break
+        return out
+
+    def crosses(self, horse_id: str, depth: int = 5) -> dict[str, tuple[list[int], list[int]]]:
+        """父側・母側の両方に出る祖先 ID → (父側の世代, 母側の世代)。例: {"000a001234": ([3], [4])} は 3×4"""
+        code = int(self.encode([horse_id], create=False)[0])
+        if code < 0 or code >= self.known.shape[0]:
+            return {}
+        sire_side = self._path_generations(int(self.sire[code]), depth)
+        dam_side = self._path_generations(int(self.dam[code]), depth)
+        common = sorted(set(sire_side) & set(dam_side), key=lambda c: (min(sire_side[c] + dam_side[c]), c))
+        ids = self.horse_ids(common)
+        return {i: (sorted(sire_side[c]), sorted(dam_side[c])) for i, c in zip(ids, common)}
+
+    def inbreeding_code(self, code: int, depth: int = 5) -> float:
+        """
+        近交係数 F（depth 代前までの血統表で計算、それより前の祖先は非近交・無血縁とみなす）
+        血縁行列 A を祖先→子孫の順に1行ずつ作る: A[i, j] = (A[父, j] + A[母, j]) / 2、A[i, i] = 1 + A[父, 母] / 2
+        F = A[本人, 本人] - 1
+        """
+        if code < 0 or code >= self.known.shape[0]:
+            return 0.0
+        anc, gens = self.ancestor_codes([code], depth)
+        nodes = [code] + anc.tolist()
+        gen_of = dict(zip(anc.tolist(), gens.tolist()))
+        gen_of[code] = 0
+        # depth 代目の馬の父母は表の外
+        parents = {}
+        for c in nodes:
+            if gen_of[c] < depth:
+                parents[c] = (int(self.sire[c]), int(self.dam[c]))
+            else:
+                parents[c] = (-1, -1)
+
+        # 祖先が先に来る順（帰りがけ順）
+        order, state = [], {}
+        stack = [(code, False)]
+        while stack:
+            c, done = stack.pop()
+            if done:
+                order.append(c)
+                continue
+            if state.get(c):
+                continue
+            state[c] = True
+            stack.append((c, True))
+            for p in parents[c]:
+                if p >= 0 and not state.get(p):
+                    stack.append((p, False))
+        index = {c: i for i, c in enumerate(order)}
+
+        n = len(order)
+        a = np.zeros((n, n), dtype=np.float64)
+        for i, c in enumerate(order):
+            s, d = (index.get(p, -1) if p >= 0 else -1 for p in parents[c])
+            row = np.zeros(i, dtype=np.float64)
+            if s >= 0:
+                row += a[s, :i]
+            if d >= 0:
+                row += a[d, :i]
+            row *= 0.5
+            a[i, :i] = row
+            a[:i, i] = row
+            a[i, i] = 1.0 + (0.5 * a[s, d] if s >= 0 and d >= 0 else 0.0)
+        return float(a[n - 1, n - 1] - 1.0)
+
+    def inbreeding(self, horse_id: str, depth: int = 5) -> float:
+        return self.inbreeding_code(int(self.encode([horse_id], create=False)[0]), depth)
+
+
+def default_root(settings) -> str:
+    return settings.get("PEDIGREE_DIR") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), "pedigree")
+
+
+def open_pedigree_graph(settings) -> PedigreeGraph:
+    """{PEDIGREE_DIR} の PedigreeGraph（horse コードは id_codes と共有）"""
+    return PedigreeGraph(default_root(settings), open_interners(id_codes_root(settings))["horse"])
+
+
+def main():
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    ap = argparse.ArgumentParser(description="血統グラフ（bloodline_spider の出力）を引きます。")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="父母を読んだ馬の数")
+    for cmd, help_text in (("ancestors", "k 代前までの祖先"), ("crosses", "父側・母側の両方に出る祖先"),
+                           ("inbreeding", "近交係数")):
+        p = sub.add_parser(cmd, help=help_text)
+        p.add_argument("horse_id")
+        p.add_argument("--depth", type=int, default=settings.getint("PEDIGREE_DEPTH", 5))
+    args = ap.parse_args()
+
+    graph = open_pedigree_graph(settings)
+    if args.cmd == "stats":
+        print(f"known\t{len(graph)}")
+        print(f"codes\t{len(graph.interner)}")
+    elif args.cmd == "ancestors":
+        for horse_id, gen in graph.ancestors(args.horse_id, args.depth).items():
+            print(f"{gen}\t{horse_id}")
+    elif args.cmd == "crosses":
+        for horse_id, (sire_gens, dam_gens) in graph.crosses(args.horse_id, args.depth).items():
+            print(f"{horse_id}\t{'・'.join(map(str, sire_gens))}×{'・'.join(map(str, dam_gens))}")
+    else:
+        print(f"{graph.inbreeding(args.horse_id, args.depth):.6f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# horse_ai_scrapy/profiling.py
+"""
+callback / pipeline の抜き取りプロファイル（PROFILE_ENABLED、既定オフ）
+
+    scrapy crawl race_result_spider -s PROFILE_ENABLED=1 -s PROFILE_SAMPLE_RATE=0.1
+
+- callback（parse_race_page 等）と pipeline の process_item（@profiled を付けたもの）の呼び出しを
+  PROFILE_SAMPLE_RATE の割合で抜き取り、その間だけ
+    cProfile               : 関数毎の呼び出し回数・時間（pstats）
+    スタックの抜き取り     : PROFILE_STACK_INTERVAL 秒毎に reactor スレッドのスタックを数える
+  を動かす。対象（callback:<名前> / pipeline:<クラス名>）毎に集計
+- 終了時に {PROFILE_DIR}（既定 {OUTPUT_BASE_DIR}/profiles）/{spider}-YYYYmmdd-HHMMSS/ へ
+    <対象>.prof / all.prof : pstats（snakeviz / flameprof / gprof2dot で開ける）
+    stacks.folded          : 折りたたみスタック（flamegraph.pl / speedscope でそのままフレームグラフ）
+    top.txt                : 対象毎の抜き取り件数と、累積時間の上位 PROFILE_TOP_N 関数
+- オフのときは ProfilingExtension / ProfilingSpiderMiddleware が NotConfigured で外れ、
+  @profiled は spider.profiler が無いことを見てそのまま呼ぶだけ
+※ callback の出力は1件取り出す毎に計測を止めるが、async の callback が途中で await すると
+  その間に動いた他の処理も混ざる（このプロジェクトの callback は同期ジェネレータ）
+"""
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+
+logger = logging.getLogger(__name__)
+
+
+class _StackSampler(threading.Thread):
+    """
+    begin()〜end() の間、対象スレッドのスタックを interval 秒毎に数える（折りたたみ形式のキー → 回数）
+    - begin() を呼んだ関数より外側（reactor・engine のフレーム）は数えない
+    """
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profile-stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts: dict[str, int] = {}
+        self._target = None
+        self._root = None
+        self._active = threading.Event()
+        self._stopped = False
+
+    def begin(self, target: str, root_frame) -> None:
+        self._target = target
+        self._root = root_frame
+        self._active.set()
+
+    def end(self) -> None:
+        self._active.clear()
+        self._root = None
+
+    def stop(self) -> None:
+        self._stopped = True
+        self._active.set()
+        self.join()
+
+    @staticmethod
+    def _frame_name(code) -> str:
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self) -> None:
+        root, target = self._root, self._target
+        frame = sys._current_frames().get(self.thread_id)
+        names = []
+        while frame is not None and frame is not root:
+            names.append(self._frame_name(frame.f_code).replace(";", ":"))
+            frame = frame.f_back
+        if frame is None:
+            # 既に begin() した関数から抜けていた
+            return
+        key = ";".join([target] + names[::-1])
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def run(self) -> None:
+        while True:
+            self._active.wait()
+            if self._stopped:
+                return
+            self._sample()
+            time.sleep(self.interval)
+
+
+class SamplingProfiler:
+    """
+    抜き取りの判定と、対象毎の cProfile・スタック集計（spider.profiler）
+    - sample() が True の呼び出しだけ start(対象) 〜 stop() で計測する（入れ子はしない）
+    """
+    def __init__(self, rate: float, interval: float, seed=None):
+        self.rate = rate
+        self._rng = random.Random(seed)
+        self.profiles: dict[str, cProfile.Profile] = {}
+        # 対象 → [抜き取った回数, 全呼び出し回数]
+        self.calls: dict[str, list[int]] = {}
+        self._active: str | None = None
+        self._sampler = _StackSampler(threading.get_ident(), interval) if interval > 0 else None
+        if self._sampler is not None:
+            self._sampler.start()
+
+    def sample(self, target: str) -> bool:
+        calls = self.calls.setdefault(target, [0, 0])
+        calls[1] += 1
+        if self._active is not None or self._rng.random() >= self.rate:
+            return False
+        calls[0] += 1
+        return True
+
+    def start(self, target: str) -> None:
+        profile = self.profiles.get(target)
+        if profile is None:
+            profile = self.profiles[target] = cProfile.Profile()
+        self._active = target
+        if self._sampler is not None:
+            # 呼び出し元（ラッパ）のフレームから内側だけを数える
+            self._sampler.begin(target, sys._getframe(1))
+        profile.enable()
+
+    def stop(self) -> None:
+        if self._active is None:
+            return
+        self.profiles[self._active].disable()
+        if self._sampler is not None:
+            self._sampler.end()
+        self._active = None
+
+    @property
+    def active(self) -> str | None:
+        return self._active
+
+    def close(self) -> None:
+        self.stop()
+        if self._sampler is not None:
+            self._sampler.stop()
+
+    # ---------- 出力 ----------
+    @staticmethod
+    def _file_name(target: str) -> str:
+        return re.sub(r"[^0-9A-Za-z_.-]+", "_", target)
+
+    def dump(self, out_dir: str, top_n: int = 30) -> None:
+        os.makedirs(out_dir, exist_ok=True)
+        stats = []
+        summary = io.StringIO()
+        for target in sorted(self.calls):
+            sampled, total = self.calls[target]
+            summary.write(f"=== {target}: 抜き取り {sampled}/{total} 回\n")
+            profile = self.profiles.get(target)
+            if profile is None or not sampled:
+                summary.write("\n")
+                continue
+            profile.dump_stats(os.path.join(out_dir, f"{self._file_name(target)}.prof"))
+            st = pstats.Stats(profile, stream=summary)
+            st.sort_stats("cumulative").print_stats(top_n)
+            stats.append(profile)
+        if stats:
+            pstats.Stats(*stats).dump_stats(os.path.join(out_dir, "all.prof"))
+        with open(os.path.join(out_dir, "top.txt"), "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+        if self._sampler is not None:
+            with open(os.path.join(out_dir, "stacks.folded"), "w", encoding="utf-8") as f:
+                for key, count in sorted(self._sampler.counts.items()):
+                    f.write(f"{key} {count}\n")
+
+
+def _check_enabled(settings) -> None:
+    if not settings.getbool("PROFILE_ENABLED"):
+        raise NotConfigured
+
+
+def _profiler(spider) -> SamplingProfiler | None:
+    return getattr(spider, "profiler", None)
+
+
+def profiled(process_item):
+    """
+    pipeline の process_item(self, item, spider) に付ける。抜き取られた呼び出しだけ pipeline:<クラス名> として計測
+    （プロファイルがオフなら spider.profiler を見るだけ）
+    """
+    @functools.wraps(process_item)
+    def wrapper(self, item, spider):
+        profiler = _profiler(spider)
+        target = f"pipeline:{type(self).__name__}"
+        if profiler is None or not profiler.sample(target):
+            return process_item(self, item, spider)
+        profiler.start(target)
+        try:
+            return process_item(self, item, spider)
+        finally:
+            profiler.stop()
+    return wrapper
+
+
+class ProfilingSpiderMiddleware:
+    """抜き取った callback の出力を1件ずつ取り出す間だけプロファイルする（スパイダー寄りに置く）"""
+    def __init__(self, crawler):
+        _check_enabled(crawler.settings)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_spider_output(self, response, result, spider):
+        profiler = _profiler(spider)
+        if profiler is None:
+            return result
+        target = f"callback:{self._callback(response)}"
+        if not profiler.sample(target):
+            return result
+        return self._profiled(result, profiler, target)
+
+    async def process_spider_output_async(self, response, result, spider):
+        profiler = _profiler(spider)
+        target = f"callback:{self._callback(response)}"
+        if profiler is None or not profiler.sample(target):
+            async for out in result:
+                yield out
+            return
+        it = result.__aiter__()
+        while True:
+            profiler.start(target)
+            try:
+                out = await it.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                profiler.stop()
+            yield out
+
+    @staticmethod
+    def _callback(response) -> str:
+        return getattr(getattr(getattr(response, "request", None), "callback", None), "__name__", "parse")
+
+    @staticmethod
+    def _profiled(result, profiler: SamplingProfiler, target: str):
+        it = iter(result)
+        while True:
+            profiler.start(target)
+            try:
+                out = next(it)
+            except StopIteration:
+                break
+            finally:
+                profiler.stop()
+            yield out
+
+
+class ProfilingExtension:
+    """spider.profiler を用意し、終了時に PROFILE_DIR へ書き出す拡張"""
+    def __init__(self, crawler):
+        settings = crawler.settings
+        _check_enabled(settings)
+        self.rate = settings.getfloat("PROFILE_SAMPLE_RATE", 0.05)
+        self.interval = settings.getfloat("PROFILE_STACK_INTERVAL", 0.005)
+        self.top_n = settings.getint("PROFILE_TOP_N", 30)
+        self.out_dir = settings.get("PROFILE_DIR") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), "profiles")
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        spider.profiler = SamplingProfiler(self.rate, self.interval)
+        logger.warning(f"[PROFILE] {spider.name}: callback / pipeline の {self.rate:.1%} を抜き取りプロファイルします")
+
+    def spider_closed(self, spider):
+        profiler = spider.profiler
+        profiler.close()
+        out_dir = os.path.join(self.out_dir, f"{spider.name}-{time.strftime('%Y%m%d-%H%M%S')}")
+        profiler.dump(out_dir, self.top_n)
+        logger.warning(f"[PROFILE] {spider.name}: {out_dir} に書き出しました（top.txt / stacks.folded / *.prof）")
@@ -0,0 +1,92 @@
+# horse_ai_scrapy/progress.py
+import os
+import sqlite3
+import time
+
+from scrapy import signals
+
+
+class CrawlProgressStore:
+    """
+    スパイダー毎の「取得済みID」記録（SQLite, {OUTPUT_BASE_DIR}/.progress/{spider}.sqlite3）
+    - mark_done() はメモリに溜めるだけ。commit() でまとめて書き込む
+    - commit() は CsvExportPipeline がCSVを flush した直後に呼ばれる
+      → CSVに書けたIDだけが完了扱いになり、落ちても未書き込み分は次回取り直す
+    - 書き込みスレッドを待たないチェックポイントでは、take_pending() で区切った分を fsync の後に commit(ids)
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS done (entity_id TEXT PRIMARY KEY, done_at REAL NOT NULL)")
+        self._conn.commit()
+        self._pending: list[str] = []
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def done_ids(self) -> set[str]:
+        return {row[0] for row in self._conn.execute("SELECT entity_id FROM done")}
+
+    def filter_pending(self, ids: list[str], refetch: set[str] | None = None) -> list[str]:
+        """取得済みIDを除いたリスト（順序保持）。refetch にあるIDは取得済みでも残す（鮮度切れ、freshness.py）"""
+        done = self.done_ids() - (refetch or set())
+        return [i for i in ids if i not in done]
+
+    def mark_done(self, entity_id: str) -> None:
+        self._pending.append(entity_id)
+
+    def take_pending(self) -> list[str]:
+        """未確定IDを取り出す（以後の mark_done は次の分）"""
+        ids, self._pending = self._pending, []
+        return ids
+
+    def commit(self, ids: list[str] | None = None) -> None:
+        """ids（既定: 未確定の全部）を取得済みとして書き込む"""
+        if ids is None:
+            ids = self.take_pending()
+        if not ids:
+            return
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO done (entity_id, done_at) VALUES (?, ?)",
+                [(i, now) for i in ids],
+            )
+
+    def reset(self) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM done")
+        self._pending.clear()
+
+    def close(self) -> None:
+        try:
+            self.commit()
+        finally:
+            self._conn.close()
+
+
+def is_restart(resume) -> bool:
+    """-a resume=0 / false / no（記録を使わず最初から取り直す）"""
+    return str(resume).strip().lower() in ("0", "false", "no")
+
+
+def open_progress_store(spider, resume: str | None = None) -> CrawlProgressStore | None:
+    """
+    spider 用の進捗ストアを開く（PROGRESS_ENABLED=False なら None）
+    - resume="0" のときは記録を消して最初から取り直す
+    - spider_closed で残りを commit して閉じる
+    """
+    settings = spider.settings
+    if not settings.getbool("PROGRESS_ENABLED", True):
+        return None
+
+    base = settings.get("PROGRESS_DIR") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), ".progress")
+    store = CrawlProgressStore(os.path.join(base, f"{spider.name}.sqlite3"))
+    if is_restart(resume):
+        store.reset()
+
+    spider.crawler.signals.connect(lambda: store.close(), signal=signals.spider_closed, weak=False)
+    return store
@@ -0,0 +1,178 @@
+# horse_ai_scrapy/render.py
+"""
+Chrome での描画の方針（PooledSeleniumMiddleware と bench/bench_render.py で共通）
+
+- 取得してよい先（RenderPolicy）
+    SELENIUM_ALLOW_HOSTS : これ以外のホストは名前解決させない（--host-resolver-rules）
+                           → 広告・解析・他社スクリプトはリクエスト自体が出ない。空なら制限なし
+    SELENIUM_DENY_URLS   : 許可したホストでも取らない URL パターン（CDP Network.setBlockedURLs）
+- 描画モード SELENIUM_RENDER_MODE
+    "eager"   : pageLoadStrategy=eager（DOM 構築まで待つ）→ SeleniumRequest の wait_until をポーリング（従来どおり）
+    "observe" : pageLoadStrategy=none（driver.get はすぐ返る）→ DOMContentLoaded（HTML を読み切った）後、
+                meta["render_ready"] の CSS セレクタが DOM にあればすぐ、無ければ現れた瞬間（MutationObserver）に渡す。
+                ポーリングしない。HTML の途中で渡すと表が欠けるので、DOMContentLoaded より前には渡さない
+                wait_until は render_ready が無いリクエストだけ、DOMContentLoaded の後に従来どおり待つ
+- Cookie は遷移前に CDP（Network.setCookie）で入れる → 読み直し不要。同じ値はドライバ毎に1回だけ
+- タブ（ドライバ）はプールで使い回す。遷移前に前のページの読み込みを止め、印を付けて
+  「前のページで見つけた」を新しいページと取り違えないようにする
+"""
+import fnmatch
+import time
+from urllib.parse import urlparse
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+
+RENDER_MODES = ("eager", "observe")
+PAGE_LOAD_STRATEGIES = {"eager": "eager", "observe": "none"}
+
+# 前のページに付ける印（新しい document には無い）
+_STALE_MARK = "__horseAiStale"
+
+# 印の付いた（遷移前の）document では何もしない → 遷移で破棄されて例外になり、呼び出し側がやり直す
+# 新しい document: DOMContentLoaded 済みで、セレクタのどれかが在れば（セレクタ無しなら DOMContentLoaded だけで）true
+# スクリプトが後から差し込む要素は MutationObserver で待つ。timeout で false
+READY_JS = """
+const selectors = arguments[0], timeoutMs = arguments[1], done = arguments[arguments.length - 1];
+if (window.%(mark)s) { return; }
+const found = () => selectors.length === 0 || selectors.some((s) => document.querySelector(s) !== null);
+const ready = () => document.readyState !== "loading" && found();
+if (ready()) { done(true); return; }
+let finished = false;
+const finish = (ok) => {
+  if (finished) return;
+  finished = true;
+  observer.disconnect();
+  document.removeEventListener("DOMContentLoaded", check);
+  done(ok);
+};
+const check = () => { if (ready()) finish(true); };
+const observer = new MutationObserver(check);
+observer.observe(document, {childList: true, subtree: true});
+document.addEventListener("DOMContentLoaded", check);
+setTimeout(() => finish(false), timeoutMs);
+""" % {"mark": _STALE_MARK}
+
+
+class RenderPolicy:
+    """ホストの許可リストと URL の拒否パターン"""
+    def __init__(self, allow_hosts=None, deny_urls=None):
+        self.allow_hosts = [h.strip().lower() for h in allow_hosts or [] if h.strip()]
+        self.deny_urls = list(deny_urls or [])
+
+    @classmethod
+    def from_settings(cls, settings) -> "RenderPolicy":
+        return cls(settings.getlist("SELENIUM_ALLOW_HOSTS"), settings.getlist("SELENIUM_DENY_URLS"))
+
+    def chrome_arguments(self) -> list[str]:
+        """許可リスト以外を名前解決させない Chrome 引数（chromedriver との通信用に localhost は残す）"""
+        if not self.allow_hosts:
+            return []
+        excludes = ", ".join(f"EXCLUDE {h}" for h in self.allow_hosts + ["localhost", "127.0.0.1"])
+        return [f"--host-resolver-rules=MAP * ~NOTFOUND, {excludes}"]
+
+    def allows(self, url: str) -> bool:
+        """この方針で取られる URL か（bench・確認用。ブラウザ内の判定は Chrome が行う）"""
+        host = (urlparse(url).hostname or "").lower()
+        if self.allow_hosts and not any(fnmatch.fnmatch(host, h) for h in self.allow_hosts):
+            return False
+        return not any(fnmatch.fnmatch(url, p) for p in self.deny_urls)
+
+
+def _cookie_list(cookies) -> list[dict]:
+    if isinstance(cookies, dict):
+        return [{"name": k, "value": v} for k, v in cookies.items()]
+    return list(cookies or [])
+
+
+def _set_cookies(driver, url: str, cookies: list[dict], seen: set | None) -> None:
+    """遷移前に CDP で入れる（seen にある値は入れ直さない）"""
+    for cookie in cookies:
+        key = (cookie["name"], cookie["value"], cookie.get("domain", ""))
+        if seen is not None and key in seen:
+            continue
+        params = {"name": cookie["name"], "value": cookie["value"], "path": cookie.get("path") or "/"}
+        if cookie.get("domain"):
+            params["domain"] = cookie["domain"]
+        else:
+            params["url"] = url
+        driver.execute_cdp_cmd("Network.setCookie", params)
+        if seen is not None:
+            seen.add(key)
+
+
+def _add_cookies_and_reload(driver, url: str, cookies: list[dict]) -> None:
+    """CDP が使えないドライバ用: ページのドメインに入れ、ブラウザに無かった Cookie があれば読み直す"""
+    added = False
+    for cookie in cookies:
+        current = driver.get_cookie(cookie["name"])
+        if current is not None and current.get("value") == cookie["value"]:
+            continue
+        try:
+            driver.add_cookie({k: cookie[k] for k in ("name", "value", "path") if k in cookie})
+            added = True
+        except WebDriverException:
+            pass
+    if added:
+        driver.get(url)
+
+
+def wait_ready(driver, selectors, timeout: float) -> bool:
+    """新しい document が DOMContentLoaded になり、セレクタが現れるまで（MutationObserver / イベント）"""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        driver.set_script_timeout(remaining + 1.0)
+        try:
+            if driver.execute_async_script(READY_JS, list(selectors or []), int(remaining * 1000)):
+                return True
+            return False
+        except TimeoutException:
+            return False
+        except WebDriverException:
+            # 遷移前の document で実行して破棄された / まだ新しい document が無い → やり直す
+            time.sleep(0.01)
+
+
+def render_page(driver, request, mode: str = "eager", cookie_cache: set | None = None):
+    """
+    SeleniumRequest を1回描画して (current_url, page_source, screenshot, timing) を返す（スレッド上で呼ぶ）
+    timing: {"load": driver.get まで, "wait": 準備完了まで}（秒）
+    """
+    t0 = time.perf_counter()
+    cookies = _cookie_list(request.cookies)
+    late_cookies = []
+    if cookies:
+        try:
+            _set_cookies(driver, request.url, cookies, cookie_cache)
+        except WebDriverException:
+            late_cookies = cookies
+    if mode == "observe":
+        # 前のページの残りの読み込みを止め、印を付けてから遷移（新しい document には印が無い）
+        driver.execute_script(f"window.stop(); window.{_STALE_MARK} = true;")
+    driver.get(request.url)
+    if late_cookies:
+        _add_cookies_and_reload(driver, request.url, late_cookies)
+    timing = {"load": time.perf_counter() - t0}
+
+    t0 = time.perf_counter()
+    wait_time = request.wait_time or 10
+    ready = request.meta.get("render_ready")
+    if mode == "observe":
+        if not wait_ready(driver, ready, wait_time):
+            raise TimeoutException(f"render_ready={ready} が {wait_time}s 以内に揃いませんでした: {request.url}")
+        if ready is None and request.wait_until:
+            WebDriverWait(driver, wait_time).until(request.wait_until)
+    elif request.wait_until:
+        WebDriverWait(driver, wait_time).until(request.wait_until)
+    if ready is not None or request.wait_until:
+        timing["wait"] = time.perf_counter() - t0
+
+    screenshot = driver.get_screenshot_as_png() if request.screenshot else None
+
+    if request.script:
+        driver.execute_script(request.script)
+
+    return driver.current_url, driver.page_source, screenshot, timing
@@ -0,0 +1,109 @@
+# horse_ai_scrapy/replay.py
+"""
+HtmlArchive に保存済みのページを、ネットワーク無しで各スパイダーの parse に通し直す。
+列を追加したときに再クロールせず作り直すためのもの。全コアで並列に処理する。
+
+使い方（scrapy.cfg のあるディレクトリで）:
+    python -m horse_ai_scrapy.replay race_result_spider
+    python -m horse_ai_scrapy.replay horse_info_spider --jobs 4 --out-dir data/replay
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from itemadapter import ItemAdapter, is_item
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from scrapy.utils.misc import load_object
+from scrapy.utils.project import get_project_settings
+
+from .archive import HtmlArchive, read_object
+from .pipelines import CsvExportPipeline
+
+# spider名 → (スパイダークラス, callback名, IDの渡し方 "cb_kwargs"/"meta", IDのキー)
+REPLAY_SPECS = {
+    "race_result_spider": ("horse_ai_scrapy.spiders.race_result_spider.RaceResultSpider", "parse_race_page", "cb_kwargs", "race_id"),
+    "race_info_spider": ("horse_ai_scrapy.spiders.race_info_spider.RaceInfoSpiderSpider", "parse", "meta", "race_id"),
+    "horse_info_spider": ("horse_ai_scrapy.spiders.horse_info_spider.HorseInfoSpider", "parse_horse_page", "cb_kwargs", "horse_id"),
+    "bloodline_spider": ("horse_ai_scrapy.spiders.bloodline_spider.BloodlineSpiderSpider", "parse_pedigree", "cb_kwargs", "horse_id"),
+}
+
+
+def build_response(spider_name: str, entity_id: str, url: str, body: bytes, encoding: str) -> HtmlResponse:
+    """保存済み本文から、live 時と同じ meta / cb_kwargs を持つレスポンスを作る"""
+    _, _, pass_by, key = REPLAY_SPECS[spider_name]
+    if pass_by == "meta":
+        request = Request(url, meta={key: entity_id})
+    else:
+        request = Request(url, cb_kwargs={key: entity_id})
+    return HtmlResponse(url=url, body=body, encoding=encoding, request=request)
+
+
+def _replay_chunk(args) -> list[dict]:
+    # ワーカープロセス側：スパイダーを素で作って callback を直接呼ぶ
+    spider_name, archive_root, entries = args
+    spidercls_path, callback_name, _, _ = REPLAY_SPECS[spider_name]
+    spider = load_object(spidercls_path)()
+    callback = getattr(spider, callback_name)
+
+    items: list[dict] = []
+    for entity_id, url, sha1, encoding in entries:
+        response = build_response(spider_name, entity_id, url, read_object(archive_root, sha1), encoding)
+        for out in callback(response, **response.request.cb_kwargs) or []:
+            # Request（Selenium 取り直し等）は無視し、item だけ集める
+            if is_item(out):
+                items.append(ItemAdapter(out).asdict())
+    return items
+
+
+def replay(spider_name: str, out_dir: str | None = None, jobs: int | None = None,
+           chunk_size: int = 200, limit: int | None = None) -> int:
+    if spider_name not in REPLAY_SPECS:
+        raise ValueError(f"replay 未対応のスパイダーです: {spider_name}（{', '.join(REPLAY_SPECS)}）")
+
+    settings = get_project_settings()
+    base = settings.get("OUTPUT_BASE_DIR", "data")
+    archive_root = settings.get("HTML_ARCHIVE_DIR") or os.path.join(base, "archive")
+    archive = HtmlArchive(archive_root)
+    entries = archive.entries(spider_name)
+    archive.close()
+    if limit:
+        entries = entries[:limit]
+    print(f"[REPLAY] {spider_name}: {len(entries)} pages from {archive_root}")
+
+    # 出力は live のCSVと混ぜない（既定 {OUTPUT_BASE_DIR}/replay に上書き）
+    settings.set("OUTPUT_BASE_DIR", out_dir or os.path.join(base, "replay"), priority="cmdline")
+    settings.set("EXPORT_OVERWRITE", True, priority="cmdline")
+    # 取り直していないので鮮度の取得記録には触れない
+    settings.set("FRESHNESS_ENABLED", False, priority="cmdline")
+    spider = load_object(REPLAY_SPECS[spider_name][0])()
+    spider.settings = settings
+    pipeline = CsvExportPipeline()
+    pipeline.open_spider(spider)
+
+    chunks = [(spider_name, archive_root, entries[i:i + chunk_size]) for i in range(0, len(entries), chunk_size)]
+    n_items = 0
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as ex:
+        for done, items in enumerate(ex.map(_replay_chunk, chunks), start=1):
+            for item in items:
+                pipeline.process_item(item, spider)
+            n_items += len(items)
+            print(f"[REPLAY] {min(done * chunk_size, len(entries))}/{len(entries)} pages, items={n_items}")
+
+    pipeline.close_spider(spider)
+    return n_items
+
+
+def main():
+    ap = argparse.ArgumentParser(description="保存済みHTMLを parse に通し直して CSV を作り直します。")
+    ap.add_argument("spider", choices=sorted(REPLAY_SPECS), help="対象スパイダー名")
+    ap.add_argument("--out-dir", default=None, help="出力先（既定: {OUTPUT_BASE_DIR}/replay）")
+    ap.add_argument("--jobs", type=int, default=None, help="並列プロセス数（既定: CPUコア数）")
+    ap.add_argument("--chunk-size", type=int, default=200, help="1タスクあたりのページ数")
+    ap.add_argument("--limit", type=int, default=None, help="先頭N件だけ処理（確認用）")
+    args = ap.parse_args()
+    replay(args.spider, out_dir=args.out_dir, jobs=args.jobs, chunk_size=args.chunk_size, limit=args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,42 @@ from scrapy_selenium import SeleniumMiddleware
 from selenium.webdriver import Chrome, ChromeOptions
 from selenium.webdriver.chrome.service import Service
 
+# フォント/動画/GIF（画像は --blink-settings=imagesEnabled=false で既にOFF）
+BLOCKED_URLS = ["*.woff*", "*.ttf*", "*.otf*", "*.mp4", "*.webm", "*.gif"]
+
+
+def build_eager_driver(driver_arguments, executable_path=None, log_path=None,
+                       blocked_urls=None, page_load_strategy="eager"):
+    """
+    eager な Chrome を1台起動する（EagerSeleniumMiddleware / PooledSeleniumMiddleware 共通）
+    - pageLoadStrategy = eager（DOM構築で返す → サブリソース待ちを短縮）
+      render.py の "observe" モードでは none（get はすぐ返し、準備完了は MutationObserver で待つ）
+    - CDPで重いリソースをブロック（blocked_urls を渡せば BLOCKED_URLS の代わりにそれを使う）
+    """
+    options = ChromeOptions()
+    for arg in driver_arguments or []:
+        options.add_argument(arg)
+
+    # ←ここがポイント
+    options.set_capability("pageLoadStrategy", page_load_strategy)
+
+    service = Service(
+        executable_path=executable_path,
+        log_output=log_path  # Windowsなら 'NUL'
+    )
+
+    driver = Chrome(service=service, options=options)
+
+    # 失敗しても動くように握りつぶし
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(blocked_urls or BLOCKED_URLS)})
+    except Exception:
+        pass
+
+    return driver
+
+
 class EagerSeleniumMiddleware(SeleniumMiddleware):
     """
     - pageLoadStrategy = eager（DOM構築で返す → サブリソース待ちを短縮）
@@ -10,27 +46,4 @@ class EagerSeleniumMiddleware(SeleniumMiddleware):
       ※ 画像は settings.py の --blink-settings=imagesEnabled=false で既にOFF
     """
     def _get_driver(self):
-        options = ChromeOptions()
-        for arg in self.driver_arguments:
-            options.add_argument(arg)
-
-        # ←ここがポイント
-        options.set_capability("pageLoadStrategy", "eager")
-
-        service = Service(
-            executable_path=self.driver_executable_path,
-            log_output=self.driver_log_path  # Windowsなら 'NUL'
-        )
-
-        driver = Chrome(service=service, options=options)
-
-        # フォント/動画/GIFをブロック（失敗しても動くように握りつぶし）
-        try:
-            driver.execute_cdp_cmd("Network.enable", {})
-            driver.execute_cdp_cmd("Network.setBlockedURLs", {
-                "urls": ["*.woff*", "*.ttf*", "*.otf*", "*.mp4", "*.webm", "*.gif"]
-            })
-        except Exception:
-            pass
-
-        return driver
+        return build_eager_driver(self.driver_arguments, self.driver_executable_path, self.driver_log_path)
@@ -0,0 +1,179 @@
+# horse_ai_scrapy/selenium_pool_mw.py
+import logging
+import time
+
+from scrapy import signals
+from scrapy.http import HtmlResponse
+from scrapy_selenium import SeleniumRequest
+from selenium.common.exceptions import TimeoutException
+from twisted.internet import defer, threads
+
+from .render import PAGE_LOAD_STRATEGIES, RENDER_MODES, RenderPolicy, render_page
+from .selenium_eager_mw import build_eager_driver
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledDriver:
+    """プール内の1台（ドライバ本体と描画ページ数、CDP で入れ済みの Cookie）"""
+    __slots__ = ("driver", "pages", "cookies")
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.cookies: set = set()
+
+
+class PooledSeleniumMiddleware:
+    """
+    scrapy_selenium.SeleniumMiddleware の置き換え（SeleniumRequest をそのまま処理）
+    - eager な Chrome を最大 SELENIUM_POOL_SIZE 台まで遅延起動し、リクエスト毎に貸出→返却
+    - 描画（get/wait/page_source）は reactor のスレッドプールで実行 → reactor をブロックしない
+    - 空きドライバが無い間は DeferredQueue で非同期に待つ
+    - SELENIUM_POOL_MAX_PAGES ページ描画毎、または WebDriver 例外時にドライバを作り直す
+    - meta["selenium_pool_pin"]=True のリクエストはドライバを貸したまま callback に渡す
+      （callback 側で response.meta["driver_release"]() を呼んで返却すること）
+    - 描画は horse_ai_scrapy.render.render_page（SELENIUM_RENDER_MODE / SELENIUM_ALLOW_HOSTS / SELENIUM_DENY_URLS）
+      request.cookies は遷移前に CDP で入れる（使えないドライバでは描画後に入れて読み直す）
+      "observe" モードでは meta["render_ready"]（CSS セレクタのリスト）が現れた時点で渡す
+    - 段階毎の秒数（checkout=空きドライバ待ち / load=driver.get / wait=待機条件）を meta["selenium_timing"] に残す
+    ※ SeleniumRequest はダウンローダのスロット（DOWNLOAD_DELAY / CONCURRENT_REQUESTS_PER_DOMAIN）を
+      通らないため、同時描画数は SELENIUM_POOL_SIZE と CONCURRENT_REQUESTS で決まる。
+      REACTOR_THREADPOOL_MAXSIZE も SELENIUM_POOL_SIZE 以上にする
+    """
+    def __init__(self, settings):
+        self.size = max(1, settings.getint("SELENIUM_POOL_SIZE", 2))
+        self.max_pages = settings.getint("SELENIUM_POOL_MAX_PAGES", 200)
+        self.driver_arguments = settings.getlist("SELENIUM_DRIVER_ARGUMENTS")
+        self.driver_executable_path = settings.get("SELENIUM_DRIVER_EXECUTABLE_PATH")
+        self.driver_log_path = settings.get("SELENIUM_DRIVER_LOG_PATH")
+        self.mode = settings.get("SELENIUM_RENDER_MODE", "eager")
+        if self.mode not in RENDER_MODES:
+            raise ValueError(f"SELENIUM_RENDER_MODE は {RENDER_MODES} のいずれか: {self.mode!r}")
+        self.policy = RenderPolicy.from_settings(settings)
+        self._idle = defer.DeferredQueue()
+        self._created = 0
+        self._slots: set[_PooledDriver] = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        mw = cls(crawler.settings)
+        concurrent = crawler.settings.getint("CONCURRENT_REQUESTS")
+        if concurrent < mw.size:
+            logger.warning(
+                f"SELENIUM_POOL_SIZE={mw.size} ですが CONCURRENT_REQUESTS={concurrent} のため"
+                f"同時描画は {concurrent} 台までです"
+            )
+        threads_max = crawler.settings.getint("REACTOR_THREADPOOL_MAXSIZE")
+        if threads_max < mw.size:
+            logger.warning(f"REACTOR_THREADPOOL_MAXSIZE={threads_max} が SELENIUM_POOL_SIZE={mw.size} より小さいです")
+        crawler.signals.connect(mw.spider_closed, signal=signals.spider_closed)
+        return mw
+
+    # ---------- プール操作 ----------
+    def _new_slot(self):
+        # スレッド上で呼ばれる（Chrome 起動は数秒かかる）
+        driver = build_eager_driver(
+            self.driver_arguments + self.policy.chrome_arguments(),
+            self.driver_executable_path,
+            self.driver_log_path,
+            blocked_urls=self.policy.deny_urls,
+            page_load_strategy=PAGE_LOAD_STRATEGIES[self.mode],
+        )
+        slot = _PooledDriver(driver)
+        self._slots.add(slot)
+        return slot
+
+    @defer.inlineCallbacks
+    def _checkout(self):
+        if not self._idle.pending and self._created < self.size:
+            self._created += 1
+            try:
+                slot = yield threads.deferToThread(self._new_slot)
+            except Exception:
+                self._created -= 1
+                raise
+            return slot
+        slot = yield self._idle.get()
+        return slot
+
+    def _checkin(self, slot: _PooledDriver):
+        if self.max_pages and slot.pages >= self.max_pages:
+            self._retire(slot)
+        else:
+            self._idle.put(slot)
+
+    def _retire(self, slot: _PooledDriver):
+        """ドライバを破棄。待ちがいれば代わりを起動して渡す"""
+        self._slots.discard(slot)
+        threads.deferToThread(self._quit, slot.driver)
+        self._created -= 1
+        if self._idle.waiting:
+            self._created += 1
+            d = threads.deferToThread(self._new_slot)
+            d.addCallbacks(self._idle.put, self._replacement_failed)
+
+    def _replacement_failed(self, failure):
+        self._created -= 1
+        logger.warning(f"[POOL] ドライバ再起動に失敗: {failure.value!r}")
+        if self._idle.waiting:
+            self._idle.waiting.pop(0).errback(failure)
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    # ---------- 描画 ----------
+    def _load(self, slot: _PooledDriver, request: SeleniumRequest):
+        # スレッド上で呼ばれる
+        return render_page(slot.driver, request, self.mode, slot.cookies)
+
+    def process_request(self, request, spider):
+        if not isinstance(request, SeleniumRequest):
+            return None
+        return self._render(request)
+
+    @defer.inlineCallbacks
+    def _render(self, request: SeleniumRequest):
+        t0 = time.perf_counter()
+        slot = yield self._checkout()
+        checkout = time.perf_counter() - t0
+        try:
+            url, body, screenshot, timing = yield threads.deferToThread(self._load, slot, request)
+        except TimeoutException:
+            # 待機条件のタイムアウトはドライバ自体は健全
+            slot.pages += 1
+            self._checkin(slot)
+            raise
+        except Exception:
+            # クラッシュ等 → 作り直し
+            self._retire(slot)
+            raise
+
+        slot.pages += 1
+        request.meta["selenium_timing"] = {"checkout": checkout, **timing}
+        if screenshot is not None:
+            request.meta["screenshot"] = screenshot
+
+        if request.meta.get("selenium_pool_pin"):
+            released = []
+
+            def release():
+                if not released:
+                    released.append(True)
+                    self._checkin(slot)
+
+            request.meta["driver"] = slot.driver
+            request.meta["driver_release"] = release
+        else:
+            self._checkin(slot)
+
+        return HtmlResponse(url, body=str.encode(body), encoding="utf-8", request=request)
+
+    def spider_closed(self):
+        for slot in list(self._slots):
+            self._quit(slot.driver)
+        self._slots.clear()
@@ -0,0 +1,121 @@
+# horse_ai_scrapy/session.py
+"""
+netkeiba のログイン済み Cookie の保存・共有（{OUTPUT_BASE_DIR}/.session/netkeiba.json）
+
+- ログインできたら Cookie を期限付きで保存し、次回の起動・他のワーカー（同じ SESSION_PATH を見るもの）は
+  ログインせずにそれを使う。HTTP の Request（cookies=）にも Selenium の描画にもそのまま渡せる
+- 期限はログイン Cookie（SESSION_AUTH_COOKIES）の expiry と SESSION_MAX_AGE の早い方。
+  計測用など他の短命な Cookie の期限では切らない。アカウント（NK_EMAIL）が違えば使わない
+- ページがログアウト状態（session_lapsed()）なら invalidate() して取り直す。
+  他のワーカーが先に新しいセッションを保存していれば、それを読むだけで済む
+※ Cookie はそのままログイン情報なので、ファイルは所有者のみ読み書き可（0600）にする
+"""
+import hashlib
+import json
+import os
+import time
+
+# ログアウト状態のページにはログインへのリンクだけがあり、ログアウトへのリンクが無い
+LOGGED_OUT_XPATH = '//a[contains(@href, "pid=login")]'
+LOGGED_IN_XPATH = '//a[contains(@href, "pid=logout")]'
+# 保存する Cookie の項目（Selenium の get_cookies() の形）
+COOKIE_KEYS = ("name", "value", "domain", "path", "expiry", "secure", "httpOnly")
+# ログイン状態を持つ Cookie（期限の判定に使う）
+AUTH_COOKIES = ("nkauth",)
+
+
+def session_lapsed(response) -> bool:
+    """ログアウト状態のページか（ログインのリンクがあり、ログアウトのリンクが無い）"""
+    return bool(response.xpath(LOGGED_OUT_XPATH)) and not response.xpath(LOGGED_IN_XPATH)
+
+
+def _account_key(account: str) -> str:
+    # メールアドレスそのものはファイルに残さない
+    return hashlib.sha256(account.strip().lower().encode("utf-8")).hexdigest()[:16]
+
+
+class SessionStore:
+    """
+    Cookie（list[dict]）を JSON 1ファイルに保存する
+    - load(): 期限内・同じアカウント・invalidate されていなければ Cookie、それ以外は None
+    - save(): 一時ファイル → os.replace で書く（読み手が途中の内容を見ない）
+    - invalidate(): 自分が読んだ（保存した）セッションのままなら無効にする。他が更新済みなら何もしない
+    """
+    def __init__(self, path: str, max_age: float = 7 * 86400, auth_cookies=AUTH_COOKIES):
+        self.path = path
+        self.max_age = max_age
+        self.auth_cookies = set(auth_cookies)
+        # 最後に load / save したセッションの保存時刻
+        self.saved_at: float | None = None
+
+    def _read(self) -> dict | None:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, data: dict) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    def load(self, account: str, now: float | None = None) -> list[dict] | None:
+        data = self._read()
+        now = now or time.time()
+        if not data or data.get("stale") or data.get("account") != _account_key(account):
+            return None
+        if data.get("expires_at", 0) <= now or not data.get("cookies"):
+            return None
+        self.saved_at = data.get("saved_at")
+        return data["cookies"]
+
+    def newer(self) -> bool:
+        """load / save した後に、別のプロセスが新しいセッションを保存したか"""
+        data = self._read()
+        return bool(data) and not data.get("stale") and data.get("saved_at") != self.saved_at
+
+    def save(self, account: str, cookies: list[dict]) -> None:
+        now = time.time()
+        cookies = [{k: c[k] for k in COOKIE_KEYS if k in c} for c in cookies if c.get("name")]
+        # 期限はログイン Cookie だけで決める（無期限・見当たらなければ SESSION_MAX_AGE のみ）
+        expiries = [c["expiry"] for c in cookies if c["name"] in self.auth_cookies and c.get("expiry")]
+        expires_at = min([now + self.max_age] + expiries)
+        self._write({
+            "account": _account_key(account),
+            "saved_at": now,
+            "expires_at": expires_at,
+            "stale": False,
+            "cookies": cookies,
+        })
+        self.saved_at = now
+
+    def invalidate(self) -> None:
+        data = self._read()
+        if data and data.get("saved_at") == self.saved_at and not data.get("stale"):
+            data["stale"] = True
+            self._write(data)
+
+
+def request_cookies(cookies: list[dict]) -> list[dict]:
+    """保存形式 → scrapy.Request(cookies=...) / SeleniumRequest(cookies=...) に渡す形"""
+    return [{k: c[k] for k in ("name", "value", "domain", "path") if k in c} for c in cookies]
+
+
+def session_path(settings) -> str:
+    """SESSION_PATH（既定 {OUTPUT_BASE_DIR}/.session/netkeiba.json）"""
+    return settings.get("SESSION_PATH") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), ".session", "netkeiba.json")
+
+
+def open_session_store(settings) -> SessionStore | None:
+    """SESSION_ENABLED の SessionStore（session_path()）"""
+    if not settings.getbool("SESSION_ENABLED", True):
+        return None
+    return SessionStore(
+        session_path(settings),
+        settings.getfloat("SESSION_MAX_AGE", 7 * 86400),
+        settings.getlist("SESSION_AUTH_COOKIES") or AUTH_COOKIES,
+    )
@@ -10,12 +10,24 @@ NK_PASSWORD = "gkjthb3a"
 # robots に阻まれて進まないケースの切り分けのため、まずは False
 ROBOTSTXT_OBEY = False
 
-# —— リクエスト制御（直列・RANDOM維持）——
+# —— リクエスト制御（RANDOM維持）——
+# 初期値。以降は AdaptiveRateMiddleware がホスト毎に遅延・同時接続数を調整する
 CONCURRENT_REQUESTS_PER_DOMAIN = 1
 DOWNLOAD_DELAY = 2.0
 RANDOMIZE_DOWNLOAD_DELAY = True
 AUTOTHROTTLE_ENABLED = False
 
+# —— ホスト毎の自動レート調整（AdaptiveRateMiddleware）——
+# 既定の範囲は common/config.py の [scraping]（download_delay / autothrottle_* / max_concurrent_per_domain）
+# 遅延の下限は DOWNLOAD_DELAY を下回らない（下げる場合は ADAPTIVE_RATE_MIN_DELAY を明示）
+ADAPTIVE_RATE_ENABLED = True
+# ホスト個別の範囲（min_delay / start_delay / max_delay / target / max_concurrency）
+ADAPTIVE_RATE_HOSTS = {
+    "regist.netkeiba.com": {"min_delay": 2.0, "max_concurrency": 1},
+}
+# 選んだ遅延・同時接続数をログに出す間隔（秒）
+ADAPTIVE_RATE_REPORT_INTERVAL = 60
+
 # タイムアウト＆リトライ
 DOWNLOAD_TIMEOUT = 30
 RETRY_TIMES = 3
@@ -25,6 +37,71 @@ FEED_EXPORT_ENCODING = "utf-8"
 OUTPUT_BASE_DIR = "data"
 # ← 追記モード：存在時ヘッダ無しで追記、新規ならヘッダ付き
 EXPORT_OVERWRITE = False
+# —— 主キーでの upsert（同じキー・同じ内容は書かず、変わった行だけ追記）——
+# 索引は {CSVのフォルダ}/.index/{CSV名}.sqlite3。dead 行の割合が EXPORT_COMPACT_RATIO 以上なら終了時に書き直す
+# 既定は従来どおり追記のみ（-s EXPORT_UPSERT=1 で有効）
+EXPORT_UPSERT = False
+EXPORT_PRIMARY_KEYS = {
+    "race_id.csv": ["race_id"],
+    "race_result.csv": ["race_id", "horse_number"],
+    "race_info.csv": ["race_id"],
+    "race_odds.csv": ["race_id"],
+    "horse_info.csv": ["horse_id"],
+    "shutuba.csv": ["race_id", "horse_number"],
+    "live_odds.csv": ["race_id", "horse_number", "observed_at"],
+    "pedigree.csv": ["horse_id"],
+}
+EXPORT_COMPACT_RATIO = 0.2
+# CSV の書き込み方式（"sync": 従来どおり item 毎にその場で書く / "thread": 専用スレッドでまとめ書き）
+EXPORT_WRITER_MODE = "sync"
+# 書き込み待ちキューの上限行数（満杯ならクロール側が待つ）/ 1回にまとめて書く行数 / OS へ flush する間隔（秒）
+EXPORT_QUEUE_SIZE = 10000
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FLUSH_INTERVAL = 5
+# チェックポイント（進捗 commit の直前）で fsync してから確定する
+EXPORT_FSYNC = True
+
+# —— 再開用の進捗記録（{OUTPUT_BASE_DIR}/.progress/{spider}.sqlite3）——
+# 取得済みIDは次回起動時に除外。最初から取り直すときは -a resume=0
+PROGRESS_ENABLED = True
+# この件数のIDが完了する毎に CSV を flush して進捗を確定
+PROGRESS_COMMIT_EVERY = 50
+
+# —— race_id_spider の区画（年×月×競馬場）——
+# 月末からこの日数以内の区画は「まだ開いている」として毎回取り直す
+RACE_ID_REOPEN_DAYS = 7
+
+# —— 複数プロセス/マシンで ID を分け合う作業キュー（horse_ai_scrapy.workqueue）——
+# SQLite のパス か http://host:port（serve の窓口）。None なら従来どおり ID CSV を1プロセスで処理（-a queue=… でも指定可）
+WORK_QUEUE = None
+# 1回に借りる件数 / 貸し出し期限（秒）/ 何回借りても終わらなければ failed にするか
+WORK_QUEUE_BATCH_SIZE = 20
+WORK_QUEUE_LEASE_SECONDS = 900
+WORK_QUEUE_MAX_ATTEMPTS = 5
+# 未処理が無く他ワーカーの貸し出しだけ残っているときに待つ間隔（秒）
+WORK_QUEUE_POLL_INTERVAL = 30
+# ワーカー名（既定: ホスト名-番号、空いている最小の番号）。出力はワーカー毎に {OUTPUT_BASE_DIR}/workers/{ワーカー名}/ へ
+# （セッション・鮮度の記録は共有。終わったら `python -m horse_ai_scrapy.workqueue merge` でまとめる）
+WORK_QUEUE_WORKER = None
+
+# —— 血統（bloodline_spider、父・母を {OUTPUT_BASE_DIR}/pedigree に horse コードの int32 配列で、numpy が必要）——
+# 何代前まで揃えるか。5 までは1頭1ページ、それより深い分は父母が未取得の祖先のページを1頭1回だけ取る
+# 検索は python -m horse_ai_scrapy.processing.pedigree ancestors / crosses / inbreeding <horse_id>
+PEDIGREE_DEPTH = 5
+# 既定: {OUTPUT_BASE_DIR}/pedigree
+PEDIGREE_DIR = None
+# このページ数を読む毎に配列をディスクへ（残りは終了時）
+PEDIGREE_FLUSH_PAGES = 200
+
+# —— 当日オッズの定期取得（race_info_spider -a live=1、live_odds.csv は前回から変わった馬だけ追記）——
+# "api": 単勝オッズは JSON を HTTP で取り、出馬表の描画は馬体重用に LIVE_ODDS_PAGE_INTERVAL 秒毎 / "page": 毎回出馬表を描画
+LIVE_ODDS_SOURCE = "api"
+# [発走までの残り秒数がこれ以下なら, この間隔（秒）]。どれにも当たらなければ LIVE_ODDS_MAX_INTERVAL
+LIVE_ODDS_SCHEDULE = [[3600, 300], [1800, 120], [600, 60], [180, 20]]
+LIVE_ODDS_MAX_INTERVAL = 900
+LIVE_ODDS_PAGE_INTERVAL = 900
+# 発走からこの秒数後に追跡をやめる（締切後の確定オッズまで取る）
+LIVE_ODDS_AFTER_POST = 120
 
 # --- Selenium (Chrome) ---
 SELENIUM_DRIVER_NAME = "chrome"
@@ -42,16 +119,138 @@ SELENIUM_DRIVER_ARGUMENTS = [
     # 余計なログを抑制
     "--log-level=3",
 ]
+# —— ログイン済みセッションの保存（horse_ai_scrapy.session、{OUTPUT_BASE_DIR}/.session/netkeiba.json）——
+# 期限内なら次回・他ワーカーはブラウザでログインせず Cookie を使う。ページがログアウト状態ならログインし直す
+SESSION_ENABLED = True
+# 既定: {OUTPUT_BASE_DIR}/.session/netkeiba.json（複数マシンで共有するなら共有フォルダを指定）
+SESSION_PATH = None
+# Cookie の期限より前でも、保存からこの秒数で使わなくなる
+SESSION_MAX_AGE = 7 * 86400
+# 期限の判定に使うログイン Cookie の名前（他の Cookie の expiry は見ない）
+SESSION_AUTH_COOKIES = ["nkauth"]
+# 1回のクロールでログインし直す上限（ログアウト状態が続くページで繰り返さない）
+SESSION_RELOGIN_MAX = 3
+
+# race_result_spider の取得モード（"http": 通常リクエスト＋表欠落時のみ Selenium / "selenium": 全ページ Selenium）
+# 実行時に -a fetch_mode=selenium で上書き可
+RACE_RESULT_FETCH_MODE = "http"
 # Chromedriver 標準ログの捨て先（Windows: 'NUL' / Linux/Mac: '/dev/null'）
 SELENIUM_DRIVER_LOG_PATH = "NUL"
 
+# --- Chrome ドライバプール（PooledSeleniumMiddleware）---
+# 同時に保持する eager Chrome の台数（並列描画には CONCURRENT_REQUESTS_PER_DOMAIN も合わせて上げる）
+SELENIUM_POOL_SIZE = 2
+# このページ数を描画したドライバは作り直す（メモリ肥大対策、0で無効）
+SELENIUM_POOL_MAX_PAGES = 200
+
+# —— 描画の方針（horse_ai_scrapy.render、PooledSeleniumMiddleware）——
+# "eager": DOM構築まで待ってから wait_until をポーリング / "observe": meta["render_ready"] のセレクタが
+# DOM に現れた瞬間に渡す（MutationObserver）。python bench/bench_render.py で両方の描画時間を比べられる
+SELENIUM_RENDER_MODE = "eager"
+# これ以外のホストは名前解決させない（広告・解析・他社スクリプトを取りに行かない）。空リストで制限なし
+SELENIUM_ALLOW_HOSTS = ["netkeiba.com", "*.netkeiba.com"]
+# 許可したホストでも取らない URL（CDP Network.setBlockedURLs のワイルドカード）
+SELENIUM_DENY_URLS = [
+    "*.woff*", "*.ttf*", "*.otf*", "*.mp4", "*.webm", "*.gif",
+    "*googletagmanager*", "*google-analytics*", "*doubleclick*", "*googlesyndication*", "*adservice*",
+]
+
+# —— 取得HTMLの保存（{OUTPUT_BASE_DIR}/archive、gzip・内容アドレス）——
+# 保存済みページは python -m horse_ai_scrapy.replay <spider> でオフライン再パースできる（-s HTML_ARCHIVE_ENABLED=1 で有効）
+HTML_ARCHIVE_ENABLED = False
+
+# —— 鮮度（取り直しの要否、{OUTPUT_BASE_DIR}/.fetch_log.sqlite3）——
+# 過去年のレースは不変、それ以外は種類毎の経過秒数で取り直す（ETag / Last-Modified があれば条件付き GET）
+# -s FRESHNESS_ENABLED=1 で有効（無効なら取得済みIDは進捗記録どおり取り直さない）
+FRESHNESS_ENABLED = False
+# 種類 → 取り直すまでの秒数（None は一度取れたら取り直さない）。馬は新しいレース結果に出たら期限前でも取り直す
+FRESHNESS_MAX_AGE = {
+    "race": None,
+    "shutuba": 6 * 3600,
+    "horse": 30 * 86400,
+}
+# 既定: {OUTPUT_BASE_DIR}/.fetch_log.sqlite3
+FRESHNESS_LOG_PATH = None
+
+# —— 計測（horse_ai_scrapy.metrics、{OUTPUT_BASE_DIR}/metrics に {spider}.prom と {spider}-YYYYMMDD.jsonl）——
+# ダウンロード/Selenium/パース/pipeline の時間、件数・エラー・キュー長をスパイダー×ホスト毎に（-s METRICS_ENABLED=1 で有効）
+METRICS_ENABLED = False
+# 書き出し間隔（秒、0 なら終了時だけ）
+METRICS_EXPORT_INTERVAL = 60
+# 既定: {OUTPUT_BASE_DIR}/metrics
+METRICS_DIR = None
+
+# —— 抜き取りプロファイル（horse_ai_scrapy.profiling、-s PROFILE_ENABLED=1 で有効）——
+# callback / pipeline の呼び出しをこの割合で cProfile とスタック抜き取りにかけ、終了時に {OUTPUT_BASE_DIR}/profiles へ
+PROFILE_ENABLED = False
+PROFILE_SAMPLE_RATE = 0.05
+# スタックを数える間隔（秒、0 ならスタックは取らず cProfile だけ）/ top.txt に出す関数の数
+PROFILE_STACK_INTERVAL = 0.005
+PROFILE_TOP_N = 30
+# 既定: {OUTPUT_BASE_DIR}/profiles
+PROFILE_DIR = None
+
+EXTENSIONS = {
+    "horse_ai_scrapy.metrics.MetricsExtension": 500,
+    "horse_ai_scrapy.profiling.ProfilingExtension": 510,
+}
+
+# callback の時間を測るため、スパイダー寄り（組み込みの最大 DepthMiddleware(900) より後ろ）
+SPIDER_MIDDLEWARES = {
+    "horse_ai_scrapy.metrics.MetricsSpiderMiddleware": 950,
+    "horse_ai_scrapy.profiling.ProfilingSpiderMiddleware": 960,
+}
+
 DOWNLOADER_MIDDLEWARES = {
     "scrapy.downloadermiddlewares.useragent.UserAgentMiddleware": None,
     "horse_ai_scrapy.middlewares.RotateUserAgentMiddleware": 400,
-    # 公式の SeleniumMiddleware（独自Eagerは外す）
-    "scrapy_selenium.SeleniumMiddleware": 800,
+    # 取り直し不要なページはアーカイブ・Selenium より手前で止める
+    "horse_ai_scrapy.freshness.FreshnessMiddleware": 450,
+    # 展開後の本文を保存するため HttpCompression(590) より手前
+    "horse_ai_scrapy.archive.HtmlArchiveMiddleware": 500,
+    # 生の応答（リトライ前）を観測するためダウンローダ寄り
+    "horse_ai_scrapy.adaptive_rate.AdaptiveRateMiddleware": 900,
+    # SeleniumRequest はドライバプールで描画（公式 SeleniumMiddleware の置き換え）
+    "horse_ai_scrapy.selenium_pool_mw.PooledSeleniumMiddleware": 800,
+    # 生のダウンロード時間・例外を測るため最もダウンローダ寄り
+    "horse_ai_scrapy.metrics.MetricsDownloaderMiddleware": 950,
 }
 
+# —— Parquet 出力（CSV と並行、{OUTPUT_BASE_DIR}/parquet/<file>/year=YYYY/venue=JJ/）——
+# pyarrow が必要
+PARQUET_EXPORT_ENABLED = False
+# 1ファイル（行グループ）あたりの行数 / 溜めておく最大秒数
+PARQUET_ROW_GROUP_SIZE = 50000
+PARQUET_FLUSH_INTERVAL = 300
+
+# —— SQLite 保存（CSV と並行、検索は horse_ai_scrapy.storage.open_storage()）——
+# テーブルは _file 毎、主キーは EXPORT_PRIMARY_KEYS、race_id/horse_id/jockey_id/trainer_id に索引（-s STORAGE_ENABLED=1 で有効）
+STORAGE_ENABLED = False
+# 既定: {OUTPUT_BASE_DIR}/horse_ai.sqlite3
+STORAGE_PATH = None
+# 1トランザクションでまとめて書く件数
+STORAGE_BATCH_SIZE = 500
+
+# —— ID（馬/騎手/調教師/馬主/生産者）→ int32 コードの辞書（{OUTPUT_BASE_DIR}/id_codes、numpy が必要）——
+# 有効なら Parquet / SQLite 出力に {列}_code を足す（特徴量ストアは常にこのコードを行番号に使う）
+ID_CODES_ENABLED = False
+# 既定: {OUTPUT_BASE_DIR}/id_codes
+ID_CODES_DIR = None
+
+# —— 馬/騎手/調教師の直近成績の特徴量ストア（{OUTPUT_BASE_DIR}/features、numpy が必要）——
+# 作り直しは python -m horse_ai_scrapy.processing.features rebuild
+FEATURE_STORE_ENABLED = False
+# 既定: {OUTPUT_BASE_DIR}/features
+FEATURE_STORE_DIR = None
+# このレース数溜まる毎に日付順で反映
+FEATURE_STORE_FLUSH_RACES = 100
+
 ITEM_PIPELINES = {
+    # 先頭で時刻を記録 → 全 pipeline を通り抜けた時点（item_scraped）までを測る
+    "horse_ai_scrapy.metrics.MetricsPipeline": 100,
     "horse_ai_scrapy.pipelines.CsvExportPipeline": 300,
+    "horse_ai_scrapy.pipelines.ParquetExportPipeline": 310,
+    "horse_ai_scrapy.pipelines.SqliteStoragePipeline": 320,
+    "horse_ai_scrapy.pipelines.FeatureStorePipeline": 330,
+    "horse_ai_scrapy.pipelines.FreshnessPipeline": 340,
 }
\ No newline at end of file
@@ -1,10 +1,199 @@
+import csv
+import os
+import re
 import scrapy
+from ..items import PedigreeItem
+
+# 血統表の馬へのリンク（/horse/ped/… /horse/sire/… 等は除く）。外国馬は英数字の10桁
+_HORSE_HREF = re.compile(r"^(?:https?://db\.netkeiba\.com)?/horse/([0-9A-Za-z]{10})/?$")
+
+
+def blood_table(response, horse_id: str) -> list[tuple[str, str, str, str]]:
+    """
+    血統表（table.blood_table）→ [(horse_id, 馬名, 父ID, 母ID)]（"" は不明）
+    - セルは前順（本人の父 → その父系 → その母系 → 本人の母 …）に並ぶ
+    - 世代は rowspan から（5代表なら 16=1代目 … 1=5代目）。直前に出た1つ上の世代の馬が親、
+      その親の1つ目の子が父・2つ目が母
+    - 父母が表に載る馬（本人〜最終世代の1つ手前）だけ、馬毎に1回返す。先頭は本人（馬名はページ見出し）
+    """
+    cells = []
+    for td in response.xpath("//table[contains(@class,'blood_table')]//tr/td"):
+        span = int(td.attrib.get("rowspan") or 1)
+        cell_id, name = "", ""
+        for a in td.xpath(".//a[@href]"):
+            m = _HORSE_HREF.match(a.attrib["href"].strip())
+            if m:
+                cell_id = m.group(1)
+                name = re.sub(r"\s+", " ", a.xpath("string(.)").get() or "").strip()
+                break
+        cells.append((span, cell_id, name))
+    if not cells:
+        return []
+
+    generations = cells[0][0].bit_length()
+    title = response.xpath("//div[contains(@class,'db_head_name')]//h1/text()").get() or ""
+    # [horse_id, 馬名, 父ID, 母ID, 世代, 子の数]
+    nodes = [[horse_id, title.strip(), "", "", 0, 0]]
+    last = {0: nodes[0]}
+    for span, cell_id, name in cells:
+        gen = generations - (span.bit_length() - 1)
+        parent = last.get(gen - 1)
+        if gen < 1 or parent is None or parent[5] >= 2:
+            # 想定外の形（rowspan の崩れ）→ 以降の親子が取り違えになるので読まない
+            return []
+        parent[2 + parent[5]] = cell_id
+        parent[5] += 1
+        node = [cell_id, name, "", "", gen, 0]
+        last[gen] = node
+        nodes.append(node)
+    # 同じ祖先が複数の経路で出る（インブリード）→ 1回だけ
+    out = {}
+    for n in nodes:
+        if n[0] and n[4] < generations and n[0] not in out:
+            out[n[0]] = (n[0], n[1], n[2], n[3])
+    return list(out.values())
 
 
 class BloodlineSpiderSpider(scrapy.Spider):
+    """
+    入力: data/horse_id.csv（既定）にある 10桁 horse_id を読む
+    取得: https://db.netkeiba.com/horse/ped/{horse_id}/（5代血統表）
+      - 表から各馬の父・母を復元し（blood_table）、血統グラフ（processing/pedigree.py、spider.graph）に入れる
+      - PEDIGREE_DEPTH（-a depth=…）代まで揃える。グラフで父母が未取得の祖先だけ、その血統ページを取る
+        → 同じ祖先は全馬を通して1回だけ取る。グラフは保存されるので次回以降も取らない（再開もこれで足りる）
+      - 取得対象はグラフの配列から世代毎にまとめて引く（入力の全馬ぶんを1回で）
+    出力: pipeline（CsvExportPipeline）が item['_file']="pedigree.csv" を見てCSVに書く
+          （グラフに新しく入った馬だけ。horse_id, horse_name, sire_id, dam_id）
+    """
     name = "bloodline_spider"
-    allowed_domains = ["netkeiba.com"]
-    start_urls = ["https://netkeiba.com"]
+    allowed_domains = ["db.netkeiba.com"]
+
+    # このスパイダーでは Selenium を無効化（プロジェクト全体で有効でもここでOFF）
+    custom_settings = {
+        "LOG_LEVEL": "WARNING",
+        "DOWNLOADER_MIDDLEWARES": {
+            "scrapy_selenium.SeleniumMiddleware": None,
+            "horse_ai_scrapy.middlewares.RotateUserAgentMiddleware": 400,
+            "horse_ai_scrapy.archive.HtmlArchiveMiddleware": 500,
+            "horse_ai_scrapy.adaptive_rate.AdaptiveRateMiddleware": 900,
+            "horse_ai_scrapy.metrics.MetricsDownloaderMiddleware": 950,
+        },
+    }
+
+    def __init__(self, horse_ids: str | None = None, depth: str | None = None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.horse_id_csv_path = horse_ids
+        self.depth_arg = depth
+        self.depth = 5
+        # replay 等でグラフ無しに parse を呼んだときは None（表の馬をそのまま出すだけ）
+        self.graph = None
+        # 取得待ちの祖先コード → そのページから辿る代数
+        self._wanted: dict[int, int] = {}
+        self._failed: set[int] = set()
+        self._pages = 0
+        self._flush_pages = 200
+
+    # Scrapy 2.13+ 推奨の coroutine 版
+    async def start(self):
+        from ..processing.pedigree import open_pedigree_graph
+
+        self.depth = int(self.depth_arg or self.settings.getint("PEDIGREE_DEPTH", 5))
+        self._flush_pages = self.settings.getint("PEDIGREE_FLUSH_PAGES", 200)
+        self.graph = open_pedigree_graph(self.settings)
+
+        # 入力CSV（未指定なら data/horse_id.csv）
+        if not self.horse_id_csv_path:
+            base = self.settings.get("OUTPUT_BASE_DIR", "data")
+            self.horse_id_csv_path = os.path.join(base, "horse_id.csv")
+
+        if not os.path.exists(self.horse_id_csv_path):
+            self.logger.error(f"horse_id リストが見つかりません: {self.horse_id_csv_path}")
+            return
+
+        # 10桁IDを読み込み（1行目がヘッダなら自動スキップ）、順序保持で重複排除
+        tmp_ids: list[str] = []
+        with open(self.horse_id_csv_path, newline="", encoding="utf-8-sig") as f:
+            reader = csv.reader(f)
+            for i, row in enumerate(reader, start=1):
+                if not row or not row[0].strip():
+                    continue
+                s = row[0].strip().lstrip("\ufeff")
+                if i == 1 and not (len(s) == 10 and s.isdigit()):
+                    continue  # 先頭行はヘッダ扱い
+                if not (len(s) == 10 and s.isdigit()):
+                    raise ValueError(f"行{i}: '{s}' は10桁の数字ではありません。")
+                tmp_ids.append(s)
+        horse_ids = list(dict.fromkeys(tmp_ids))
+
+        requests = list(self._expand(self.graph.encode(horse_ids), self.depth))
+        print(f"[PROGRESS] loaded horse_ids: {len(horse_ids)} / pedigree pages to fetch: {len(requests)}"
+              f"（グラフに父母がある馬: {len(self.graph)}）")
+        for request in requests:
+            yield request
+
+    def _expand(self, codes, depth: int):
+        """codes から depth 代までのうち、父母が未取得の馬の血統ページを要求（取得待ち・失敗済みは出さない）"""
+        pending, gens = self.graph.unresolved(codes, depth)
+        for code, gen in zip(pending.tolist(), gens.tolist()):
+            if code in self._failed:
+                continue
+            remaining = depth - gen
+            if code in self._wanted:
+                # 既に要求済み → 読んだ時に深い方まで辿る
+                self._wanted[code] = max(self._wanted[code], remaining)
+                continue
+            self._wanted[code] = remaining
+            yield self._pedigree_request(self.graph.horse_ids([code])[0], code)
+
+    def _pedigree_request(self, horse_id: str, code: int):
+        return scrapy.Request(
+            url=f"https://db.netkeiba.com/horse/ped/{horse_id}/",
+            callback=self.parse_pedigree,
+            errback=self.err_pedigree,
+            cb_kwargs={"horse_id": horse_id},
+            meta={"pedigree_code": code},
+            dont_filter=True,
+        )
+
+    def err_pedigree(self, failure):
+        horse_id = failure.request.cb_kwargs.get("horse_id")
+        code = failure.request.meta.get("pedigree_code")
+        self._wanted.pop(code, None)
+        # この実行では取り直さない（次回はグラフに無いので再び対象になる）
+        self._failed.add(code)
+        self.logger.warning(f"[ERR] horse_id={horse_id} : {repr(failure.value)[:200]}")
+
+    def parse_pedigree(self, response, horse_id: str):
+        rows = blood_table(response, horse_id)
+        if not rows:
+            self.logger.warning(f"[WARN] horse_id={horse_id} : 血統表を読めませんでした {response.url}")
+            if self.graph is not None:
+                code = response.meta.get("pedigree_code")
+                self._wanted.pop(code, None)
+                self._failed.add(code)
+            return
+
+        if self.graph is None:
+            new = [True] * len(rows)
+        else:
+            new = self.graph.add([r[0] for r in rows], [r[2] for r in rows], [r[3] for r in rows]).tolist()
+        for (hid, name, sire_id, dam_id), is_new in zip(rows, new):
+            if is_new:
+                yield PedigreeItem(_file="pedigree.csv", horse_id=hid, horse_name=name, sire_id=sire_id, dam_id=dam_id)
+
+        if self.graph is None:
+            return
+        code = response.meta.get("pedigree_code")
+        remaining = self._wanted.pop(code, self.depth)
+        yield from self._expand([code], remaining)
+
+        self._pages += 1
+        if self._flush_pages and self._pages % self._flush_pages == 0:
+            self.graph.flush()
+        if self._pages % 50 == 0:
+            print(f"[PROGRESS] pedigree pages: {self._pages} / 取得待ち: {len(self._wanted)} / 父母既知: {len(self.graph)}")
 
-    def parse(self, response):
-        pass
+    def closed(self, reason):
+        if self.graph is not None:
+            self.graph.flush()
+            print(f"[PROGRESS] pedigree pages: {self._pages} / 父母既知: {len(self.graph)} / 失敗: {len(self._failed)}")
@@ -2,7 +2,10 @@ import csv
 import os
 import re
 import scrapy
+from ..freshness import NotModified, due_for_refetch
 from ..items import HorseInfoItem
+from ..progress import open_progress_store
+from ..workqueue import open_queue_progress, use_worker_output
 
 
 class HorseInfoSpider(scrapy.Spider):
@@ -22,24 +25,43 @@ class HorseInfoSpider(scrapy.Spider):
     # このスパイダーでは Selenium を無効化（プロジェクト全体で有効でもここでOFF）
     custom_settings = {
         "LOG_LEVEL": "WARNING",
-        "DOWNLOAD_DELAY": 1.0,
-        "AUTOTHROTTLE_ENABLED": True,
         "DOWNLOADER_MIDDLEWARES": {
             "scrapy_selenium.SeleniumMiddleware": None,
             # UA/言語ローテーションを使っているなら（存在する場合のみ）
             "horse_ai_scrapy.middlewares.RotateUserAgentMiddleware": 400,
+            "horse_ai_scrapy.freshness.FreshnessMiddleware": 450,
+            "horse_ai_scrapy.archive.HtmlArchiveMiddleware": 500,
+            "horse_ai_scrapy.adaptive_rate.AdaptiveRateMiddleware": 900,
+            "horse_ai_scrapy.metrics.MetricsDownloaderMiddleware": 950,
         },
     }
 
-    def __init__(self, horse_ids: str | None = None, *args, **kwargs):
+    def __init__(self, horse_ids: str | None = None, resume: str | None = None, queue: str | None = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.horse_id_csv_path = horse_ids
+        self.resume = resume
+        self.queue = queue
+        self.progress = None
         self.horse_ids: list[str] = []
         self._total_horses = 0
         self._done_horses = 0
 
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # 作業キューを使うなら出力先をワーカー毎に（pipeline が開く前に。workqueue.py）
+        use_worker_output(crawler.settings, spider.queue)
+        return spider
+
     # Scrapy 2.13+ 推奨の coroutine 版
     async def start(self):
+        # 共有の作業キュー（-a queue=… / WORK_QUEUE）があれば、ID CSV ではなくキューから借りた分を取る
+        self.progress = open_queue_progress(self, self.queue)
+        if self.progress is not None:
+            async for horse_id in self.progress.iter_ids():
+                yield self._horse_request(horse_id)
+            return
+
         # 入力CSV（未指定なら data/horse_id.csv）
         if not self.horse_id_csv_path:
             base = self.settings.get("OUTPUT_BASE_DIR", "data")
@@ -64,25 +86,44 @@ class HorseInfoSpider(scrapy.Spider):
                 tmp_ids.append(s)
 
         self.horse_ids = list(dict.fromkeys(tmp_ids))
+
+        # 前回までに取得済みの horse_id を除外（-a resume=0 で最初から）。鮮度切れ・新しく走った馬は残す
+        self.progress = open_progress_store(self, self.resume)
+        if self.progress is not None:
+            loaded = len(self.horse_ids)
+            self.horse_ids = self.progress.filter_pending(
+                self.horse_ids, due_for_refetch(self.settings, "horse", self.horse_ids)
+            )
+            print(f"[PROGRESS] skip done horse_ids: {loaded - len(self.horse_ids)}")
+
         self._total_horses = len(self.horse_ids)
         print(f"[PROGRESS] loaded horse_ids: {self._total_horses}")
 
         for horse_id in self.horse_ids:
-            yield scrapy.Request(
-                url=f"https://db.netkeiba.com/horse/{horse_id}/",
-                callback=self.parse_horse_page,
-                errback=self.err_horse_page,
-                cb_kwargs={"horse_id": horse_id},
-                dont_filter=True,
-            )
+            yield self._horse_request(horse_id)
+
+    def _horse_request(self, horse_id: str):
+        return scrapy.Request(
+            url=f"https://db.netkeiba.com/horse/{horse_id}/",
+            callback=self.parse_horse_page,
+            errback=self.err_horse_page,
+            cb_kwargs={"horse_id": horse_id},
+            dont_filter=True,
+        )
 
     def err_horse_page(self, failure):
         horse_id = failure.request.cb_kwargs.get("horse_id")
-        self.logger.warning(f"[ERR] horse_id={horse_id} : {repr(failure.value)[:200]}")
+        ok = bool(failure.check(NotModified))
+        if ok:
+            # まだ新しい / 304（freshness.py）→ 取得済み扱い
+            if self.progress is not None:
+                self.progress.mark_done(horse_id)
+        else:
+            self.logger.warning(f"[ERR] horse_id={horse_id} : {repr(failure.value)[:200]}")
         self._done_horses += 1
         if self._total_horses and (self._done_horses % 10 == 0 or self._done_horses == self._total_horses):
             pct = self._done_horses / self._total_horses * 100
-            print(f"[PROGRESS] {self._done_horses}/{self._total_horses} ({pct:.1f}%) last={horse_id} ok=False")
+            print(f"[PROGRESS] {self._done_horses}/{self._total_horses} ({pct:.1f}%) last={horse_id} ok={ok}")
 
     def parse_horse_page(self, response, horse_id: str):
         # 見出し: 性別・毛色（全角スペ保持、\xa0/改行のみ除去）
@@ -166,6 +207,9 @@ class HorseInfoSpider(scrapy.Spider):
         )
 
         # 進捗
+        if self.progress is not None:
+            self.progress.mark_done(horse_id)
+
         self._done_horses += 1
         if self._total_horses and (self._done_horses % 10 == 0 or self._done_horses == self._total_horses):
             pct = self._done_horses / self._total_horses * 100
@@ -1,8 +1,24 @@
+import datetime as dt
 import scrapy
 import logging
+from urllib.parse import urlencode
+
+from horse_ai_scrapy.ini_config import load_ini
 from horse_ai_scrapy.items import RaceIdItem
+from horse_ai_scrapy.progress import open_progress_store
+
+# 競馬場コード（01=札幌 … 10=小倉）
+JYO_CODES = ("01", "02", "03", "04", "05", "06", "07", "08", "09", "10")
+
 
 class RaceIdSpiderSpider(scrapy.Spider):
+    """
+    race_list 検索を 年×月×競馬場 の区画に分けて、区画毎に並行してページ送りする
+    - 期間は common/config.py の [period]（-a start=2024-01 -a end=2025-07 で上書き）
+    - 最終ページまで読めた区画は進捗ストアに記録し、次回から飛ばす
+      ただし月末から RACE_ID_REOPEN_DAYS 日以内の区画（当月など）は「まだ開いている」ので毎回取り直し、記録もしない
+    - -a resume=0 で記録を消して全区画を取り直す
+    """
     name = "race_id_spider"
     allowed_domains = ["db.netkeiba.com"]
 
@@ -12,28 +28,92 @@ class RaceIdSpiderSpider(scrapy.Spider):
     export_fields = ["race_id"]
 
     custom_settings = {
-        'LOG_LEVEL': 'INFO', 
+        'LOG_LEVEL': 'INFO',
     }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, start: str | None = None, end: str | None = None, resume: str | None = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.count = 0
+        self.start_month = start
+        self.end_month = end
+        self.resume = resume
+        self.progress = None
+
+    @staticmethod
+    def _parse_month(value: str) -> tuple[int, int]:
+        year, mon = str(value).replace("/", "-").split("-")
+        return int(year), int(mon)
+
+    def _period(self) -> tuple[tuple[int, int], tuple[int, int]]:
+        ini = load_ini(self.settings)
+        sec = "period"
+        first = (ini.getint(sec, "start_year", fallback=2000), ini.getint(sec, "start_mon", fallback=1))
+        last = (ini.getint(sec, "end_year", fallback=dt.date.today().year), ini.getint(sec, "end_mon", fallback=12))
+        if self.start_month:
+            first = self._parse_month(self.start_month)
+        if self.end_month:
+            last = self._parse_month(self.end_month)
+        return first, last
+
+    @staticmethod
+    def _months(first: tuple[int, int], last: tuple[int, int]):
+        year, mon = first
+        while (year, mon) <= last:
+            yield year, mon
+            year, mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+
+    def _is_open(self, year: int, mon: int, today: dt.date) -> bool:
+        """月末 + RACE_ID_REOPEN_DAYS 日を過ぎていなければ、まだ結果が増える区画"""
+        month_end = dt.date(year + mon // 12, mon % 12 + 1, 1) - dt.timedelta(days=1)
+        return today <= month_end + dt.timedelta(days=self.settings.getint("RACE_ID_REOPEN_DAYS", 7))
+
+    @staticmethod
+    def partition_key(year: int, mon: int, jyo: str) -> str:
+        return f"{year:04d}-{mon:02d}-{jyo}"
+
+    @staticmethod
+    def partition_url(year: int, mon: int, jyo: str) -> str:
+        query = urlencode([
+            ("pid", "race_list"), ("word", ""),
+            ("track[]", "1"), ("track[]", "2"), ("track[]", "3"),
+            ("start_year", year), ("start_mon", mon), ("end_year", year), ("end_mon", mon),
+            ("jyo[]", jyo),
+            ("kyori_min", ""), ("kyori_max", ""), ("sort", "date"), ("list", 100),
+        ])
+        return f"https://db.netkeiba.com/?{query}"
 
     async def start(self):
-        start_year = 2000
-        start_mon = 1
-        end_year = 2030
-        end_mon = 12
-
-        start_url = (
-            "https://db.netkeiba.com/?pid=race_list&word=&track%5B%5D=1&track%5B%5D=2&track%5B%5D=3&"
-            f"start_year={start_year}&start_mon={start_mon}&end_year={end_year}&end_mon={end_mon}"
-            "&jyo%5B%5D=01&jyo%5B%5D=02&jyo%5B%5D=03&jyo%5B%5D=04&jyo%5B%5D=05&jyo%5B%5D=06&jyo%5B%5D=07&jyo%5B%5D=08&jyo%5B%5D=09&jyo%5B%5D=10"
-            "&kyori_min=&kyori_max=&sort=date&list=100"
-        )
-        yield scrapy.Request(url=start_url, callback=self.parse)
-
-    def parse(self, response):
+        first, last = self._period()
+        today = dt.date.today()
+        self.progress = open_progress_store(self, self.resume)
+        done = self.progress.done_ids() if self.progress is not None else set()
+
+        partitions = []
+        skipped = 0
+        for year, mon in self._months(first, last):
+            # 未来の月にはまだ結果が無い
+            if dt.date(year, mon, 1) > today:
+                break
+            is_open = self._is_open(year, mon, today)
+            for jyo in JYO_CODES:
+                key = self.partition_key(year, mon, jyo)
+                if key in done and not is_open:
+                    skipped += 1
+                    continue
+                partitions.append((key, year, mon, jyo, is_open))
+        logging.info(f"[{self.name}] 区画: {len(partitions)}件（取得済みでスキップ {skipped}件）"
+                     f" 期間 {first[0]}-{first[1]:02d}〜{last[0]}-{last[1]:02d}")
+
+        # 新しい月から（日次の更新で当月が先に終わるように）
+        for key, year, mon, jyo, is_open in reversed(partitions):
+            yield scrapy.Request(
+                url=self.partition_url(year, mon, jyo),
+                callback=self.parse,
+                errback=self.err_partition,
+                cb_kwargs={"partition": key, "is_open": is_open},
+            )
+
+    def parse(self, response, partition: str = "", is_open: bool = True):
         # race_id抽出
         race_ids = response.xpath(
             '//td[contains(@class, "w_race")]/a[contains(@href, "/race/")]/@href'
@@ -48,7 +128,23 @@ class RaceIdSpiderSpider(scrapy.Spider):
                 race_id=rid
             )
 
-        # 次ページ（「次へ」）
+        # 次ページ（「次へ」）。途中の区画を先に片付けて、並行中の区画数を増やしすぎない
         next_link = response.xpath('//a[@title="次"]/@href').get()
         if next_link:
-            yield response.follow(next_link, callback=self.parse)
+            yield response.follow(
+                next_link,
+                callback=self.parse,
+                errback=self.err_partition,
+                cb_kwargs={"partition": partition, "is_open": is_open},
+                priority=response.request.priority + 1,
+            )
+        elif partition:
+            # 最終ページまで読めた。開いている区画は次回も取り直すので記録しない
+            self.crawler.stats.inc_value("race_id/partitions_done")
+            if self.progress is not None and not is_open:
+                self.progress.mark_done(partition)
+
+    def err_partition(self, failure):
+        partition = failure.request.cb_kwargs.get("partition")
+        self.crawler.stats.inc_value("race_id/partitions_failed")
+        self.logger.warning(f"[ERR] partition={partition} : {repr(failure.value)[:200]}（次回取り直し）")
@@ -1,19 +1,29 @@
 import os
 import re
 import csv
+import time
 import logging
 import scrapy
+from scrapy.utils.defer import maybe_deferred_to_future
 from scrapy_selenium import SeleniumRequest
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
-from horse_ai_scrapy.items import RaceInfoItem
+from horse_ai_scrapy.freshness import NotModified, due_for_refetch
+from horse_ai_scrapy.items import LiveOddsItem, ShutubaItem
+from horse_ai_scrapy.live_odds import (
+    LIVE_ODDS_SOURCES, ODDS_API_URL, TRACKED_FIELDS,
+    LiveRace, LiveSchedule, OddsTracker, now_jst, parse_odds_api, parse_post_time,
+)
+from horse_ai_scrapy.progress import open_progress_store
+from horse_ai_scrapy.table_extract import extract_shutuba_rows
+from horse_ai_scrapy.workqueue import open_queue_progress, use_worker_output
 
 class RaceInfoSpiderSpider(scrapy.Spider):
     name = "race_info_spider"
     allowed_domains = ["netkeiba.com", "race.netkeiba.com", ""]
 
-    # 出力
-    export_file = "race_info.csv"
+    # 出力（race_result_spider の race_info.csv とは列が違うので別ファイル）
+    export_file = "shutuba.csv"
     export_fields = [
         "race_id", "race_name", "race_info1", "race_info2", "race_grade",
         "gate_number", "horse_number", "horse_id", "horse_sex_age",
@@ -24,14 +34,37 @@ class RaceInfoSpiderSpider(scrapy.Spider):
     # 実行時は WARNING でOK。切り分け時は INFO に上げても良い
     custom_settings = {"LOG_LEVEL": "WARNING"}
 
-    def __init__(self, race_ids: str | None = None, *args, **kwargs):
+    def __init__(self, race_ids: str | None = None, resume: str | None = None, queue: str | None = None,
+                 live: str | None = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.race_ids_path = race_ids
+        self.resume = resume
+        self.queue = queue
+        # -a live=1: 当日レースのオッズを発走まで定期取得（live_odds.py）
+        self.live = str(live or "").strip().lower() in ("1", "true", "yes")
+        self.progress = None
         self.total = 0
         self.done = 0
+        # race_id → LiveRace（live モード）
+        self._live: dict[str, LiveRace] = {}
+        self._tracker = OddsTracker()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # 作業キューを使うなら出力先をワーカー毎に（pipeline が開く前に。workqueue.py）
+        use_worker_output(crawler.settings, spider.queue)
+        return spider
 
     # Scrapy 2.13+ 推奨の start()（非同期コルーチン）
     async def start(self):
+        # 共有の作業キュー（-a queue=… / WORK_QUEUE）があれば、ID CSV ではなくキューから借りた分を取る
+        self.progress = open_queue_progress(self, self.queue)
+        if self.progress is not None:
+            async for rid in self.progress.iter_ids():
+                yield self._shutuba_request(rid)
+            return
+
         # 入力CSV（未指定なら data\race_id\race_id_list_2000_01-05.csv）
         if not self.race_ids_path:
             base = self.settings.get("OUTPUT_BASE_DIR", "data")
@@ -56,6 +89,19 @@ class RaceInfoSpiderSpider(scrapy.Spider):
                     ids.append(s)
 
         unique_ids = list(dict.fromkeys(ids))
+
+        if self.live:
+            async for request in self._live_requests(unique_ids):
+                yield request
+            return
+
+        # 前回までに取得済みの race_id を除外（-a resume=0 で最初から）。出馬表が鮮度切れのレースは残す
+        self.progress = open_progress_store(self, self.resume)
+        if self.progress is not None:
+            loaded = len(unique_ids)
+            unique_ids = self.progress.filter_pending(unique_ids, due_for_refetch(self.settings, "shutuba", unique_ids))
+            self.logger.warning(f"取得済みのためスキップ: {loaded - len(unique_ids)}件")
+
         self.total = len(unique_ids)
         if self.total == 0:
             self.logger.warning("race_id が0件でした。処理を終了します。")
@@ -63,31 +109,40 @@ class RaceInfoSpiderSpider(scrapy.Spider):
 
         logging.warning(f"[{self.name}] 開始: 0/{self.total} (0.0%)")
 
+        for rid in unique_ids:
+            yield self._shutuba_request(rid)
+
+    def _shutuba_request(self, rid: str, callback=None, errback=None, meta=None):
         # 厳しすぎると固まるため、どちらか出たらOKにする
         wait_condition = EC.any_of(
             EC.presence_of_element_located((By.CSS_SELECTOR, ".RaceTableArea tr.HorseList")),
             EC.presence_of_element_located((By.CSS_SELECTOR, ".RaceList_NameBox"))
         )
-
-        for rid in unique_ids:
-            url = f"https://race.netkeiba.com/race/shutuba.html?race_id={rid}&rf=race_submenu"
-            yield SeleniumRequest(
-                url=url,
-                callback=self.parse,
-                errback=self.errback_selenium,  # タイムアウト等でも次へ進める
-                meta={"race_id": rid},
-                wait_time=15,
-                wait_until=wait_condition,
-                dont_filter=True,
-            )
+        url = f"https://race.netkeiba.com/race/shutuba.html?race_id={rid}&rf=race_submenu"
+        return SeleniumRequest(
+            url=url,
+            callback=callback or self.parse,
+            errback=errback or self.errback_selenium,  # タイムアウト等でも次へ進める
+            # SELENIUM_RENDER_MODE="observe" では wait_until をポーリングせず、DOMContentLoaded 後に出走表の行があれば渡す
+            # （RaceList_NameBox は表より前にあるので待ち条件にしない → 表が欠けたまま渡さない）
+            meta={"race_id": rid, "render_ready": [".RaceTableArea tr.HorseList"], **(meta or {})},
+            wait_time=15,
+            wait_until=wait_condition,
+            dont_filter=True,
+        )
 
     def errback_selenium(self, failure):
-        """Selenium 側で Timeout/他例外が起きた時に呼ばれる"""
+        """Selenium 側で Timeout/他例外が起きた時に呼ばれる（鮮度判定で取らなかった時も）"""
         rid = failure.request.meta.get("race_id")
-        self.logger.warning(f"[ERR] race_id={rid} : {repr(failure.value)[:200]}")
+        if failure.check(NotModified):
+            # 過去のレース / まだ新しい（freshness.py）→ 取得済み扱い
+            if self.progress is not None:
+                self.progress.mark_done(rid)
+        else:
+            self.logger.warning(f"[ERR] race_id={rid} : {repr(failure.value)[:200]}")
         # 進捗
         self.done += 1
-        if (self.done % 100 == 0) or (self.done == self.total):
+        if self.total and ((self.done % 100 == 0) or (self.done == self.total)):
             pct = (self.done / self.total) * 100.0
             logging.warning(f"[{self.name}] 進捗: {self.done}/{self.total} ({pct:.1f}%)")
 
@@ -112,52 +167,135 @@ class RaceInfoSpiderSpider(scrapy.Spider):
         race_info2_spans = [span.strip().replace("\xa0", "") for span in race_info2_spans if span and span.strip()]
         race_info2 = "/".join(race_info2_spans)
 
-        # ========== 出走情報 ==========
-        horse_list_elements = response.xpath('//div[@class="RaceTableArea"]/table//tr[@class="HorseList"]')
-
-        for tr in horse_list_elements:
-            gate_number = _txt(tr.xpath('.//td[contains(@class, "Waku")]/span/text()'))
-            horse_number = _txt(tr.xpath('.//td[contains(@class, "Umaban")]/text()'))
-
-            horse_href = tr.xpath('.//td[contains(@class, "HorseInfo")]//span[@class="HorseName"]/a/@href').get() or ""
-            ids = re.findall(r"\d+", horse_href)
-            horse_id = ids[0].strip() if ids else ""
-
-            horse_sex_age = _txt(tr.xpath('.//td[contains(@class, "Barei")]/text()'))
-
-            jockey_href = tr.xpath('.//td[contains(@class, "Jockey")]/a/@href').get() or ""
-            ids = re.findall(r"\d+", jockey_href)
-            jockey_id = ids[0].strip() if ids else ""
-
-            trainer_href = tr.xpath('.//td[contains(@class, "Trainer")]/a/@href').get() or ""
-            ids = re.findall(r"\d+", trainer_href)
-            trainer_id = ids[0].strip() if ids else ""
+        # ========== 出走情報（表を1回だけ走査） ==========
+        horse_table = response.xpath('//div[@class="RaceTableArea"]/table')
+        rows = extract_shutuba_rows(horse_table[0].root) if horse_table else []
 
-            horse_weight = _txt(tr.xpath('.//td[contains(@class, "Weight")]/text()'))
-            horse_weight_change = _txt(tr.xpath('.//td[contains(@class, "Weight")]/small/text()'))
-            win_odds = _txt(tr.xpath('.//td[contains(@class, "Popular")][1]/span/text()'))
-            odds_rank = _txt(tr.xpath('.//td[contains(@class, "Popular_Ninki")]/span/text()'))
-
-            yield RaceInfoItem(
+        for row in rows:
+            yield ShutubaItem(
+                _file=self.export_file,
                 race_id=race_id,
                 race_name=race_name,
                 race_info1=race_info1,
                 race_info2=race_info2,
                 race_grade=race_grade,
-                gate_number=gate_number,
-                horse_number=horse_number,
-                horse_id=horse_id,
-                horse_sex_age=horse_sex_age,
-                jockey_id=jockey_id,
-                trainer_id=trainer_id,
-                horse_weight=horse_weight,
-                horse_weight_change=horse_weight_change,
-                win_odds=win_odds,
-                odds_rank=odds_rank,
+                **row,
             )
 
-        # 進捗
+        # 進捗（出走表の行が取れた時だけ完了。NameBox だけで表が描画されていないページは次回取り直す）
+        if rows:
+            if self.progress is not None:
+                self.progress.mark_done(race_id)
+        else:
+            # replay では crawler が無い
+            if hasattr(self, "crawler"):
+                self.crawler.stats.inc_value("shutuba/no_rows")
+            self.logger.warning(f"[WARN] race_id={race_id} : 出走表の行がありません（未完了のまま次回取り直します）")
+
         self.done += 1
-        if (self.done % 100 == 0) or (self.done == self.total):
+        if self.total and ((self.done % 100 == 0) or (self.done == self.total)):
             pct = (self.done / self.total) * 100.0
             logging.warning(f"[{self.name}] 進捗: {self.done}/{self.total} ({pct:.1f}%)")
+
+    # ========== live モード ==========
+    async def _live_requests(self, race_ids: list[str]):
+        """
+        各レースの出馬表を1回描画（出馬表・発走時刻・馬体重）→ 以降はオッズを残り時間に応じた間隔で取り続ける
+        全レースが発走 LIVE_ODDS_AFTER_POST 秒後を過ぎたら終わる
+        """
+        # reactor はここで import（モジュール読み込み時に既定の reactor を入れてしまわないように）
+        from twisted.internet import reactor
+        from twisted.internet.task import deferLater
+
+        self.live_source = self.settings.get("LIVE_ODDS_SOURCE", "api")
+        if self.live_source not in LIVE_ODDS_SOURCES:
+            self.logger.error(f"LIVE_ODDS_SOURCE は {LIVE_ODDS_SOURCES} のいずれかです: {self.live_source}")
+            return
+        schedule = LiveSchedule(
+            self.settings.getlist("LIVE_ODDS_SCHEDULE"),
+            max_interval=self.settings.getfloat("LIVE_ODDS_MAX_INTERVAL", 900.0),
+        )
+        page_interval = self.settings.getfloat("LIVE_ODDS_PAGE_INTERVAL", 900.0)
+        after_post = self.settings.getfloat("LIVE_ODDS_AFTER_POST", 120.0)
+        self._live = {rid: LiveRace(rid) for rid in race_ids}
+        logging.warning(f"[{self.name}] live: {len(self._live)}レース / source={self.live_source}")
+
+        while self._live:
+            now = now_jst()
+            t = time.time()
+            for rid, race in list(self._live.items()):
+                if race.finished(now, after_post):
+                    del self._live[rid]
+                    logging.warning(f"[{self.name}] live: {rid} 追跡終了（残り {len(self._live)}レース）")
+                    continue
+                interval = schedule.interval(race.remaining(now))
+                # 出馬表の描画（初回・馬体重の更新 / "page" では毎回）
+                if t >= race.next_page_at and not race.page_in_flight:
+                    race.page_in_flight = True
+                    race.next_page_at = t + (interval if self.live_source == "page" else page_interval)
+                    yield self._shutuba_request(
+                        rid, callback=self.parse_live_page, errback=self.err_live,
+                        meta={"freshness": False, "live_first": not race.seen_page},
+                    )
+                # オッズ（API）。発走時刻が分かる（初回の描画が済む）までは待つ
+                if self.live_source == "api" and race.seen_page and t >= race.next_odds_at:
+                    race.next_odds_at = t + interval
+                    yield scrapy.Request(
+                        ODDS_API_URL.format(race_id=rid),
+                        callback=self.parse_live_odds,
+                        errback=self.err_live,
+                        cb_kwargs={"race_id": rid},
+                        meta={"freshness": False, "race_id": rid},
+                        dont_filter=True,
+                    )
+            if not self._live:
+                break
+            due = min(
+                min(r.next_page_at, r.next_odds_at) if self.live_source == "api" and r.seen_page else r.next_page_at
+                for r in self._live.values()
+            )
+            await maybe_deferred_to_future(deferLater(reactor, min(max(due - time.time(), 1.0), 30.0), lambda: None))
+
+    def _live_items(self, race_id: str, rows: dict[str, dict], source: str):
+        observed_at = now_jst().isoformat(timespec="seconds")
+        for row in self._tracker.update(race_id, rows):
+            self.crawler.stats.inc_value("live_odds/changed_rows")
+            yield LiveOddsItem(
+                _file="live_odds.csv", race_id=race_id, horse_number=row["horse_number"], observed_at=observed_at,
+                **{f: row[f] for f in TRACKED_FIELDS}, source=source,
+            )
+
+    def parse_live_page(self, response):
+        race_id = response.meta["race_id"]
+        race = self._live.get(race_id)
+        first = response.meta.get("live_first")
+        rows = {}
+        # "api" ではオッズは API 側に任せる（描画時点の値と行き来して差分が出ないように）
+        fields = TRACKED_FIELDS if self.live_source == "page" else ("horse_weight", "horse_weight_change")
+        for item in self.parse(response):
+            # 出馬表そのもの（shutuba.csv）は初回だけ
+            if first:
+                yield item
+            rows[str(item.get("horse_number") or "")] = {f: str(item.get(f) or "") for f in fields}
+        rows.pop("", None)
+        if race is not None:
+            race.page_in_flight = False
+            race.seen_page = True
+            # 発走時刻は出走表が空でも取れるよう、RaceData01 から直接読む
+            race_info1 = response.xpath('string(//div[@class="RaceList_NameBox"]//div[@class="RaceData01"])').get()
+            race.post_at = race.post_at or parse_post_time(race_info1, race.day)
+        yield from self._live_items(race_id, rows, "page")
+
+    def parse_live_odds(self, response, race_id: str):
+        rows = parse_odds_api(response.body)
+        if not rows:
+            self.crawler.stats.inc_value("live_odds/api_empty")
+            return
+        yield from self._live_items(race_id, rows, "api")
+
+    def err_live(self, failure):
+        race_id = failure.request.meta.get("race_id")
+        race = self._live.get(race_id)
+        if race is not None and isinstance(failure.request, SeleniumRequest):
+            race.page_in_flight = False
+        self.logger.warning(f"[ERR][live] race_id={race_id} : {repr(failure.value)[:200]}")
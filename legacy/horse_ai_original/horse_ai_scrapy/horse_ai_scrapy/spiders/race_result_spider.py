@@ -1,40 +1,114 @@
 import csv
 import os
-import re
 import scrapy
+from scrapy.utils.defer import maybe_deferred_to_future
 from scrapy_selenium import SeleniumRequest
 from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from twisted.internet.defer import Deferred
 
+from ..freshness import NotModified, due_for_refetch
 from ..items import RaceInfoItem
 from ..items import RaceOddsItem
 from ..items import RaceResultItem
+from ..progress import open_progress_store
+from ..session import LOGGED_IN_XPATH, open_session_store, request_cookies, session_lapsed
+from ..table_extract import extract_result_rows
+from ..workqueue import open_queue_progress, use_worker_output
 
 class RaceResultSpider(scrapy.Spider):
     name = "race_result_spider"
     allowed_domains = ["regist.netkeiba.com", "db.netkeiba.com"]
 
     custom_settings = {
-        "DOWNLOADER_MIDDLEWARES": {"scrapy_selenium.SeleniumMiddleware": 800},
+        "DOWNLOADER_MIDDLEWARES": {
+            "horse_ai_scrapy.freshness.FreshnessMiddleware": 450,
+            "horse_ai_scrapy.archive.HtmlArchiveMiddleware": 500,
+            "horse_ai_scrapy.selenium_pool_mw.PooledSeleniumMiddleware": 800,
+            "horse_ai_scrapy.adaptive_rate.AdaptiveRateMiddleware": 900,
+            "horse_ai_scrapy.metrics.MetricsDownloaderMiddleware": 950,
+        },
         "LOG_LEVEL": "WARNING",
-        "DOWNLOAD_DELAY": 1.0,
-        "AUTOTHROTTLE_ENABLED": True,
     }
 
-    def __init__(self, race_ids: str | None = None, *args, **kwargs):
+    # 取得モード: "http"（通常の scrapy.Request、表が無いページだけ Selenium で再取得）/ "selenium"（全ページ Selenium）
+    FETCH_MODES = ("http", "selenium")
+
+    def __init__(self, race_ids: str | None = None, fetch_mode: str | None = None, resume: str | None = None,
+                 queue: str | None = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.race_id_csv_path = race_ids
+        self.fetch_mode = fetch_mode
+        self.resume = resume
+        self.queue = queue
+        # 作業キュー使用時、ログイン（Cookie 取得）が終わったら start() に知らせる
+        self._login_done: Deferred | None = None
+        self.progress = None
         self.race_ids: list[str] = []
         self._total_races = 0
         self._done_races = 0
+        # ログイン後のブラウザ（または保存済みセッション）の Cookie。HTTP / Selenium のリクエストに付ける
+        self._session_cookies: list[dict] = []
+        # 保存済みセッション（session.py）/ ログインし直し中に待たせている race_id / ログインし直した回数
+        self.session = None
+        self._relogin_waiting: list[str] | None = None
+        self._relogins = 0
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        # 作業キューを使うなら出力先をワーカー毎に（pipeline が開く前に。workqueue.py）
+        use_worker_output(crawler.settings, spider.queue)
+        return spider
+
+    async def start(self):
+        # 共有の作業キュー（-a queue=… / WORK_QUEUE）が無ければ従来どおり（ID CSV → ログイン → 全ページ）
+        self.progress = open_queue_progress(self, self.queue)
+        if self.progress is None:
+            for request in self.start_requests():
+                yield request
+            return
 
-    def start_requests(self):
+        if not self._check_settings():
+            return
+        # ログインが済んで Cookie が揃ってから、キューから借りた分だけ出す（保存済みセッションがあればログインしない）
+        if not self._restore_session():
+            self._login_done = Deferred()
+            yield self._login_request()
+            await maybe_deferred_to_future(self._login_done)
+        async for race_id in self.progress.iter_ids():
+            yield self._race_request(race_id)
+
+    def _check_settings(self) -> bool:
         self.email = (self.settings.get("NK_EMAIL") or "").strip()
         self.password = (self.settings.get("NK_PASSWORD") or "").strip()
         if not self.email or not self.password:
             self.logger.error("NK_EMAIL / NK_PASSWORD を settings.py で設定してください。")
+            return False
+
+        self.fetch_mode = (self.fetch_mode or self.settings.get("RACE_RESULT_FETCH_MODE", "http")).strip().lower()
+        if self.fetch_mode not in self.FETCH_MODES:
+            self.logger.error(f"fetch_mode は {self.FETCH_MODES} のいずれかを指定してください: {self.fetch_mode}")
+            return False
+        self.session = open_session_store(self.settings)
+        return True
+
+    def _restore_session(self) -> bool:
+        """保存済みのログイン Cookie が期限内なら使う（ブラウザでのログインを省く）"""
+        if self.session is None:
+            return False
+        cookies = self.session.load(self.email)
+        if not cookies:
+            return False
+        self._session_cookies = request_cookies(cookies)
+        self.crawler.stats.inc_value("session/restored")
+        self.logger.warning(f"保存済みのログインを使います（{self.session.path}）")
+        return True
+
+    def start_requests(self):
+        if not self._check_settings():
             return
 
         if not self.race_id_csv_path:
@@ -56,14 +130,29 @@ class RaceResultSpider(scrapy.Spider):
                 if not (len(s) == 12 and s.isdigit()):
                     raise ValueError(f"行{i}: '{s}' は12桁の数字ではありません。")
                 self.race_ids.append(s)
-            
-            self._total_races = len(self.race_ids)
-            print(f"[PROGRESS] loaded race_ids: {self._total_races}")
 
-        yield SeleniumRequest(
+        # 前回までに取得済みの race_id を除外（-a resume=0 で最初から）。記録が stale のレースは残す
+        self.progress = open_progress_store(self, self.resume)
+        if self.progress is not None:
+            loaded = len(self.race_ids)
+            self.race_ids = self.progress.filter_pending(self.race_ids, due_for_refetch(self.settings, "race", self.race_ids))
+            print(f"[PROGRESS] skip done race_ids: {loaded - len(self.race_ids)}")
+
+        self._total_races = len(self.race_ids)
+        print(f"[PROGRESS] loaded race_ids: {self._total_races}")
+
+        if self._restore_session():
+            yield from self._yield_race_pages()
+        else:
+            yield self._login_request()
+
+    def _login_request(self, relogin: bool = False):
+        return SeleniumRequest(
             url="https://regist.netkeiba.com/account/?pid=login",
             callback=self.after_login,
             errback=self.err_login,
+            # ログイン操作が終わるまでドライバをプールへ返さない。relogin: ページ途中でセッションが切れた時のログインし直し
+            meta={"selenium_pool_pin": True, "relogin": relogin},
             wait_time=8,
             dont_filter=True,
         )
@@ -77,7 +166,9 @@ class RaceResultSpider(scrapy.Spider):
                 )
             except TimeoutException:
                 self.logger.warning("netkeiba ログイン済み")
-                yield from self._yield_race_pages()
+                self._capture_cookies(driver)
+                self._release_driver(response)
+                yield from self._after_login(response.request)
                 return
 
             password_input = WebDriverWait(driver, 6).until(
@@ -106,33 +197,145 @@ class RaceResultSpider(scrapy.Spider):
         except Exception as e:
             self.logger.warning(f"ログイン中例外: {e!r}（続行します）")
 
-        yield from self._yield_race_pages()
+        self._capture_cookies(driver)
+        self._release_driver(response)
+        yield from self._after_login(response.request)
+
+    @staticmethod
+    def _release_driver(response):
+        """PooledSeleniumMiddleware で貸し出されたドライバをプールへ返す"""
+        release = response.meta.get("driver_release")
+        if release:
+            release()
+
+    def _capture_cookies(self, driver):
+        """
+        ログイン済みブラウザの Cookie を以降のリクエストへ引き継ぐ
+        ログインできていれば（ログインフォームが消えてログアウトのリンクがある）次回・他ワーカー用に保存もする
+        """
+        try:
+            cookies = driver.get_cookies()
+            logged_in = not driver.find_elements(By.NAME, "login_id") and bool(driver.find_elements(By.XPATH, LOGGED_IN_XPATH))
+        except Exception as e:
+            self.logger.warning(f"Cookie 取得に失敗: {e!r}（未ログインで続行）")
+            return
+        self._session_cookies = request_cookies([c for c in cookies if c.get("name")])
+        if self.session is not None and logged_in and self._session_cookies:
+            self.session.save(self.email, cookies)
+            self.crawler.stats.inc_value("session/saved")
 
     def err_login(self, failure):
         self.logger.warning(f"[ERR][login] {repr(failure.value)[:200]}（ログインせず続行）")
+        yield from self._after_login(failure.request)
+
+    def _after_login(self, request):
+        if request.meta.get("relogin"):
+            # ログインし直し → 待たせていたページだけ取り直す（もう一度切れていてもそのまま読む）
+            waiting, self._relogin_waiting = self._relogin_waiting or [], None
+            for race_id in waiting:
+                yield self._race_request(race_id, session_retry=True)
+            return
         yield from self._yield_race_pages()
 
+    def _session_lapsed(self, race_id: str):
+        """ページがログアウト状態だった（保存済みセッションの期限切れ等）→ ログインし直してから取り直す"""
+        self.crawler.stats.inc_value("session/lapsed")
+        if self._relogin_waiting is not None:
+            self._relogin_waiting.append(race_id)
+            return
+        if self.session is not None:
+            if self.session.newer() and self._restore_session():
+                # 他のワーカーが既にログインし直して保存していた
+                yield self._race_request(race_id, session_retry=True)
+                return
+            self.session.invalidate()
+        if self._relogins >= self.settings.getint("SESSION_RELOGIN_MAX", 3):
+            self.logger.warning(f"ログインし直しが SESSION_RELOGIN_MAX 回に達したため、そのまま読みます: race_id={race_id}")
+            yield self._race_request(race_id, session_retry=True)
+            return
+        self._relogins += 1
+        self.logger.warning(f"ログインが切れています（race_id={race_id}）。ログインし直します")
+        self._relogin_waiting = [race_id]
+        yield self._login_request(relogin=True)
+
     def _yield_race_pages(self):
+        if self._login_done is not None:
+            # 作業キュー: ページは start() が借りた分だけ出す
+            if not self._login_done.called:
+                self._login_done.callback(None)
+            return
         for race_id in self.race_ids:
-            url = f"https://db.netkeiba.com/race/{race_id}/"
-            yield SeleniumRequest(
-                url=url,
-                callback=self.parse_race_page,
-                cb_kwargs={"race_id": race_id},
-                errback=self.err_race_page,
-                wait_time=6,
-                dont_filter=True,
-            )
+            yield self._race_request(race_id)
+
+    def _race_request(self, race_id: str, session_retry: bool = False):
+        if self.fetch_mode == "http":
+            return self._http_race_request(race_id, session_retry)
+        return self._selenium_race_request(race_id, session_retry=session_retry)
+
+    def _http_race_request(self, race_id: str, session_retry: bool = False):
+        return scrapy.Request(
+            url=f"https://db.netkeiba.com/race/{race_id}/",
+            callback=self.parse_race_page,
+            cb_kwargs={"race_id": race_id},
+            errback=self.err_race_page,
+            cookies=self._session_cookies,
+            # ログインし直した後の取り直しは、直前の取得を鮮度記録が見て止めないように対象外
+            meta={"session_retry": session_retry, "freshness": False if session_retry else None},
+            dont_filter=True,
+        )
+
+    def _selenium_race_request(self, race_id: str, fallback: bool = False, session_retry: bool = False):
+        return SeleniumRequest(
+            url=f"https://db.netkeiba.com/race/{race_id}/",
+            callback=self.parse_race_page,
+            cb_kwargs={"race_id": race_id},
+            errback=self.err_race_page,
+            cookies=self._session_cookies,
+            # 取り直しは同じ URL の取得の直後なので鮮度判定の対象外
+            meta={
+                "selenium_fallback": fallback,
+                "session_retry": session_retry,
+                "freshness": False if (fallback or session_retry) else None,
+            },
+            wait_time=6,
+            dont_filter=True,
+        )
+
+    @staticmethod
+    def _has_static_tables(response) -> bool:
+        """静的HTMLに「レース結果」表と払い戻し表が揃っているか"""
+        return bool(
+            response.xpath('//table[@summary="レース結果"]')
+            and response.xpath('//dl[@class="pay_block"]')
+        )
 
     def err_race_page(self, failure):
         race_id = failure.request.cb_kwargs.get("race_id")
-        self.logger.warning(f"[ERR] race_id={race_id} : {repr(failure.value)[:200]}")
+        ok = bool(failure.check(NotModified))
+        if ok:
+            # 取得済みで変わっていない（freshness.py）→ 取得済み扱い
+            if self.progress is not None:
+                self.progress.mark_done(race_id)
+        else:
+            self.logger.warning(f"[ERR] race_id={race_id} : {repr(failure.value)[:200]}")
         self._done_races += 1
         if self._total_races and (self._done_races % 10 == 0 or self._done_races == self._total_races):
             pct = self._done_races / self._total_races * 100
-            print(f"[PROGRESS] {self._done_races}/{self._total_races} ({pct:.1f}%) last={race_id} ok=False")
+            print(f"[PROGRESS] {self._done_races}/{self._total_races} ({pct:.1f}%) last={race_id} ok={ok}")
 
     def parse_race_page(self, response, race_id: str):
+        # ログインしていたはずなのにログアウト状態のページ → ログインし直してから取り直す（1回まで）
+        if self._session_cookies and not response.meta.get("session_retry") and session_lapsed(response):
+            yield from self._session_lapsed(race_id)
+            return
+
+        # HTTP モードで表が欠けていたら、そのページだけ Selenium で取り直す（再取得は1回まで）
+        if self.fetch_mode == "http" and not response.meta.get("selenium_fallback") and not self._has_static_tables(response):
+            self.logger.info(f"[FALLBACK] race_id={race_id} : 静的HTMLに表が無いため Selenium で再取得")
+            self.crawler.stats.inc_value("race_result/selenium_fallback")
+            yield self._selenium_race_request(race_id, fallback=True, session_retry=bool(response.meta.get("session_retry")))
+            return
+
         # レース情報
         race_info_element = response.xpath('//div[contains(@class, "data_intro")]')
         race_name = race_info_element.xpath('normalize-space(string(.//h1[1]))').get() or ''
@@ -249,39 +452,25 @@ class RaceResultSpider(scrapy.Spider):
             trifecta_dividend=trifecta_dividend,
         )
 
-        # レース結果
-        race_result_elements = response.xpath('//table[@summary="レース結果"]//tr')
-        for tr in race_result_elements[1:]:
-            gate_number = tr.xpath('normalize-space(./td[2]//text())').get() or ""
-            horse_number = tr.xpath('normalize-space(./td[3]//text())').get() or ""
-            horse_id = tr.xpath('./td[4]//a/@href').re_first(r'/horse/(\d+)/') or ""
-            horse_sex_age = tr.xpath('normalize-space(./td[5]//text())').get() or ""
-            jockey_id = tr.xpath('./td[7]//a/@href').re_first(r'/jockey/.*/(\d+)/') or ""
-            win_odds = tr.xpath('normalize-space(./td[13]//text())').get() or ""
-            odds_rank = tr.xpath('normalize-space(./td[14]//text())').get() or ""
-            hw_text = tr.xpath('normalize-space(./td[15]//text())').get() or ""
-            m_w = re.search(r'\d+', hw_text)
-            horse_weight = m_w.group(0) if m_w else ""
-            m_c = re.search(r'\(([-+−]?\d+)\)', hw_text)
-            horse_weight_change = m_c.group(1) if m_c else ""
-            trainer_id = tr.xpath('./td[19]//a/@href').re_first(r'/trainer/.*/(\d+)/') or ""
-
-            yield RaceResultItem(
-                _file="race_result.csv",
-                race_id=race_id,
-                gate_number=gate_number,
-                horse_number=horse_number,
-                horse_id=horse_id,
-                horse_sex_age=horse_sex_age,
-                jockey_id=jockey_id,
-                trainer_id=trainer_id,
-                horse_weight=horse_weight,
-                horse_weight_change=horse_weight_change,
-                win_odds=win_odds,
-                odds_rank=odds_rank,
-            )
-        
+        # レース結果（表を1回だけ走査）
+        race_result_table = response.xpath('//table[@summary="レース結果"]')
+        n_rows = 0
+        if race_result_table:
+            for row in extract_result_rows(race_result_table[0].root):
+                n_rows += 1
+                yield RaceResultItem(_file="race_result.csv", race_id=race_id, **row)
+
+        # 結果の行が取れたレースだけ完了（表が無い・読めないページは次回取り直す）
+        if n_rows:
+            if self.progress is not None:
+                self.progress.mark_done(race_id)
+        else:
+            # replay では crawler が無い
+            if hasattr(self, "crawler"):
+                self.crawler.stats.inc_value("race_result/no_rows")
+            self.logger.warning(f"[WARN] race_id={race_id} : レース結果の行がありません（未完了のまま次回取り直します）")
+
         self._done_races += 1
         if self._total_races and (self._done_races % 10 == 0 or self._done_races == self._total_races):
             pct = self._done_races / self._total_races * 100
-            print(f"[PROGRESS] {self._done_races}/{self._total_races} ({pct:.1f}%) last={race_id} ok=True")
\ No newline at end of file
+            print(f"[PROGRESS] {self._done_races}/{self._total_races} ({pct:.1f}%) last={race_id} ok={bool(n_rows)}")
\ No newline at end of file
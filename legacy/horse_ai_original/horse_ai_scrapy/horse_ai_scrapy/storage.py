@@ -0,0 +1,158 @@
+# horse_ai_scrapy/storage.py
+"""
+取得データの SQLite 保存先（既定 {OUTPUT_BASE_DIR}/horse_ai.sqlite3）と検索用API
+
+- テーブルは item['_file'] の名前から（race_result.csv → race_result）。列は item のフィールド
+- 主キーは EXPORT_PRIMARY_KEYS（CSV の upsert と同じ）。同じキーは上書き
+- race_id / horse_id / jockey_id / trainer_id には索引を張る
+- 数値列（PARQUET_COLUMN_TYPES）は INTEGER / REAL 型で作る（変換できない値は文字列のまま入る）
+
+使い方:
+    from horse_ai_scrapy.storage import open_storage
+    db = open_storage()
+    db.results_for_horse("2019104567")
+    db.odds_for_race("202505020607")
+"""
+import os
+import re
+import sqlite3
+
+# 索引を張る列（主キーそのものは除く）
+INDEX_COLUMNS = ("race_id", "horse_id", "jockey_id", "trainer_id")
+_AFFINITY = {"int": "INTEGER", "float": "REAL"}
+
+
+def table_of(filename: str) -> str:
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return re.sub(r"\W", "_", stem)
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class Storage:
+    """SQLite への upsert と、よく使う検索"""
+    def __init__(self, path: str, primary_keys: dict | None = None, column_types: dict | None = None):
+        self.path = path
+        # ファイル名 → 主キー列 / {列: 型}（どちらも settings と同じ形）
+        self.primary_keys = primary_keys or {}
+        self.column_types = column_types or {}
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # table -> 列のリスト
+        self._columns = {}
+
+    # ---------- スキーマ ----------
+    def columns(self, table: str) -> list[str]:
+        if table not in self._columns:
+            self._columns[table] = [r["name"] for r in self._conn.execute(f"PRAGMA table_info({_quote(table)})")]
+        return self._columns[table]
+
+    def ensure_table(self, filename: str, fields: list[str], extra_types: dict | None = None) -> str:
+        """テーブルが無ければ作る。あれば足りない列だけ追加（extra_types: column_types に無い列の型）"""
+        table = table_of(filename)
+        name = os.path.basename(filename)
+        types = {**self.column_types.get(name, {}), **(extra_types or {})}
+        existing = self.columns(table)
+        if not existing:
+            keys = [k for k in self.primary_keys.get(name, []) if k in fields]
+            cols = [f"{_quote(c)} {_AFFINITY.get(types.get(c), 'TEXT')}" for c in fields]
+            if keys:
+                cols.append(f"PRIMARY KEY ({', '.join(_quote(k) for k in keys)})")
+            with self._conn:
+                self._conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({', '.join(cols)})")
+                for c in INDEX_COLUMNS:
+                    if c in fields and keys != [c]:
+                        self._conn.execute(
+                            f"CREATE INDEX IF NOT EXISTS {_quote(f'idx_{table}_{c}')} ON {_quote(table)} ({_quote(c)})"
+                        )
+        else:
+            missing = [c for c in fields if c not in existing]
+            with self._conn:
+                for c in missing:
+                    self._conn.execute(
+                        f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(c)} {_AFFINITY.get(types.get(c), 'TEXT')}"
+                    )
+        self._columns.pop(table, None)
+        return table
+
+    def primary_key(self, table: str) -> list[str]:
+        rows = self._conn.execute(f"PRAGMA table_info({_quote(table)})").fetchall()
+        return [r["name"] for r in sorted(rows, key=lambda r: r["pk"]) if r["pk"]]
+
+    # ---------- 書き込み ----------
+    def upsert_many(self, table: str, fields: list[str], rows: list[tuple]) -> None:
+        """1トランザクションでまとめて書く（主キーがあれば同じキーは上書き）"""
+        if not rows:
+            return
+        cols = ", ".join(_quote(c) for c in fields)
+        marks = ", ".join("?" for _ in fields)
+        sql = f"INSERT INTO {_quote(table)} ({cols}) VALUES ({marks})"
+        keys = self.primary_key(table)
+        if keys:
+            updates = ", ".join(f"{_quote(c)} = excluded.{_quote(c)}" for c in fields if c not in keys)
+            conflict = ", ".join(_quote(k) for k in keys)
+            sql += f" ON CONFLICT ({conflict}) DO " + (f"UPDATE SET {updates}" if updates else "NOTHING")
+        with self._conn:
+            self._conn.executemany(sql, rows)
+
+    # ---------- 検索 ----------
+    def query(self, sql: str, params=()) -> list[dict]:
+        return [dict(r) for r in self._conn.execute(sql, params)]
+
+    def race_info(self, race_id: str) -> dict | None:
+        rows = self.query("SELECT * FROM race_info WHERE race_id = ?", (race_id,))
+        return rows[0] if rows else None
+
+    def odds_for_race(self, race_id: str) -> dict | None:
+        rows = self.query("SELECT * FROM race_odds WHERE race_id = ?", (race_id,))
+        return rows[0] if rows else None
+
+    def results_for_race(self, race_id: str) -> list[dict]:
+        return self.query("SELECT * FROM race_result WHERE race_id = ? ORDER BY horse_number", (race_id,))
+
+    def results_for_horse(self, horse_id: str) -> list[dict]:
+        """その馬の全出走（レース情報付き、古い順）"""
+        return self.query(
+            "SELECT r.*, i.race_name AS race_title, i.race_info, i.race_conditions"
+            " FROM race_result r LEFT JOIN race_info i ON i.race_id = r.race_id"
+            " WHERE r.horse_id = ? ORDER BY r.race_id",
+            (horse_id,),
+        )
+
+    def results_for_jockey(self, jockey_id: str) -> list[dict]:
+        return self.query("SELECT * FROM race_result WHERE jockey_id = ? ORDER BY race_id", (jockey_id,))
+
+    def results_for_trainer(self, trainer_id: str) -> list[dict]:
+        return self.query("SELECT * FROM race_result WHERE trainer_id = ? ORDER BY race_id", (trainer_id,))
+
+    def horse(self, horse_id: str) -> dict | None:
+        rows = self.query("SELECT * FROM horse_info WHERE horse_id = ?", (horse_id,))
+        return rows[0] if rows else None
+
+    def distinct_ids(self, column: str, table: str = "race_result") -> list[str]:
+        """export_ids.py 相当（索引だけで済む）"""
+        if column not in INDEX_COLUMNS:
+            raise ValueError(f"索引の無い列です: {column}")
+        return [r[0] for r in self._conn.execute(
+            f"SELECT DISTINCT {_quote(column)} FROM {_quote(table)} WHERE {_quote(column)} != '' ORDER BY 1"
+        )]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_storage(path: str | None = None, settings=None) -> Storage:
+    """settings（既定: プロジェクト設定）の STORAGE_PATH / EXPORT_PRIMARY_KEYS で開く"""
+    if settings is None:
+        from scrapy.utils.project import get_project_settings
+        settings = get_project_settings()
+    from .pipelines import PARQUET_COLUMN_TYPES
+
+    path = path or settings.get("STORAGE_PATH") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), "horse_ai.sqlite3")
+    return Storage(path, settings.getdict("EXPORT_PRIMARY_KEYS"), PARQUET_COLUMN_TYPES)
+
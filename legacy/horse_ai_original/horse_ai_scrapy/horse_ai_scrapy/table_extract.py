@@ -0,0 +1,181 @@
+# horse_ai_scrapy/table_extract.py
+"""
+表を1回だけ走査して行データを取り出す抽出器（lxml 要素を直接たどる）
+- 列位置は表ごとに1回だけ決める（レース結果: 見出しテキスト / 出馬表: 1行目の td の class）
+- 1行あたり td を1回列挙し、セル文字列と href の ID を事前コンパイル済み正規表現で抜く
+  （行×列ごとの XPath 評価をしない）
+"""
+import re
+
+# XPath normalize-space() と同じ空白（\xa0 や全角スペースは残す）
+_XML_SPACE = re.compile(r"[ \t\r\n]+")
+
+_HORSE_ID = re.compile(r"/horse/(\d+)/")
+_JOCKEY_ID = re.compile(r"/jockey/.*/(\d+)/")
+_TRAINER_ID = re.compile(r"/trainer/.*/(\d+)/")
+_DIGITS = re.compile(r"\d+")
+_WEIGHT_CHANGE = re.compile(r"\(([-+−]?\d+)\)")
+
+
+def text_of(el) -> str:
+    """要素配下の全テキストを normalize-space 相当で連結"""
+    if el is None:
+        return ""
+    return _XML_SPACE.sub(" ", "".join(el.itertext())).strip()
+
+
+def own_text(el) -> str:
+    """要素直下の最初のテキスト（XPath の td/text() 相当）"""
+    if el is None or el.text is None:
+        return ""
+    return el.text.strip()
+
+
+def href_of(el, path: str = ".//a") -> str:
+    if el is None:
+        return ""
+    a = el.find(path)
+    return (a.get("href") or "") if a is not None else ""
+
+
+def _cells(tr) -> list:
+    return [c for c in tr if c.tag in ("td", "th")]
+
+
+def columns_by_header(header_cells, aliases: dict[str, tuple[str, ...]]) -> dict[str, int]:
+    """見出しテキスト → 列位置（aliases の先頭一致）"""
+    texts = [text_of(c) for c in header_cells]
+    cols = {}
+    for field, names in aliases.items():
+        for i, t in enumerate(texts):
+            if any(t.startswith(n) for n in names):
+                cols[field] = i
+                break
+    return cols
+
+
+def columns_by_class(cells, keys: dict[str, str]) -> dict[str, int]:
+    """td の class（部分一致）→ 列位置。XPath の td[contains(@class, key)][1] と同じく最初の列"""
+    classes = [c.get("class") or "" for c in cells]
+    cols = {}
+    for field, key in keys.items():
+        for i, cls in enumerate(classes):
+            if key in cls:
+                cols[field] = i
+                break
+    return cols
+
+
+# ---------- レース結果（db.netkeiba.com/race/{id}/ の summary="レース結果"） ----------
+RESULT_HEADERS = {
+    "gate_number": ("枠番",),
+    "horse_number": ("馬番",),
+    "horse": ("馬名",),
+    "horse_sex_age": ("性齢",),
+    "jockey": ("騎手",),
+    "win_odds": ("単勝",),
+    "odds_rank": ("人気",),
+    "horse_weight": ("馬体重",),
+    "trainer": ("調教師",),
+    "finish_position": ("着順",),
+}
+# 見出しが取れない時の列位置（ログイン時のレイアウト、0始まり）
+RESULT_FALLBACK = {
+    "gate_number": 1, "horse_number": 2, "horse": 3, "horse_sex_age": 4, "jockey": 6,
+    "win_odds": 12, "odds_rank": 13, "horse_weight": 14, "trainer": 18, "finish_position": 0,
+}
+
+
+def extract_result_rows(table) -> list[dict]:
+    """レース結果表の各行 → RaceResultItem 用の dict（race_id 以外）"""
+    rows = iter(table.iter("tr"))
+    header = next(rows, None)
+    if header is None:
+        return []
+    cols = {**RESULT_FALLBACK, **columns_by_header(_cells(header), RESULT_HEADERS)}
+    width = max(cols.values()) + 1
+
+    out = []
+    for tr in rows:
+        tds = [c for c in tr if c.tag == "td"]
+        if not tds:
+            continue
+        tds += [None] * (width - len(tds))
+
+        hw_text = text_of(tds[cols["horse_weight"]])
+        m_w = _DIGITS.search(hw_text)
+        m_c = _WEIGHT_CHANGE.search(hw_text)
+        m_h = _HORSE_ID.search(href_of(tds[cols["horse"]]))
+        m_j = _JOCKEY_ID.search(href_of(tds[cols["jockey"]]))
+        m_t = _TRAINER_ID.search(href_of(tds[cols["trainer"]]))
+
+        out.append({
+            "gate_number": text_of(tds[cols["gate_number"]]),
+            "horse_number": text_of(tds[cols["horse_number"]]),
+            "horse_id": m_h.group(1) if m_h else "",
+            "horse_sex_age": text_of(tds[cols["horse_sex_age"]]),
+            "jockey_id": m_j.group(1) if m_j else "",
+            "trainer_id": m_t.group(1) if m_t else "",
+            "horse_weight": m_w.group(0) if m_w else "",
+            "horse_weight_change": m_c.group(1) if m_c else "",
+            "win_odds": text_of(tds[cols["win_odds"]]),
+            "odds_rank": text_of(tds[cols["odds_rank"]]),
+            # 既存CSVの列順を崩さないよう末尾に追加（"中止" "除外" 等の文字列もそのまま）
+            "finish_position": text_of(tds[cols["finish_position"]]),
+        })
+    return out
+
+
+# ---------- 出馬表（race.netkeiba.com/race/shutuba.html の tr.HorseList） ----------
+SHUTUBA_CLASSES = {
+    "gate_number": "Waku",
+    "horse_number": "Umaban",
+    "horse": "HorseInfo",
+    "horse_sex_age": "Barei",
+    "jockey": "Jockey",
+    "trainer": "Trainer",
+    "horse_weight": "Weight",
+    "win_odds": "Popular",
+    "odds_rank": "Popular_Ninki",
+}
+
+
+def _first_digits(href: str) -> str:
+    m = _DIGITS.search(href)
+    return m.group(0) if m else ""
+
+
+def extract_shutuba_rows(table) -> list[dict]:
+    """出馬表の各 HorseList 行 → ShutubaItem 用の dict（レース情報以外）"""
+    out = []
+    cols = None
+    for tr in table.iter("tr"):
+        if tr.get("class") != "HorseList":
+            continue
+        tds = [c for c in tr if c.tag == "td"]
+        if cols is None:
+            cols = columns_by_class(tds, SHUTUBA_CLASSES)
+
+        def cell(field):
+            i = cols.get(field)
+            return tds[i] if i is not None and i < len(tds) else None
+
+        weight = cell("horse_weight")
+        small = weight.find("small") if weight is not None else None
+        gate = cell("gate_number")
+        odds = cell("win_odds")
+        rank = cell("odds_rank")
+
+        out.append({
+            "gate_number": own_text(gate.find("span")) if gate is not None else "",
+            "horse_number": own_text(cell("horse_number")),
+            "horse_id": _first_digits(href_of(cell("horse"), ".//span[@class='HorseName']/a")),
+            "horse_sex_age": own_text(cell("horse_sex_age")),
+            "jockey_id": _first_digits(href_of(cell("jockey"), "a")),
+            "trainer_id": _first_digits(href_of(cell("trainer"), "a")),
+            "horse_weight": own_text(weight),
+            "horse_weight_change": own_text(small),
+            "win_odds": own_text(odds.find("span")) if odds is not None else "",
+            "odds_rank": own_text(rank.find("span")) if rank is not None else "",
+        })
+    return out
@@ -0,0 +1,180 @@
+# horse_ai_scrapy/upsert.py
+"""
+出力CSVの主キー索引（重複行を溜めない upsert 書き込み用）
+
+CSV は追記しかできないので「置き換え」は次のように扱う:
+  - 同じキー・同じ内容の行     → 書かない（再クロールでも増えない）
+  - 同じキー・内容が変わった行 → 末尾に追記し、古い行は dead として数える
+  - dead が一定割合を超えたら compact() で生きている行だけに書き直す
+
+使い方（手動で圧縮する場合、scrapy.cfg のあるディレクトリで）:
+    python -m horse_ai_scrapy.upsert data/race_result.csv
+    python -m horse_ai_scrapy.upsert data/horse_info.csv --key horse_id
+"""
+import argparse
+import csv
+import hashlib
+import os
+import sqlite3
+
+# キー列の値を連結する区切り（CSV の値には出てこない制御文字）
+_SEP = "\x1f"
+
+
+def index_path_of(csv_path: str) -> str:
+    """{CSVのフォルダ}/.index/{CSV名}.sqlite3"""
+    return os.path.join(os.path.dirname(csv_path) or ".", ".index", os.path.basename(csv_path) + ".sqlite3")
+
+
+def row_digest(values) -> bytes:
+    return hashlib.blake2b(_SEP.join("" if v is None else str(v) for v in values).encode("utf-8"), digest_size=8).digest()
+
+
+class KeyIndex:
+    """
+    CSV 1ファイル分の主キー索引（SQLite）
+    - keys: キー → 最新行の行番号（ヘッダを除く0始まり）と内容ハッシュ
+    - meta: CSV の行数・dead 行数・バイト数。バイト数が実ファイルと違えば（異常終了等）CSV から作り直す
+    """
+    def __init__(self, csv_path: str, key_columns: list[str], encoding: str = "utf-8"):
+        self.csv_path = csv_path
+        self.key_columns = list(key_columns)
+        self.encoding = encoding
+        self.path = index_path_of(csv_path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # 書き込みスレッドで開き、close だけ別スレッドから呼ばれることがある
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, row_no INTEGER NOT NULL, digest BLOB NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.commit()
+        meta = dict(self._conn.execute("SELECT name, value FROM meta"))
+        self.rows = meta.get("rows", 0)
+        self.dead = meta.get("dead", 0)
+        self._size = meta.get("size", -1)
+        self._key_pos = None
+
+    # ---------- 整合 ----------
+    def attach(self, fieldnames: list[str]) -> None:
+        """CSV を開いた直後に呼ぶ。索引が CSV と食い違っていれば作り直す"""
+        self._key_pos = [fieldnames.index(c) for c in self.key_columns]
+        size = os.path.getsize(self.csv_path) if os.path.exists(self.csv_path) else 0
+        if size != self._size:
+            self.rebuild()
+
+    def rebuild(self) -> None:
+        """CSV を先頭から読み直して索引を作る（同じキーは後の行が生き）"""
+        latest = {}
+        rows = 0
+        if os.path.exists(self.csv_path) and os.path.getsize(self.csv_path) > 0:
+            with open(self.csv_path, newline="", encoding=self.encoding) as f:
+                reader = csv.reader(f)
+                header = next(reader, None) or []
+                pos = [header.index(c) for c in self.key_columns] if all(c in header for c in self.key_columns) else None
+                for row in reader:
+                    if pos is not None and len(row) > max(pos):
+                        latest[_SEP.join(row[i] for i in pos)] = (rows, row_digest(row))
+                    rows += 1
+        with self._conn:
+            self._conn.execute("DELETE FROM keys")
+            self._conn.executemany(
+                "INSERT INTO keys (key, row_no, digest) VALUES (?, ?, ?)",
+                ((k, n, d) for k, (n, d) in latest.items()),
+            )
+        self.rows = rows
+        self.dead = rows - len(latest)
+        self.commit()
+
+    def reset(self) -> None:
+        """CSV を上書きで開き直した時（EXPORT_OVERWRITE=True）"""
+        with self._conn:
+            self._conn.execute("DELETE FROM keys")
+        self.rows = 0
+        self.dead = 0
+
+    # ---------- upsert ----------
+    def accept(self, values: list) -> bool:
+        """この行を書くべきなら True（行番号を割り当てる）。同じキー・同じ内容なら False"""
+        key = _SEP.join("" if values[i] is None else str(values[i]) for i in self._key_pos)
+        digest = row_digest(values)
+        old = self._conn.execute("SELECT digest FROM keys WHERE key = ?", (key,)).fetchone()
+        if old is not None:
+            if old[0] == digest:
+                return False
+            self.dead += 1
+        self._conn.execute("INSERT OR REPLACE INTO keys (key, row_no, digest) VALUES (?, ?, ?)", (key, self.rows, digest))
+        self.rows += 1
+        return True
+
+    def live_rows(self) -> set[int]:
+        return {row[0] for row in self._conn.execute("SELECT row_no FROM keys")}
+
+    @property
+    def dead_ratio(self) -> float:
+        return self.dead / self.rows if self.rows else 0.0
+
+    def commit(self) -> None:
+        """CSV を flush した後に呼ぶ（バイト数を記録して次回の整合チェックに使う）"""
+        self._size = os.path.getsize(self.csv_path) if os.path.exists(self.csv_path) else 0
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)",
+                [("rows", self.rows), ("dead", self.dead), ("size", self._size)],
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def compact(index: KeyIndex) -> int:
+    """dead 行を除いて CSV を書き直す（一時ファイル → 置き換え）。消した行数を返す"""
+    path = index.csv_path
+    if not os.path.exists(path):
+        return 0
+    live = index.live_rows()
+    tmp = f"{path}.compact.tmp"
+    removed = 0
+    with open(path, newline="", encoding=index.encoding) as src, \
+            open(tmp, "w", newline="", encoding=index.encoding) as dst:
+        reader = csv.reader(src)
+        writer = csv.writer(dst)
+        header = next(reader, None)
+        if header is not None:
+            writer.writerow(header)
+        for n, row in enumerate(reader):
+            if n in live:
+                writer.writerow(row)
+            else:
+                removed += 1
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp, path)
+    index.rebuild()
+    return removed
+
+
+def main():
+    from scrapy.utils.project import get_project_settings
+
+    ap = argparse.ArgumentParser(description="出力CSVの重複（dead）行を取り除いて書き直します。")
+    ap.add_argument("csv_path", help="対象CSV")
+    ap.add_argument("--key", action="append", help="主キー列（複数可、既定: EXPORT_PRIMARY_KEYS のファイル名の設定）")
+    args = ap.parse_args()
+
+    settings = get_project_settings()
+    keys = args.key or settings.getdict("EXPORT_PRIMARY_KEYS").get(os.path.basename(args.csv_path))
+    if not keys:
+        ap.error(f"主キーが決まりません（--key を指定してください）: {args.csv_path}")
+
+    index = KeyIndex(args.csv_path, keys, settings.get("FEED_EXPORT_ENCODING", "utf-8"))
+    try:
+        index.rebuild()
+        before = index.rows
+        removed = compact(index)
+        print(f"[COMPACT] {args.csv_path}: {before} → {before - removed} rows（{removed} 行削除）")
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
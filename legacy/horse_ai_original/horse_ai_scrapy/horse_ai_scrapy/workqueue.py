@@ -0,0 +1,547 @@
+# horse_ai_scrapy/workqueue.py
+"""
+複数プロセス / 複数マシンで1つのID一覧を分け合うための作業キュー（貸し出し＝リース方式）
+
+- キュー名はスパイダー名（race_result_spider / race_info_spider / horse_info_spider）
+- ワーカーは claim() で ID をまとめて借りる（期限 WORK_QUEUE_LEASE_SECONDS 秒）
+  → 取れたら complete()。期限切れの貸し出しは次の claim() で自動的に未処理へ戻る
+  → WORK_QUEUE_MAX_ATTEMPTS 回借りても終わらない ID は failed にして配らない
+- 保存先は SQLite（WAL）。同じマシンのプロセス同士ならキューのファイルを共有するだけでよい
+- 出力（CSV・id_codes・特徴量・血統など）はワーカー毎に分ける: {OUTPUT_BASE_DIR}/workers/{ワーカー名}/
+  （use_worker_output()。CSV の追記・upsert の索引と圧縮・1プロセスだけが書くストアを他のワーカーと共有しない）
+  ログインのセッションと鮮度の取得記録は共有のまま。ワーカー名は既定で {ホスト名}-{番号}（再起動しても同じ）
+  → クロールが終わったら `merge` で {OUTPUT_BASE_DIR} の CSV・HTML 保存庫へまとめる（merge_worker_outputs()）
+- 別マシンからは `serve` で立てた HTTP の窓口（既定 127.0.0.1:8765）を使う（中身は同じ SQLite）
+
+スパイダーからは -a queue=<sqlite のパス | http://host:port>（または WORK_QUEUE）で使う。
+spider.progress に QueueProgress が入り、CsvExportPipeline のチェックポイントで CSV を書き切ってから complete() する。
+
+使い方（scrapy.cfg のあるディレクトリで）:
+    python -m horse_ai_scrapy.workqueue add race_result_spider data/race_id_list.csv
+    python -m horse_ai_scrapy.workqueue stats race_result_spider
+    python -m horse_ai_scrapy.workqueue serve --port 8765
+    python -m horse_ai_scrapy.workqueue merge
+    scrapy crawl race_result_spider -a queue=data/.queue.sqlite3
+    scrapy crawl race_result_spider -a queue=http://192.168.0.10:8765
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scrapy import signals
+
+logger = logging.getLogger(__name__)
+
+# 状態
+PENDING, LEASED, DONE, FAILED = 0, 1, 2, 3
+STATE_NAMES = {PENDING: "pending", LEASED: "leased", DONE: "done", FAILED: "failed"}
+
+
+class WorkQueue:
+    """
+    SQLite の作業キュー
+    - add(queue, ids)                              : 未登録の ID だけ追加（順序は追加順）
+    - claim(queue, worker, n, lease_seconds)       : 期限切れを戻してから、未処理を最大 n 件貸し出す
+    - complete / release / renew(queue, worker, ids) : 完了 / 返却 / 期限延長
+    - stats(queue)                                 : 状態毎の件数とワーカー毎の処理速度
+    """
+    def __init__(self, path: str, max_attempts: int = 5):
+        self.path = path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # トランザクションは自前で張る（BEGIN IMMEDIATE で他プロセスの claim と直列化）
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " queue TEXT NOT NULL, entity_id TEXT NOT NULL, state INTEGER NOT NULL DEFAULT 0,"
+            " worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, done_at REAL,"
+            " PRIMARY KEY (queue, entity_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_items_state ON items (queue, state)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS workers ("
+            " queue TEXT NOT NULL, worker TEXT NOT NULL, claimed INTEGER NOT NULL DEFAULT 0,"
+            " done INTEGER NOT NULL DEFAULT 0, first_seen REAL NOT NULL, last_seen REAL NOT NULL,"
+            " PRIMARY KEY (queue, worker))"
+        )
+
+    def _tx(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def _touch(self, conn, queue: str, worker: str, claimed: int = 0, done: int = 0) -> None:
+        now = time.time()
+        conn.execute(
+            "INSERT INTO workers (queue, worker, claimed, done, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (queue, worker) DO UPDATE SET claimed = claimed + excluded.claimed,"
+            " done = done + excluded.done, last_seen = excluded.last_seen",
+            (queue, worker, claimed, done, now, now),
+        )
+
+    def add(self, queue: str, ids) -> int:
+        rows = [(queue, str(i)) for i in ids]
+
+        def fn(conn):
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO items (queue, entity_id) VALUES (?, ?)", rows)
+            return conn.total_changes - before
+        return self._tx(fn)
+
+    def claim(self, queue: str, worker: str, n: int, lease_seconds: float) -> list[str]:
+        def fn(conn):
+            now = time.time()
+            # 期限切れ → 未処理へ（借りた回数が上限なら failed）
+            conn.execute(
+                "UPDATE items SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, worker = NULL, lease_until = NULL"
+                " WHERE queue = ? AND state = ? AND lease_until < ?",
+                (self.max_attempts, FAILED, PENDING, queue, LEASED, now),
+            )
+            ids = [r[0] for r in conn.execute(
+                "SELECT entity_id FROM items WHERE queue = ? AND state = ? ORDER BY rowid LIMIT ?",
+                (queue, PENDING, n),
+            )]
+            conn.executemany(
+                "UPDATE items SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1"
+                " WHERE queue = ? AND entity_id = ?",
+                [(LEASED, worker, now + lease_seconds, queue, i) for i in ids],
+            )
+            self._touch(conn, queue, worker, claimed=len(ids))
+            return ids
+        return self._tx(fn)
+
+    def complete(self, queue: str, worker: str, ids) -> int:
+        """完了にする（期限切れで他へ回った後でも、取れたものは完了扱い）"""
+        def fn(conn):
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE items SET state = ?, worker = ?, lease_until = NULL, done_at = ?"
+                " WHERE queue = ? AND entity_id = ? AND state != ?",
+                [(DONE, worker, time.time(), queue, i, DONE) for i in ids],
+            )
+            done = conn.total_changes - before
+            self._touch(conn, queue, worker, done=done)
+            return done
+        return self._tx(fn)
+
+    def release(self, queue: str, worker: str, ids) -> int:
+        """借りたまま終わらなかった分を未処理へ戻す（次の claim ですぐ配られる）"""
+        def fn(conn):
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE items SET state = ?, worker = NULL, lease_until = NULL"
+                " WHERE queue = ? AND entity_id = ? AND state = ? AND worker = ?",
+                [(PENDING, queue, i, LEASED, worker) for i in ids],
+            )
+            return conn.total_changes - before
+        return self._tx(fn)
+
+    def renew(self, queue: str, worker: str, ids, lease_seconds: float) -> int:
+        def fn(conn):
+            before = conn.total_changes
+            until = time.time() + lease_seconds
+            conn.executemany(
+                "UPDATE items SET lease_until = ? WHERE queue = ? AND entity_id = ? AND state = ? AND worker = ?",
+                [(until, queue, i, LEASED, worker) for i in ids],
+            )
+            self._touch(conn, queue, worker)
+            return conn.total_changes - before
+        return self._tx(fn)
+
+    def stats(self, queue: str) -> dict:
+        with self._lock:
+            counts = {name: 0 for name in STATE_NAMES.values()}
+            for state, n in self._conn.execute("SELECT state, COUNT(*) FROM items WHERE queue = ? GROUP BY state", (queue,)):
+                counts[STATE_NAMES.get(state, str(state))] = n
+            workers = []
+            for worker, claimed, done, first, last in self._conn.execute(
+                "SELECT worker, claimed, done, first_seen, last_seen FROM workers WHERE queue = ? ORDER BY worker", (queue,)
+            ):
+                minutes = max(last - first, 1.0) / 60
+                workers.append({"worker": worker, "claimed": claimed, "done": done,
+                                "per_min": round(done / minutes, 2), "last_seen": last})
+        return {**counts, "workers": workers}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class HttpWorkQueue:
+    """serve で立てた窓口へ同じ操作を JSON で投げるクライアント（WorkQueue と同じ呼び方）"""
+    def __init__(self, url: str, timeout: float = 30.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def _call(self, method: str, **params):
+        req = urllib.request.Request(
+            f"{self.url}/{method}", data=json.dumps(params).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))["result"]
+
+    def add(self, queue, ids):
+        return self._call("add", queue=queue, ids=list(ids))
+
+    def claim(self, queue, worker, n, lease_seconds):
+        return self._call("claim", queue=queue, worker=worker, n=n, lease_seconds=lease_seconds)
+
+    def complete(self, queue, worker, ids):
+        return self._call("complete", queue=queue, worker=worker, ids=list(ids))
+
+    def release(self, queue, worker, ids):
+        return self._call("release", queue=queue, worker=worker, ids=list(ids))
+
+    def renew(self, queue, worker, ids, lease_seconds):
+        return self._call("renew", queue=queue, worker=worker, ids=list(ids), lease_seconds=lease_seconds)
+
+    def stats(self, queue):
+        return self._call("stats", queue=queue)
+
+    def close(self) -> None:
+        pass
+
+
+_HTTP_METHODS = ("add", "claim", "complete", "release", "renew", "stats")
+
+
+def serve(queue: WorkQueue, host: str = "127.0.0.1", port: int = 8765) -> None:
+    """WorkQueue を HTTP（POST /<method>、本文は JSON の引数）で公開する"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            method = self.path.strip("/")
+            if method not in _HTTP_METHODS:
+                self.send_error(404)
+                return
+            try:
+                params = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                body = json.dumps({"result": getattr(queue, method)(**params)}).encode("utf-8")
+            except (TypeError, ValueError) as e:
+                self.send_error(400, str(e))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            logger.debug(fmt, *args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    logger.info(f"[QUEUE] serving {queue.path} on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def open_work_queue(target: str, max_attempts: int = 5):
+    """'http://…' なら HttpWorkQueue、それ以外は SQLite のパスとして WorkQueue"""
+    if target.startswith(("http://", "https://")):
+        return HttpWorkQueue(target)
+    return WorkQueue(target, max_attempts=max_attempts)
+
+
+class QueueProgress:
+    """
+    作業キューを spider.progress として使うための窓口（CrawlProgressStore と同じ呼び方）
+    - iter_ids() で WORK_QUEUE_BATCH_SIZE 件ずつ借りて1件ずつ返す（Scrapy が start() を読み進める分だけ借りる）
+      借りる物が無くても他のワーカーの貸し出しが残っていれば、期限切れで戻るのを待つ（自分の分は延長しながら）
+    - mark_done() は溜めるだけ。commit()（CSV のチェックポイント）で complete()、ついでに残りの期限を延長
+      （take_pending() で区切った分だけを commit(ids) することもできる）
+    - close() で終わらなかった分を返却
+    """
+    def __init__(self, queue, name: str, worker: str, batch_size: int = 20,
+                 lease_seconds: float = 900.0, poll_interval: float = 30.0):
+        self.queue = queue
+        self.name = name
+        self.worker = worker
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._pending: list[str] = []
+        # 借りていてまだ complete していない ID
+        self._leased: set[str] = set()
+        self._renewed_at = time.monotonic()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def mark_done(self, entity_id: str) -> None:
+        self._pending.append(entity_id)
+
+    def take_pending(self) -> list[str]:
+        ids, self._pending = self._pending, []
+        return ids
+
+    def commit(self, ids: list[str] | None = None) -> None:
+        if ids is None:
+            ids = self.take_pending()
+        if ids:
+            self.queue.complete(self.name, self.worker, ids)
+            self._leased.difference_update(ids)
+        if self._leased and time.monotonic() - self._renewed_at >= self.lease_seconds / 2:
+            self.queue.renew(self.name, self.worker, sorted(self._leased), self.lease_seconds)
+            self._renewed_at = time.monotonic()
+
+    async def iter_ids(self):
+        from twisted.internet import reactor
+        from twisted.internet.task import deferLater
+        from twisted.internet.threads import deferToThread
+        from scrapy.utils.defer import maybe_deferred_to_future
+
+        while True:
+            ids = await maybe_deferred_to_future(deferToThread(
+                self.queue.claim, self.name, self.worker, self.batch_size, self.lease_seconds
+            ))
+            if ids:
+                if not self._leased:
+                    self._renewed_at = time.monotonic()
+                self._leased.update(ids)
+                for i in ids:
+                    yield i
+                continue
+            # 自分の貸し出し分（処理中・未 commit）は待たない。他のワーカーの分が残っていれば期限切れを待つ
+            stats = await maybe_deferred_to_future(deferToThread(self.queue.stats, self.name))
+            others = stats["leased"] - len(self._leased)
+            if others <= 0:
+                return
+            logger.info(f"[QUEUE] {self.name}: 未処理なし / 他ワーカーの貸し出し中 {others}件 → {self.poll_interval:.0f}秒待つ")
+            if self._leased:
+                await maybe_deferred_to_future(deferToThread(
+                    self.queue.renew, self.name, self.worker, sorted(self._leased), self.lease_seconds
+                ))
+                self._renewed_at = time.monotonic()
+            await maybe_deferred_to_future(deferLater(reactor, self.poll_interval, lambda: None))
+
+    def close(self) -> None:
+        try:
+            self.commit()
+            if self._leased:
+                self.queue.release(self.name, self.worker, sorted(self._leased))
+            stats = self.queue.stats(self.name)
+            me = next((w for w in stats["workers"] if w["worker"] == self.worker), {})
+            logger.warning(
+                f"[QUEUE] {self.name}: pending={stats['pending']} leased={stats['leased']} done={stats['done']}"
+                f" failed={stats['failed']} / {self.worker}: done={me.get('done', 0)} ({me.get('per_min', 0)}/分)"
+            )
+        finally:
+            self.queue.close()
+
+
+def default_worker_name(settings) -> str:
+    return settings.get("WORK_QUEUE_WORKER") or f"{socket.gethostname()}-{os.getpid()}"
+
+
+# 1プロセスだけが書くストアの置き場所（指定されているとワーカー間で共有になる）
+SINGLE_WRITER_DIRS = ("ID_CODES_DIR", "FEATURE_STORE_DIR", "PEDIGREE_DIR")
+# 出力先 → 掴んでいるロックファイル（プロセスが終わるまで持つ）
+_WORKER_LOCKS: dict[str, object] = {}
+
+
+def _try_lock(path: str):
+    """排他ロックを取れたらファイルを返す（他のプロセスが持っていれば None）"""
+    f = open(path, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def use_worker_output(settings, target: str | None = None) -> str | None:
+    """
+    作業キューを使う（-a queue=… / WORK_QUEUE）なら OUTPUT_BASE_DIR をワーカー毎の
+    {OUTPUT_BASE_DIR}/workers/{ワーカー名} に差し替えて、そのパスを返す（使わないなら None）
+    - spider の from_crawler（設定が固まる前）で呼ぶ。pipeline・middleware は差し替え後の出力先を使う
+    - ログインのセッション・鮮度の取得記録はワーカー間で共有するので、差し替える前の場所に固定する
+    - ワーカー名は WORK_QUEUE_WORKER、無ければ {ホスト名}-{番号} の空いている最小の番号
+      （再起動しても同じ場所に追記する。同じマシンで同時に動かすワーカーは別の番号になる）
+    - 出力先は排他ロック（.worker.lock）で1プロセスに限る。WORK_QUEUE_WORKER の出力先が使用中なら ValueError
+    - SINGLE_WRITER_DIRS を明示していると共有になるので ValueError
+    - 出力はワーカー毎に溜まるので、merge_worker_outputs()（`merge` コマンド）で元の OUTPUT_BASE_DIR へまとめる
+    """
+    from .freshness import fetch_log_path
+    from .session import session_path
+
+    target = target or settings.get("WORK_QUEUE")
+    if not target:
+        return None
+    shared = [name for name in SINGLE_WRITER_DIRS if settings.get(name)]
+    if shared:
+        raise ValueError(f"作業キューではワーカー毎の出力先を使うので {', '.join(shared)} は指定できません")
+
+    base = settings.get("OUTPUT_BASE_DIR", "data")
+    for name, path in (("SESSION_PATH", session_path(settings)), ("FRESHNESS_LOG_PATH", fetch_log_path(settings))):
+        settings.set(name, path, priority="cmdline")
+
+    named = settings.get("WORK_QUEUE_WORKER")
+    candidates = [named] if named else (f"{socket.gethostname()}-{n}" for n in itertools.count(1))
+    for worker in candidates:
+        out_dir = os.path.join(base, "workers", worker)
+        key = os.path.abspath(out_dir)
+        if key in _WORKER_LOCKS:
+            break
+        os.makedirs(out_dir, exist_ok=True)
+        lock = _try_lock(os.path.join(out_dir, ".worker.lock"))
+        if lock is not None:
+            _WORKER_LOCKS[key] = lock
+            break
+        if named:
+            raise ValueError(f"{out_dir} は他のワーカーが使用中です（WORK_QUEUE_WORKER をワーカー毎に変えてください）")
+    settings.set("WORK_QUEUE_WORKER", worker, priority="cmdline")
+    settings.set("OUTPUT_BASE_DIR", out_dir, priority="cmdline")
+    return out_dir
+
+
+def merge_worker_outputs(settings) -> dict[str, int]:
+    """
+    {OUTPUT_BASE_DIR}/workers/*/ の CSV と HTML 保存庫を {OUTPUT_BASE_DIR} へまとめる（動いているワーカーは飛ばす）
+    - CSV は EXPORT_PRIMARY_KEYS で upsert（同じ行は書かない）→ 何度実行しても増えない
+    - 保存庫は同じエンティティなら新しく取った方（replay は {OUTPUT_BASE_DIR}/archive から作り直せる）
+    - Parquet / SQLite / 特徴量 / id_codes はワーカー毎のまま（id_codes のコードはワーカー毎に違う）。
+      まとめた CSV から作り直す（例: python -m horse_ai_scrapy.processing.features rebuild）
+    戻り値: ファイル名 → 読んだ行数（保存庫は "archive"）
+    """
+    from .archive import HtmlArchive
+    from .pipelines import _CsvFiles
+
+    base = settings.get("OUTPUT_BASE_DIR", "data")
+    encoding = settings.get("FEED_EXPORT_ENCODING", "utf-8")
+    # まとめる時は EXPORT_UPSERT に関係なく主キーで重ねない（何度実行しても同じ結果にする）
+    primary_keys = settings.getdict("EXPORT_PRIMARY_KEYS")
+    archive_root = settings.get("HTML_ARCHIVE_DIR") or os.path.join(base, "archive")
+    workers_dir = os.path.join(base, "workers")
+    counts: dict[str, int] = {}
+    for worker in sorted(os.listdir(workers_dir)) if os.path.isdir(workers_dir) else []:
+        src = os.path.join(workers_dir, worker)
+        lock = _try_lock(os.path.join(src, ".worker.lock")) if os.path.isdir(src) else None
+        if lock is None:
+            logger.warning(f"[MERGE] {src}: 使用中（またはフォルダではない）のため飛ばします")
+            continue
+        try:
+            files = _CsvFiles(base, overwrite=False, encoding=encoding, primary_keys=primary_keys)
+            try:
+                for name in sorted(os.listdir(src)):
+                    if not name.endswith(".csv"):
+                        continue
+                    with open(os.path.join(src, name), newline="", encoding=encoding) as f:
+                        reader = csv.DictReader(f)
+                        for chunk in iter(lambda: list(itertools.islice(reader, 10000)), []):
+                            files.write_rows(name, list(reader.fieldnames), chunk)
+                            counts[name] = counts.get(name, 0) + len(chunk)
+            finally:
+                files.close()
+            if os.path.exists(os.path.join(src, "archive", "index.sqlite3")):
+                archive = HtmlArchive(archive_root)
+                try:
+                    counts["archive"] = counts.get("archive", 0) + archive.merge_from(os.path.join(src, "archive"))
+                finally:
+                    archive.close()
+        finally:
+            lock.close()
+        logger.warning(f"[MERGE] {src} → {base}")
+    return counts
+
+
+def open_queue_progress(spider, target: str | None = None) -> QueueProgress | None:
+    """
+    -a queue=… / WORK_QUEUE があれば spider 用の QueueProgress を開く（無ければ None → 従来の ID CSV）
+    spider_closed で残りを complete・返却して閉じる
+    """
+    settings = spider.settings
+    target = target or settings.get("WORK_QUEUE")
+    if not target:
+        return None
+    progress = QueueProgress(
+        open_work_queue(target, max_attempts=settings.getint("WORK_QUEUE_MAX_ATTEMPTS", 5)),
+        spider.name,
+        default_worker_name(settings),
+        batch_size=settings.getint("WORK_QUEUE_BATCH_SIZE", 20),
+        lease_seconds=settings.getfloat("WORK_QUEUE_LEASE_SECONDS", 900.0),
+        poll_interval=settings.getfloat("WORK_QUEUE_POLL_INTERVAL", 30.0),
+    )
+    spider.crawler.signals.connect(lambda: progress.close(), signal=signals.spider_closed, weak=False)
+    logger.info(f"[QUEUE] {spider.name}: {target} / worker={progress.worker}")
+    return progress
+
+
+def _read_ids(csv_path: str) -> list[str]:
+    """1列目の数字だけの値（ヘッダや空行は飛ばす）"""
+    ids = []
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.reader(f):
+            s = (row[0] if row else "").strip().lstrip("\ufeff")
+            if s.isdigit():
+                ids.append(s)
+    return list(dict.fromkeys(ids))
+
+
+def main():
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    default = settings.get("WORK_QUEUE") or os.path.join(settings.get("OUTPUT_BASE_DIR", "data"), ".queue.sqlite3")
+    ap = argparse.ArgumentParser(description="スパイダー間で ID を分け合う作業キュー")
+    ap.add_argument("--queue", default=default, help="SQLite のパス か http://host:port（既定: WORK_QUEUE）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    ad = sub.add_parser("add", help="ID CSV（1列目）を登録（登録済みは無視）")
+    ad.add_argument("name", help="キュー名（スパイダー名）")
+    ad.add_argument("csv_path")
+    st = sub.add_parser("stats", help="件数とワーカー毎の処理速度")
+    st.add_argument("name")
+    sv = sub.add_parser("serve", help="SQLite のキューを HTTP で公開")
+    sv.add_argument("--host", default="127.0.0.1")
+    sv.add_argument("--port", type=int, default=8765)
+    sub.add_parser("merge", help="ワーカー毎の出力（workers/*/ の CSV・HTML 保存庫）を OUTPUT_BASE_DIR へまとめる")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.cmd == "merge":
+        for name, n in sorted(merge_worker_outputs(settings).items()):
+            print(f"[MERGE] {name}: {n}")
+        return
+    queue = open_work_queue(args.queue, max_attempts=settings.getint("WORK_QUEUE_MAX_ATTEMPTS", 5))
+    try:
+        if args.cmd == "add":
+            ids = _read_ids(args.csv_path)
+            print(f"[QUEUE] {args.name}: +{queue.add(args.name, ids)} / {len(ids)}")
+        elif args.cmd == "stats":
+            print(json.dumps(queue.stats(args.name), ensure_ascii=False, indent=2))
+        else:
+            if not isinstance(queue, WorkQueue):
+                ap.error("serve には SQLite のパスを指定してください")
+            serve(queue, args.host, args.port)
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
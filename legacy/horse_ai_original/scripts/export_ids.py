@@ -3,17 +3,37 @@
 race_result.csv から horse_id / jockey_id / trainer_id の
 ユニーク値を抽出して 1列CSV を3つ出力します。
 出力先は入力CSVと同じフォルダになります。
+
+  - horse_id.csv 等        : これまでの全ID（ソート済み）
+  - horse_id_new.csv 等    : 前回の出力に無かったIDだけ（次の horse/jockey/trainer 取得の入力用）
+  - .export_ids_state.json : 前回どこまで読んだか（バイト位置＋直前の内容の指紋）
+
+2回目以降は前回の続き（追記された末尾）だけを読みます。
+入力が書き直されていた（upsert の圧縮等）場合や --full 指定時は全体を読み直し、
+そのときはファイルを行境界で分割してプロセス並列で読みます。
+※ race_result.csv はセル内改行が無い前提（行境界＝レコード境界）
 """
 
 import csv
+import hashlib
+import heapq
+import json
 import os
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
 # --- ここを追加：スクリプト場所から既定入力パスを作る ---
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJ_ROOT  = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
 DEFAULT_INPUT = os.path.join(PROJ_ROOT, "horse_ai_scrapy", "data", "race_result.csv")
 
+STATE_FILE = ".export_ids_state.json"
+OUTPUTS = [("horse_id.csv", "horse_id"), ("jockey_id.csv", "jockey_id"), ("trainer_id.csv", "trainer_id")]
+# 続きを読む前に「前回読んだ末尾」が変わっていないか確かめるバイト数
+FINGERPRINT_BYTES = 4096
+# 並列で読むときの1区間の最小サイズ（これより小さいファイルは1プロセスで読む）
+MIN_CHUNK_BYTES = 8 * 1024 * 1024
+
 def detect_idx(header: list[str]) -> tuple[int, int, int]:
     """ヘッダ行から列位置を推定（0始まり）。"""
     name_to_idx = {name: i for i, name in enumerate(header)}
@@ -29,48 +49,162 @@ def detect_idx(header: list[str]) -> tuple[int, int, int]:
     trainer_idx = find(["trainer_id"], 6)               # 7項目目
     return horse_idx, jockey_idx, trainer_idx
 
+def _id_key(values):
+    return (lambda x: int(x)) if all(v.isdigit() for v in values) else None
+
 def sort_keys(values: set[str]) -> list[str]:
     if not values:
         return []
-    all_digit = all(v.isdigit() for v in values)
-    return sorted(values, key=(lambda x: int(x)) if all_digit else None)
+    return sorted(values, key=_id_key(values))
 
-def export_unique_ids(in_path: str, write_header: bool = True) -> None:
-    out_base = os.path.dirname(os.path.abspath(in_path)) or "."
+def merge_sorted(old: list[str], new: set[str]) -> list[str]:
+    """ソート済みの前回分に今回の新規分を差し込む（全体を並べ直さない）"""
+    if not new:
+        return old
+    key = _id_key(new) if all(v.isdigit() for v in old) else None
+    return list(heapq.merge(old, sorted(new, key=key), key=key))
+
+# ---------- 読み取り ----------
+def read_header(in_path: str) -> tuple[list[str], int]:
+    """ヘッダ行とデータ先頭のバイト位置"""
+    with open(in_path, "rb") as f:
+        line = f.readline()
+    header = next(csv.reader([line.decode("utf-8-sig")]), None)
+    if header is None:
+        raise RuntimeError("空のCSVです: " + in_path)
+    return header, len(line)
+
+def scan_range(args) -> tuple[set[str], set[str], set[str]]:
+    """[start, end) に先頭がある行だけを読む（start が行の途中なら次の行から）"""
+    in_path, start, end, idx = args
+    h_idx, j_idx, t_idx = idx
+    max_idx = max(idx)
     horses, jockeys, trainers = set(), set(), set()
 
-    with open(in_path, newline="", encoding="utf-8-sig") as f:
-        reader = csv.reader(f)
-        header = next(reader, None)
-        if header is None:
-            raise RuntimeError("空のCSVです: " + in_path)
-
-        h_idx, j_idx, t_idx = detect_idx(header)
-        max_idx = max(h_idx, j_idx, t_idx)
-
-        for row in reader:
-            if not row or len(row) <= max_idx:
-                continue
-            horse_id   = row[h_idx].strip()
-            jockey_id  = row[j_idx].strip()
-            trainer_id = row[t_idx].strip()
-            if horse_id:   horses.add(horse_id)
-            if jockey_id:  jockeys.add(jockey_id)
-            if trainer_id: trainers.add(trainer_id)
-
-    files = [
-        ("horse_id.csv",   "horse_id",   sort_keys(horses)),
-        ("jockey_id.csv",  "jockey_id",  sort_keys(jockeys)),
-        ("trainer_id.csv", "trainer_id", sort_keys(trainers)),
-    ]
-    for fname, header_name, values in files:
+    with open(in_path, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            if f.read(1) != b"\n":
+                f.readline()
+        lines = []
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            lines.append(line.decode("utf-8"))
+
+    for row in csv.reader(lines):
+        if not row or len(row) <= max_idx:
+            continue
+        horse_id   = row[h_idx].strip()
+        jockey_id  = row[j_idx].strip()
+        trainer_id = row[t_idx].strip()
+        if horse_id:   horses.add(horse_id)
+        if jockey_id:  jockeys.add(jockey_id)
+        if trainer_id: trainers.add(trainer_id)
+    return horses, jockeys, trainers
+
+def scan(in_path: str, start: int, end: int, idx: tuple[int, int, int], jobs: int) -> list[set[str]]:
+    """[start, end) を行境界で区切って並列に読み、結果を合わせる"""
+    if end <= start:
+        # 前回から追記が無い
+        return [set(), set(), set()]
+    n = max(1, min(jobs, (end - start) // MIN_CHUNK_BYTES))
+    step = -(-(end - start) // n)
+    ranges = [(in_path, s, min(s + step, end), idx) for s in range(start, end, step)]
+    if len(ranges) <= 1:
+        parts = [scan_range(r) for r in ranges]
+    else:
+        with ProcessPoolExecutor(max_workers=len(ranges)) as ex:
+            parts = list(ex.map(scan_range, ranges))
+
+    merged = [set(), set(), set()]
+    for part in parts:
+        for acc, s in zip(merged, part):
+            acc |= s
+    return merged
+
+def fingerprint(in_path: str, offset: int) -> str:
+    with open(in_path, "rb") as f:
+        f.seek(max(0, offset - FINGERPRINT_BYTES))
+        return hashlib.sha1(f.read(offset - f.tell())).hexdigest()
+
+# ---------- 前回の状態 ----------
+def load_state(out_base: str, in_path: str, header: list[str]) -> dict | None:
+    """続きから読めるなら前回の状態を返す（入力が書き直されていれば None）"""
+    path = os.path.join(out_base, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        state = json.load(f)
+    size = os.path.getsize(in_path)
+    if (state.get("input") != os.path.abspath(in_path) or state.get("header") != header
+            or state.get("offset", 0) > size or fingerprint(in_path, state["offset"]) != state.get("fingerprint")):
+        return None
+    return state
+
+def save_state(out_base: str, in_path: str, header: list[str], offset: int) -> None:
+    path = os.path.join(out_base, STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"input": os.path.abspath(in_path), "header": header, "offset": offset,
+                   "fingerprint": fingerprint(in_path, offset)}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def read_ids(path: str, header_name: str) -> list[str]:
+    """前回出力した1列CSV（ソート済み）"""
+    if not os.path.exists(path):
+        return []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        values = [row[0].strip() for row in csv.reader(f) if row and row[0].strip()]
+    # ヘッダ付き（--no-header 無し）の場合
+    if values and values[0] == header_name:
+        values = values[1:]
+    return values
+
+def write_ids(out_path: str, header_name: str, values, write_header: bool) -> None:
+    tmp = out_path + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as wf:
+        if write_header:
+            wf.write(header_name + "\n")
+        for v in values:
+            wf.write(v + "\n")
+    os.replace(tmp, out_path)
+
+def export_unique_ids(in_path: str, write_header: bool = True, full: bool = False, jobs: int | None = None) -> None:
+    out_base = os.path.dirname(os.path.abspath(in_path)) or "."
+    header, data_start = read_header(in_path)
+    idx = detect_idx(header)
+    # 読んでいる間に追記されても、今回はこの位置までを扱う（続きは次回）
+    with open(in_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        # 行の途中で止まらないよう、最後の改行まで
+        f.seek(max(data_start, end - 65536))
+        tail = f.read(end - f.tell())
+        end = end - len(tail) + tail.rfind(b"\n") + 1 if b"\n" in tail else data_start
+
+    state = None if full else load_state(out_base, in_path, header)
+    start = state["offset"] if state else data_start
+    mode = "incremental" if state else "full"
+    print(f"[INFO] mode = {mode}, bytes = {start}..{end}")
+
+    found = scan(in_path, start, end, idx, jobs or os.cpu_count() or 1)
+
+    for (fname, header_name), ids in zip(OUTPUTS, found):
         out_path = os.path.join(out_base, fname)
-        with open(out_path, "w", newline="", encoding="utf-8") as wf:
-            if write_header:
-                wf.write(header_name + "\n")
-            for v in values:
-                wf.write(v + "\n")
-        print(f"Wrote {out_path} ({len(values)}件)")
+        previous = read_ids(out_path, header_name)
+        new = ids.difference(previous)
+        # 続きだけ読んだ時は前回分に差し込む。全体を読んだ時は今回の結果がそのまま全ID
+        values = merge_sorted(previous, new) if state else sort_keys(ids)
+        write_ids(out_path, header_name, values, write_header)
+
+        stem, ext = os.path.splitext(fname)
+        new_path = os.path.join(out_base, f"{stem}_new{ext}")
+        write_ids(new_path, header_name, sort_keys(new), write_header)
+        print(f"Wrote {out_path} ({len(values)}件) / {new_path} (新規 {len(new)}件)")
+
+    save_state(out_base, in_path, header, end)
 
 def main():
     ap = argparse.ArgumentParser(description="race_result.csv からユニークID一覧を出力します。")
@@ -81,10 +215,12 @@ def main():
         help=f"入力CSVのパス（既定: {DEFAULT_INPUT}）",
     )
     ap.add_argument("--no-header", action="store_true", help="出力CSVにヘッダ行を付けない")
+    ap.add_argument("--full", action="store_true", help="前回の位置を使わず全体を読み直す")
+    ap.add_argument("--jobs", type=int, default=None, help="全体を読むときの並列プロセス数（既定: CPUコア数）")
     args = ap.parse_args()
 
     print(f"[INFO] input = {os.path.abspath(args.input_csv)}")
-    export_unique_ids(args.input_csv, write_header=not args.no_header)
+    export_unique_ids(args.input_csv, write_header=not args.no_header, full=args.full, jobs=args.jobs)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# scrapy プロジェクト（horse_ai_scrapy パッケージ）と scripts/ を import できるようにする
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "horse_ai_scrapy"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
@@ -0,0 +1,47 @@
+from scrapy import Request
+from scrapy.utils.test import get_crawler
+
+from horse_ai_scrapy.adaptive_rate import AdaptiveRateMiddleware
+from horse_ai_scrapy.freshness import NotModified
+
+HOST = "db.netkeiba.com"
+
+
+def _middleware():
+    crawler = get_crawler(settings_dict={
+        "ADAPTIVE_RATE_ENABLED": True,
+        "ADAPTIVE_RATE_MIN_DELAY": 2.0,
+        "ADAPTIVE_RATE_START_DELAY": 2.0,
+        "ADAPTIVE_RATE_MAX_DELAY": 10.0,
+    })
+    mw = AdaptiveRateMiddleware(crawler)
+    # エンジン無しで動かす（スロットは無し）
+    mw._slot = lambda request: (HOST, None)
+    return mw
+
+
+def test_freshness_skips_leave_delay_unchanged():
+    mw = _middleware()
+    request = Request(f"https://{HOST}/horse/2019104567/")
+    before = mw._state(HOST).delay
+    for _ in range(10):
+        mw.process_exception(request, NotModified("horse 2019104567: 取得済み"), None)
+    state = mw.hosts[HOST]
+    assert state.delay == before
+    assert state.error_rate == 0.0
+    assert state.errors == 0
+
+
+def test_download_errors_still_back_off():
+    mw = _middleware()
+    request = Request(f"https://{HOST}/horse/2019104567/")
+    before = mw._state(HOST).delay
+    mw.process_exception(request, TimeoutError(), None)
+    assert mw.hosts[HOST].delay > before
+    assert mw.hosts[HOST].errors == 1
+
+
+def test_min_delay_defaults_to_download_delay():
+    crawler = get_crawler(settings_dict={"ADAPTIVE_RATE_ENABLED": True, "DOWNLOAD_DELAY": 2.0})
+    mw = AdaptiveRateMiddleware(crawler)
+    assert mw.defaults["min_delay"] >= 2.0
@@ -0,0 +1,48 @@
+import csv
+
+from horse_ai_scrapy.pipelines import _CsvFiles
+
+KEYS = {"race_result.csv": ["race_id", "horse_id"]}
+
+
+def _read(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_new_column_rewrites_header(tmp_path):
+    files = _CsvFiles(str(tmp_path), overwrite=False, encoding="utf-8", primary_keys=KEYS)
+    files.write_rows("race_result.csv", ["race_id", "horse_id", "time"],
+                     [{"race_id": "202405010101", "horse_id": "2021100001", "time": "1:34.5"}])
+    files.close()
+
+    # 次の実行で列が増えた（finish_position）
+    fieldnames = ["race_id", "horse_id", "finish_position", "time"]
+    files = _CsvFiles(str(tmp_path), overwrite=False, encoding="utf-8", primary_keys=KEYS)
+    files.write_rows("race_result.csv", fieldnames, [
+        {"race_id": "202405010101", "horse_id": "2021100002", "finish_position": "2", "time": "1:34.7"},
+    ])
+    files.close()
+
+    rows = _read(tmp_path / "race_result.csv")
+    assert rows[0] == ["race_id", "horse_id", "time", "finish_position"]
+    assert rows[1] == ["202405010101", "2021100001", "1:34.5", ""]
+    assert rows[2] == ["202405010101", "2021100002", "1:34.7", "2"]
+
+
+def test_index_follows_rewritten_header(tmp_path):
+    row = {"race_id": "202405010101", "horse_id": "2021100001", "time": "1:34.5"}
+    files = _CsvFiles(str(tmp_path), overwrite=False, encoding="utf-8", primary_keys=KEYS)
+    files.write_rows("race_result.csv", ["race_id", "horse_id", "time"], [row])
+    files.close()
+
+    # 増えた列が空のままの同じ行は書かない。値が入れば更新として追記
+    fieldnames = ["race_id", "horse_id", "time", "finish_position"]
+    files = _CsvFiles(str(tmp_path), overwrite=False, encoding="utf-8", primary_keys=KEYS)
+    files.write_rows("race_result.csv", fieldnames, [{**row, "finish_position": ""}])
+    files.write_rows("race_result.csv", fieldnames, [{**row, "finish_position": "1"}])
+    files.close()
+
+    rows = _read(tmp_path / "race_result.csv")
+    assert len(rows) == 3
+    assert rows[2][-1] == "1"
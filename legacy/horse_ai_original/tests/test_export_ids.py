@@ -0,0 +1,45 @@
+import os
+
+from export_ids import OUTPUTS, detect_idx, export_unique_ids, read_ids, scan
+
+HEADER = "race_id,horse_name,horse_url,horse_id,jockey_name,jockey_id,trainer_id\n"
+
+
+def _outputs(out_dir, suffix=""):
+    return [read_ids(os.path.join(out_dir, f"{os.path.splitext(fname)[0]}{suffix}.csv"), name)
+            for fname, name in OUTPUTS]
+
+
+def test_full_then_incremental(tmp_path):
+    in_path = str(tmp_path / "race_result.csv")
+    with open(in_path, "w", encoding="utf-8", newline="") as f:
+        f.write(HEADER + "202401010101,A,,2019100001,a,01001,01101\n")
+
+    export_unique_ids(in_path, jobs=2)
+    assert _outputs(tmp_path) == [["2019100001"], ["01001"], ["01101"]]
+
+    # 追記なし（前回の位置 = 末尾）→ 新規は空、全IDはそのまま
+    assert scan(in_path, 10, 10, detect_idx(HEADER.strip().split(",")), 4) == [set(), set(), set()]
+    export_unique_ids(in_path, jobs=2)
+    assert _outputs(tmp_path) == [["2019100001"], ["01001"], ["01101"]]
+    assert _outputs(tmp_path, "_new") == [[], [], []]
+
+    # 追記あり → 続きだけ読む
+    with open(in_path, "a", encoding="utf-8", newline="") as f:
+        f.write("202401010102,B,,2019100002,a,01001,01102\n")
+    export_unique_ids(in_path, jobs=2)
+    assert _outputs(tmp_path) == [["2019100001", "2019100002"], ["01001"], ["01101", "01102"]]
+    assert _outputs(tmp_path, "_new") == [["2019100002"], [], ["01102"]]
+
+
+def test_rewritten_input_is_read_in_full(tmp_path):
+    in_path = str(tmp_path / "race_result.csv")
+    with open(in_path, "w", encoding="utf-8", newline="") as f:
+        f.write(HEADER + "202401010101,A,,2019100001,a,01001,01101\n")
+    export_unique_ids(in_path, jobs=2)
+
+    # 圧縮等で書き直された → 前回の位置は使わず全体から
+    with open(in_path, "w", encoding="utf-8", newline="") as f:
+        f.write(HEADER + "202401010103,C,,2019100003,c,01003,01103\n")
+    export_unique_ids(in_path, jobs=2)
+    assert _outputs(tmp_path) == [["2019100003"], ["01003"], ["01103"]]
@@ -0,0 +1,26 @@
+import time
+
+from horse_ai_scrapy.session import SessionStore
+
+ACCOUNT = "user@example.com"
+DAY = 86400
+
+
+def test_expiry_follows_auth_cookie_only(tmp_path):
+    now = time.time()
+    store = SessionStore(str(tmp_path / "netkeiba.json"), max_age=7 * DAY)
+    store.save(ACCOUNT, [
+        {"name": "nkauth", "value": "a", "expiry": int(now + 3 * DAY)},
+        # 計測用の短命な Cookie では切らない
+        {"name": "_gat", "value": "1", "expiry": int(now + 60)},
+    ])
+    assert store.load(ACCOUNT, now=now + 600) is not None
+    assert store.load(ACCOUNT, now=now + 4 * DAY) is None
+
+
+def test_expiry_capped_by_max_age(tmp_path):
+    now = time.time()
+    store = SessionStore(str(tmp_path / "netkeiba.json"), max_age=DAY)
+    store.save(ACCOUNT, [{"name": "nkauth", "value": "a", "expiry": int(now + 30 * DAY)}])
+    assert store.load(ACCOUNT, now=now + DAY / 2) is not None
+    assert store.load(ACCOUNT, now=now + 2 * DAY) is None